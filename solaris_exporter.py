@@ -31,9 +31,14 @@ This exporter provides info about:
   - Memory Usage, swap-in, swap-out (MemCollector);
   - Network Interfaces (NetworkCollector);
   - Node time, uptime (CurTimeCollector, UpTimeCollector);
-  - FC links Multipath (FCinfoCollector, /usr/sbin/mpathadm list lu)
+  - FC links Multipath (FCinfoCollector): path counts of LUs (/usr/sbin/mpathadm list lu), state of every path
+    (mpathadm show lu), state, speed and link error counters of HBA ports (/usr/sbin/fcinfo hba-port -l)
   - System Services health via 'svcs -x' command (SVCSCollector);
-  - Whole system health via 'fmadm faulty' (FmadmCollector), requires pfexec of '/usr/sbin/fmadm'.
+  - State of every SMF service (SMFStateCollector, solaris_exporter_smf_state and solaris_exporter_smf_services),
+    'svcs -a' runs only when SMF repository or restarter logs are changed;
+  - Whole system health via 'fmadm faulty' (FmadmCollector): open faults with class, FRU and severity
+    (solaris_exporter_fma_fault), ereports of 'fmdump -e' and 'fmstat' module statistics,
+    requires pfexec of '/usr/sbin/fmadm', '/usr/sbin/fmdump' and '/usr/sbin/fmstat'.
   - Zpool devices health via 'zpool status' command (ZpoolCollector)
   - Solaris Volume Manager disk status (MetaStatCollector, MetaDBCollector).
   - Get info from text files *.prom in folder provided by text_file_path var (TextFileCollector).
@@ -126,22 +131,136 @@ Installation. To use this exporter you need python2.7 or python3.x and its modul
 
 """
 import time
+# beginning of startup time breakdown of StartupDiscovery, after interpreter start
+module_start_time = time.time()
+import sys
 import re
 import subprocess
+import select
+import errno
+import heapq
+import zlib
+import copy
 import threading
 import socket
 import psutil
-from psutil import _psutil_sunos as cext
+try:
+    from psutil import _psutil_sunos as cext
+except ImportError:
+    # not Solaris, module is imported by solaris_exporter_benchmark.py
+    cext = None
 import os
-from prometheus_client.core import REGISTRY, Counter, Gauge, GaugeMetricFamily, CounterMetricFamily, UntypedMetricFamily
-from prometheus_client.parser import text_string_to_metric_families
-from prometheus_client import start_http_server
+from prometheus_client.core import REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, GaugeMetricFamily, CounterMetricFamily, \
+    UntypedMetricFamily
 from glob import glob
 from collections import namedtuple
 
+try:
+    import ctypes
+except ImportError:
+    ctypes = None
+
+try:
+    # Python 2.7
+    import Queue as queue
+except ImportError:
+    # Python 3
+    import queue
+
+# time.monotonic() is absent in Python 2.7, use wall clock there
+monotonic_time = getattr(time, 'monotonic', time.time)
+
 exporter_port = 9100
 text_file_path = '/opt/solaris_exporter/'
+# text files bigger than this or with more series are skipped
+text_file_max_size_bytes = 64 * 1024 * 1024
+text_file_max_series = 500000
 dictionaries_refresh_interval_sec = 600
+# disks dictionary is rebuilt by 'iostat -E' only if set of disks is changed (checked once in interval) or it is too old
+disk_index_check_interval_sec = 30
+disk_index_max_age_sec = 3600
+# run collectors in background threads on their own schedule, /metrics returns the latest collected snapshots
+background_collection = False
+# how often each collector runs in background mode, collector could override it by 'collect_interval_sec' attribute
+background_collection_interval_sec = 30
+background_collection_workers = 4
+# run collectors in parallel threads during scrape, return what is completed in concurrent_collection_deadline_sec
+concurrent_collection = False
+concurrent_collection_workers = 8
+concurrent_collection_deadline_sec = 45
+# scrapes in this interval get the same result, concurrent scrapes always share one collection
+exposition_cache_min_interval_sec = 5
+# compress output for clients with 'Accept-Encoding: gzip' header
+exposition_gzip = True
+# HTTP server: connections are served by this number of threads, keep-alive connection holds its thread
+http_workers = 8
+# accepted connections waiting for free thread, more connections get '503 Service Unavailable'
+http_max_queued_connections = 16
+# /metrics requests generated at once, more requests get 503 (scrapes share ExpositionCache anyway)
+http_max_concurrent_scrapes = 4
+# seconds to read request and to write every part of response, slow clients are disconnected
+http_timeout_sec = 10
+# HTTP/1.1 persistent connections wait for next request this time, 0 - connection is closed after response,
+# idle connection does not keep its thread when other connections wait for it
+http_keepalive_idle_sec = 120
+# DiskIOCollector calculates 'iostat -x' values (r/s, w/s, kr/s, kw/s, wait, actv, wsvc_t, asvc_t, %w, %b)
+diskio_iostat_gauges = False
+# metrics with names matching this regex are not exported, None - disabled
+metric_name_deny_regex = None
+# only metrics with names matching this regex are exported, None - disabled
+metric_name_allow_regex = None
+# series with label values matching regex are not exported, example: {'zone': '^test'}
+label_value_deny_regexes = {}
+# only series with label values matching regex are exported, example: {'driver': '^(sd|ssd)$'}
+label_value_allow_regexes = {}
+# labels removed from all metrics, example: ['stat_desc', 'admin_desc', 'host']
+drop_labels = []
+# max number of series returned by one collector, example: {'DiskIOCollector': 20000}, 0 - unlimited
+collector_max_series = {}
+collector_max_series_default = 0
+# write metrics to socket as they are collected (chunked transfer encoding), exposition cache is not used then
+exposition_streaming = False
+# how to read kstat: 'libkstat' (ctypes, no forks), 'command' ('kstat -p'), 'auto' - libkstat if it is available
+kstat_backend = 'auto'
+# DiskSpaceCollector runs os.statvfs() of mountpoints in these threads, mounts not answered in time are skipped
+diskspace_statvfs_workers = 4
+# Python 3.7+: serve /metrics from asyncio event loop, run collectors as concurrent tasks and OS commands
+# as asyncio subprocesses killed at timeout (solaris_exporter_async.py near this file is required)
+asyncio_runtime = False
+# asyncio runtime closes connections which do not send request headers in this time
+asyncio_request_timeout_sec = 10
+# global zone exporter also serves metrics of running local zones at /zones/<zonename>/metrics
+# and /metrics?zone=<zonename> (svcs, disk space, zone kstats), so exporters in local zones are not needed
+zone_targets = False
+# list of running zones ('zoneadm list -p') is refreshed after this interval
+zone_targets_refresh_interval_sec = 60
+# kstat based per zone collectors run once in this interval, all zone targets get series from the same snapshot
+zone_targets_snapshot_ttl_sec = 10
+# 'ldm list -p' output is reused for this time, then it is refreshed in background
+ldom_list_cache_ttl_sec = 30
+# LdomsLsCollector reads 'ldm list -l -p' bindings again when domains, their state, ncpu or mem are changed,
+# or after this time
+ldom_bindings_max_age_sec = 3600
+# 'zpool status' vdev tree is read again after this interval or when health of pools is changed
+zpool_status_refresh_interval_sec = 300
+# FCinfoCollector reuses 'mpathadm list lu' and 'fcinfo hba-port -l' output for this time, then it is refreshed
+# in background
+fc_cache_ttl_sec = 30
+# FCinfoCollector exports state of every path of LUs from 'mpathadm show lu' (solaris_exporter_fc_path_state)
+fc_path_details = True
+# 'mpathadm show lu' is run in background for new LUs and LUs with changed path counts, and for LUs older than this
+fc_topology_max_age_sec = 3600
+# FmadmCollector reads full 'fmadm faulty' once in this interval, between them only new events of 'fmdump -t'
+fma_full_refresh_interval_sec = 3600
+# max number of open faults kept by FmadmCollector with their class, FRU and severity
+fma_max_faults = 1000
+# SMFStateCollector runs 'svcs -a' again only when SMF repository or restarter logs in /var/svc/log are changed,
+# or after this time
+smf_state_max_age_sec = 300
+# solaris_exporter_smf_state is exported only for FMRIs matching allow regex and not matching deny regex,
+# None - disabled, example: '^svc:/(application|site)/'
+smf_fmri_allow_regex = None
+smf_fmri_deny_regex = None
 disk_operations_dictionary = {
     'reads': 'number of read operations',
     'writes': 'number of write operations',
@@ -176,6 +295,259 @@ per_zone_cpu_counters_dictionary = {
     'sysspawn': 'spawns for zone',
 }
 
+# zone_vfs and zone_misc ('zones' module) kstats of PerZoneCpuCollector: {kstat statistic: (statistic, stat_desc, divider)}
+per_zone_vfs_counters_dictionary = {
+    'nread': ('vfs_nread', 'VFS bytes read for zone', 1),
+    'nwritten': ('vfs_nwritten', 'VFS bytes written for zone', 1),
+    'rtime': ('vfs_rtime', 'VFS I/O run queue time for zone, seconds', 1000000000),
+    'wtime': ('vfs_wtime', 'VFS I/O wait queue time for zone, seconds', 1000000000),
+    'nsec_waitrq': ('waitrq', 'time of zone threads waiting in CPU run queue, seconds', 1000000000),
+}
+
+
+def command_label(args):
+    """
+    Short name of command for metric labels: executable name and its subcommand, if any.
+    '/usr/bin/pfexec /usr/sbin/fmadm faulty' -> 'fmadm faulty', 'kstat -p -c disk' -> 'kstat'
+    """
+    if args and os.path.basename(args[0]) == 'pfexec':
+        args = args[1:]
+    if not args:
+        return 'unknown'
+    label = os.path.basename(args[0])
+    if len(args) > 1 and not args[1].startswith('-') and not args[1].startswith('/') and args[1].isalpha():
+        label += ' ' + args[1]
+    return label
+
+
+class CommandReaper(object):
+    """
+    Reaps children of CommandRunner without polling: thread of command waits for its child by blocking wait(),
+    one supervisor thread for all commands kills children which are still running at their deadline.
+    Supervisor thread is started on first use and sleeps while no child is waited for.
+    """
+
+    def __init__(self):
+        # heap of [stop_time, sequence number, task, killed], task is None when child is reaped
+        self.deadlines = []
+        self.sequence = 0
+        self.condition = threading.Condition()
+        self.supervisor = None
+
+    def wait(self, task, stop_time):
+        """
+        Returns True if task exits before stop_time, otherwise task is killed and reaped
+        """
+        if task.poll() is not None:
+            return True
+        with self.condition:
+            self.sequence += 1
+            entry = [stop_time, self.sequence, task, False]
+            heapq.heappush(self.deadlines, entry)
+            if self.supervisor is None:
+                self.supervisor = threading.Thread(target=self._supervise, name='solaris_exporter_reaper')
+                self.supervisor.daemon = True
+                self.supervisor.start()
+            self.condition.notify()
+        task.wait()
+        with self.condition:
+            entry[2] = None
+            # supervisor drops reaped child instead of waiting for its deadline
+            self.condition.notify()
+            return not entry[3]
+
+    def _supervise(self):
+        with self.condition:
+            while True:
+                while self.deadlines and self.deadlines[0][2] is None:
+                    heapq.heappop(self.deadlines)
+                if not self.deadlines:
+                    self.condition.wait()
+                    continue
+                remaining = self.deadlines[0][0] - monotonic_time()
+                if remaining > 0:
+                    self.condition.wait(remaining)
+                    continue
+                entry = heapq.heappop(self.deadlines)
+                task = entry[2]
+                entry[2], entry[3] = None, True
+                # waiting thread sets returncode as soon as it reaps child, pid could be reused after that
+                if task.returncode is None:
+                    try:
+                        task.kill()
+                    except OSError:
+                        pass
+
+
+command_reaper = CommandReaper()
+
+
+class CommandRunner(object):
+    """
+    Runs OS commands with timeout. Output pipe is read with select() until EOF or monotonic deadline,
+    so no helper thread is needed per command. Child is killed at deadline and reaped by wait(),
+    child which closed output but does not exit is killed by command_reaper.
+    Works in Python 2.7.
+    """
+    command_duration = Histogram('solaris_exporter_command_duration_seconds',
+                                 'Time of OS command run (fork, exec, read output, wait)', ['command'],
+                                 buckets=(.01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 25, 50))
+    command_output_bytes = Counter('solaris_exporter_command_output_bytes',
+                                   'Bytes of OS command output read for parsing', ['command'])
+
+    def __init__(self):
+        self.devnull = open(os.devnull, 'w')
+
+    def _read_chunks(self, task, stop_time):
+        """
+        Generator of output chunks of task until EOF, yields None and stops if stop_time is reached first
+        """
+        fd = task.stdout.fileno()
+        while True:
+            remaining = stop_time - monotonic_time()
+            if remaining <= 0:
+                yield None
+                return
+            try:
+                ready = select.select([fd], [], [], remaining)[0]
+            except (select.error, OSError, IOError) as e:
+                if e.args[0] == errno.EINTR:
+                    continue
+                raise
+            if not ready:
+                continue
+            chunk = os.read(fd, 65536)
+            if not chunk:
+                return
+            yield chunk
+
+    def _read_output(self, task, stop_time):
+        """
+        Returns output of task and True if it is read completely before stop_time
+        """
+        chunks = []
+        for chunk in self._read_chunks(task, stop_time):
+            if chunk is None:
+                return b''.join(chunks), False
+            chunks.append(chunk)
+        return b''.join(chunks), True
+
+    def _wait(self, task, stop_time):
+        """
+        Returns True if task exits before stop_time, otherwise task is killed and reaped.
+        Task closed its output already, so it exits right now in most cases.
+        """
+        return command_reaper.wait(task, stop_time)
+
+    def _kill(self, task):
+        try:
+            task.kill()
+        except OSError:
+            pass
+        task.wait()
+
+    def run(self, commandline, timeout):
+        """
+        Example:
+        output, task_return_code, task_timeouted = command_runner.run('shell command text', timeout)
+        """
+        args = commandline.split()
+        start_time = monotonic_time()
+        stop_time = start_time + timeout
+        try:
+            task = subprocess.Popen(args, shell=False, stdout=subprocess.PIPE, stderr=self.devnull)
+        except OSError:
+            return "", 101, False
+
+        try:
+            output, completed = self._read_output(task, stop_time)
+            if completed:
+                completed = self._wait(task, stop_time)
+            else:
+                self._kill(task)
+        finally:
+            task.stdout.close()
+        label = command_label(args)
+        self.command_duration.labels(label).observe(monotonic_time() - start_time)
+        self.command_output_bytes.labels(label).inc(len(output))
+
+        if completed:
+            return output.decode('utf-8'), task.returncode, False
+        return output.decode('utf-8'), 100, True
+
+    def run_lines(self, commandline, timeout):
+        """
+        Same as run(), but output is returned as CommandLines, which are read while command is running
+        """
+        output = CommandLines()
+        output.lines = self._output_lines(commandline, timeout, output)
+        return output
+
+    def _output_lines(self, commandline, timeout, output):
+        args = commandline.split()
+        start_time = monotonic_time()
+        stop_time = start_time + timeout
+        try:
+            task = subprocess.Popen(args, shell=False, stdout=subprocess.PIPE, stderr=self.devnull)
+        except OSError:
+            output.return_code, output.timeouted = 101, False
+            return
+
+        output_bytes = 0
+        completed = False
+        try:
+            tail = b''
+            for chunk in self._read_chunks(task, stop_time):
+                if chunk is None:
+                    break
+                output_bytes += len(chunk)
+                lines = (tail + chunk).split(b'\n')
+                tail = lines.pop()
+                for line in lines:
+                    yield line.decode('utf-8')
+            else:
+                completed = True
+                if tail:
+                    yield tail.decode('utf-8')
+        finally:
+            # iteration stopped by reader kills the command as timeout does
+            try:
+                if completed:
+                    completed = self._wait(task, stop_time)
+                else:
+                    self._kill(task)
+            finally:
+                task.stdout.close()
+            label = command_label(args)
+            self.command_duration.labels(label).observe(monotonic_time() - start_time)
+            self.command_output_bytes.labels(label).inc(output_bytes)
+            if completed:
+                output.return_code, output.timeouted = task.returncode, False
+            else:
+                output.return_code, output.timeouted = 100, True
+
+
+class CommandLines(object):
+    """
+    Output of OS command as iterable of lines without line ends, whole output is not kept.
+    return_code and timeouted are set as run_shell_command() returns them, when all lines are read.
+    Example:
+    output = run_shell_command_lines('shell command text', timeout)
+    for line in output: ...
+    if output.return_code == 0 and output.timeouted is False: ...
+    """
+
+    def __init__(self, lines=None, return_code=None, timeouted=None):
+        self.lines = lines
+        self.return_code = return_code
+        self.timeouted = timeouted
+
+    def __iter__(self):
+        return iter(self.lines)
+
+
+command_runner = CommandRunner()
+
 
 def run_shell_command(commandline, timeout):
     """
@@ -183,55 +555,594 @@ def run_shell_command(commandline, timeout):
     Example:
     output, task_return_code, task_timeouted = run_shell_command('shell command text', timeout)
     """
-    output = ""
-    task_timeouted = False
-    task_return_code = 100
-    FNULL = open(os.devnull, 'w')
-    try:
-        task = subprocess.Popen(commandline.split(), shell=False, stdout=subprocess.PIPE, stderr=FNULL)
-    except OSError:
-        task_return_code = 101
-        return "", task_return_code, task_timeouted
+    return command_runner.run(commandline, timeout)
 
-    task_stop_time = time.time() + timeout
 
-    def killer_for_task(task, task_stop_time):
-        while task.poll() is None and time.time() < task_stop_time:
-            time.sleep(0.1)
-        if time.time() > task_stop_time:
-            try:
-                task.kill()
-                try:
-                    task.stdout.close()
-                except (ValueError, IOError) as e:
-                    pass
-            except OSError:
-                pass
+def run_shell_command_lines(commandline, timeout):
+    """
+    Same as run_shell_command(), but returns CommandLines to parse output while command is running.
+    command_runner without run_lines() (replaced one) reads whole output first.
+    """
+    run_lines = getattr(command_runner, 'run_lines', None)
+    if run_lines is not None:
+        return run_lines(commandline, timeout)
+    output, task_return_code, task_timeouted = command_runner.run(commandline, timeout)
+    return CommandLines(output.splitlines(), task_return_code, task_timeouted)
 
-    killer_job = threading.Thread(target=killer_for_task, args=(task, task_stop_time))
-    killer_job.start()
 
-    # Wait for subprocess complete. Timeout is controlled by thread killer_job
-    try:
-        output = task.communicate()[0]
+class CommandCache(object):
+    """
+    Time based cache of OS commands output, key is command line.
+    Result younger than ttl is returned from cache (hit).
+    Older result is returned too, but command is restarted in background thread (stale-while-revalidate).
+    Only absent result waits for command (miss). Timeouted results are not cached.
+    Registered in REGISTRY as collector to export age of cached results.
+    """
+    command_cache_requests = Counter('solaris_exporter_command_cache_requests',
+                                     'Requests of cached OS commands output', ['command', 'result'])
+
+    def __init__(self):
+        # {commandline: (output, return_code, timeouted, monotonic time of run)}
+        self.results = {}
+        self.refreshing = set()
+        self.lock = threading.Lock()
+
+    def _refresh(self, commandline, timeout):
+        output, task_return_code, task_timeouted = run_shell_command(commandline, timeout)
+        with self.lock:
+            if task_timeouted is False:
+                self.results[commandline] = (output, task_return_code, task_timeouted, monotonic_time())
+            self.refreshing.discard(commandline)
+        return output, task_return_code, task_timeouted
+
+    def run(self, commandline, timeout, ttl):
+        """
+        Example:
+        output, task_return_code, task_timeouted = command_cache.run('shell command text', timeout, ttl)
+        """
+        label = command_label(commandline.split())
+        with self.lock:
+            result = self.results.get(commandline)
+            if result is not None and monotonic_time() - result[3] > ttl and commandline not in self.refreshing:
+                self.refreshing.add(commandline)
+                refresher = threading.Thread(target=self._refresh, args=(commandline, timeout))
+                refresher.daemon = True
+                refresher.start()
+                self.command_cache_requests.labels(label, 'stale').inc()
+            elif result is not None:
+                self.command_cache_requests.labels(label, 'hit').inc()
+        if result is not None:
+            return result[0], result[1], result[2]
+        self.command_cache_requests.labels(label, 'miss').inc()
+        return self._refresh(commandline, timeout)
 
-    except ValueError:
-        pass
+    def collect(self):
+        now = monotonic_time()
+        cache_age = FilteredGaugeMetricFamily('solaris_exporter_command_cache_age_seconds',
+                                              'age of cached OS command output', labels=['command', 'host'])
+        with self.lock:
+            results = list(self.results.items())
+        ages = {}
+        for commandline, result in results:
+            label = command_label(commandline.split())
+            ages[label] = max(ages.get(label, 0), now - result[3])
+        for label in sorted(ages):
+            cache_age.add_metric([label, host_name], ages[label])
+        yield cache_age
 
-    killer_job.join()
-    FNULL.close()
 
-    if time.time() >= task_stop_time:
-        task_timeouted = True
-    else:
-        task_return_code = task.returncode
+command_cache = CommandCache()
 
-    try:
-        task.stdout.close()
-    except ValueError:
+
+def run_cached_command(commandline, timeout, ttl):
+    """
+    Same as run_shell_command(), but result could be taken from command_cache if it is younger than ttl seconds.
+    Example:
+    output, task_return_code, task_timeouted = run_cached_command('shell command text', timeout, ttl)
+    """
+    return command_cache.run(commandline, timeout, ttl)
+
+
+class WorkerTask(object):
+    """
+    Function submitted to WorkerPool, holds its result or exception
+    """
+
+    def __init__(self, function, args):
+        self.function = function
+        self.args = args
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+    def run(self):
+        try:
+            self.result = self.function(*self.args)
+        except Exception as e:
+            self.error = e
+        self.done.set()
+
+    def wait(self, timeout=None):
+        """
+        Returns True if task is completed in timeout
+        """
+        self.done.wait(timeout)
+        return self.done.is_set()
+
+
+class WorkerPool(object):
+    """
+    Fixed number of daemon threads running submitted functions.
+    Used instead of concurrent.futures, which is absent in Python 2.7.
+    Example:
+    pool = WorkerPool(4)
+    task = pool.submit(function, arg1, arg2)
+    if task.wait(timeout): print(task.result)
+    """
+
+    def __init__(self, workers, name='solaris_exporter_worker'):
+        self.tasks = queue.Queue()
+        for i in range(workers):
+            worker = threading.Thread(target=self._worker, name=name + '_' + str(i))
+            worker.daemon = True
+            worker.start()
+
+    def _worker(self):
+        while True:
+            task = self.tasks.get()
+            task.run()
+
+    def submit(self, function, *args):
+        task = WorkerTask(function, args)
+        self.tasks.put(task)
+        return task
+
+
+# kstat names with this symbols are translated to '_', as in metric labels
+kstat_name_cleaner = re.compile('[ ,!=]')
+
+
+def compile_kstat_spec(spec):
+    """
+    Translates kstat selector 'module:instance:name:statistic' in kstat(1M) syntax into list of 4 match functions.
+    Empty field matches everything, field in slashes '/.../' is regular expression, otherwise exact string.
+    """
+    fields = spec.split(':')
+    fields += [''] * (4 - len(fields))
+    matchers = []
+    for field in fields[:4]:
+        if field in ['', '*']:
+            matchers.append(None)
+        elif len(field) > 1 and field.startswith('/') and field.endswith('/'):
+            matchers.append(re.compile(field[1:-1]).search)
+        else:
+            matchers.append(lambda value, field=field: value == field)
+    return matchers
+
+
+def kstat_field_matches(matcher, value):
+    return matcher is None or bool(matcher(value))
+
+
+def parse_kstat_output(output):
+    """
+    Parses 'kstat -p' output into list of records (module, instance, name, statistic, value)
+    """
+    records = []
+    for line in output.splitlines():
+        kstatkeyvalue = line.split("\t")
+        if len(kstatkeyvalue) < 2:
+            continue
+        kstatkey = kstatkeyvalue[0].split(":")
+        if len(kstatkey) < 4:
+            continue
+        records.append((kstatkey[0], kstatkey[1], kstatkey[2], kstatkey[3], kstatkeyvalue[1]))
+    return records
+
+
+class KstatNameCache(object):
+    """
+    Cleaned kstat names, shared by kstat backends. kstat_name_cleaner is applied once per distinct kstat
+    and statistic name instead of every record, and all records of one kstat share the same
+    (module, instance, name) strings, so collectors could use them as cheap dictionary keys.
+    Cache is dropped if it grows over max_size entries (devices and zones come and go).
+    """
+    max_size = 200000
+
+    def __init__(self):
+        # (module, instance, name) -> (module, instance, name) cleaned
+        self.kstats = {}
+        # 'module:instance:name' of 'kstat -p' output -> (module, instance, name) cleaned
+        self.prefixes = {}
+        # statistic -> statistic cleaned
+        self.statistics = {}
+
+    def kstat(self, module, instance, name):
+        key = (module, instance, name)
+        names = self.kstats.get(key)
+        if names is None:
+            if len(self.kstats) > self.max_size:
+                self.kstats.clear()
+                self.prefixes.clear()
+            names = (kstat_name_cleaner.sub('_', module), instance, kstat_name_cleaner.sub('_', name))
+            self.kstats[key] = names
+        return names
+
+    def statistic(self, statistic):
+        cleaned = self.statistics.get(statistic)
+        if cleaned is None:
+            if len(self.statistics) > self.max_size:
+                self.statistics.clear()
+            cleaned = kstat_name_cleaner.sub('_', statistic)
+            self.statistics[statistic] = cleaned
+        return cleaned
+
+    def parse(self, output):
+        """
+        Generator of cleaned records (module, instance, name, statistic, value) from 'kstat -p' output,
+        in one pass: one partition of line, kstat and statistic names are taken from cache.
+        """
+        return self.parse_lines(output.splitlines())
+
+    def parse_lines(self, lines):
+        """
+        Same as parse() for iterable of 'kstat -p' output lines, for example CommandLines of running command
+        """
+        prefixes = self.prefixes
+        statistics = self.statistics
+        for line in lines:
+            key, separator, value = line.partition('\t')
+            if not separator:
+                continue
+            prefix, separator, statistic = key.rpartition(':')
+            names = prefixes.get(prefix)
+            if names is None:
+                fields = prefix.split(':')
+                if len(fields) < 3:
+                    continue
+                names = self.kstat(fields[0], fields[1], fields[2])
+                prefixes[prefix] = names
+            cleaned = statistics.get(statistic)
+            if cleaned is None:
+                cleaned = self.statistic(statistic)
+            yield names + (cleaned, value)
+
+
+kstat_names = KstatNameCache()
+
+
+class KstatCommandBackend(object):
+    """
+    Reads kstat by 'kstat -p' command, works everywhere, but forks heavy kstat perl script on each call
+    """
+
+    def read(self, specs, ks_class, timeout):
+        commandline = 'kstat -p'
+        if ks_class:
+            commandline += ' -c ' + ks_class
+        commandline += ' ' + ' '.join(specs)
+        # records are parsed while kstat is writing its output
+        output = run_shell_command_lines(commandline, timeout)
+        records = list(kstat_names.parse_lines(output))
+        if output.return_code != 0 or output.timeouted:
+            records = []
+        return records, output.return_code, output.timeouted
+
+
+class KstatTextBackend(object):
+    """
+    Reads kstat from recorded 'kstat -p' output, selectors are applied as kstat command does.
+    Used to check collectors without Solaris.
+    Example:
+    kstat_reader = KstatReader(KstatTextBackend(open('kstat_p.txt').read()))
+    """
+
+    def __init__(self, text):
+        self.records = parse_kstat_output(text)
+        self.classes = {}
+        for module, instance, name, statistic, value in self.records:
+            if statistic == 'class':
+                self.classes[(module, instance, name)] = value
+
+    def names(self, specs, ks_class):
+        compiled_specs = [compile_kstat_spec(spec) for spec in specs or ['']]
+        return [key for key in sorted(self.classes)
+                if (not ks_class or self.classes[key] == ks_class) and
+                any(all(kstat_field_matches(matcher, field) for matcher, field in zip(matchers, key))
+                    for matchers in compiled_specs)]
+
+    def read(self, specs, ks_class, timeout):
+        compiled_specs = [compile_kstat_spec(spec) for spec in specs or ['']]
+        records = []
+        for record in self.records:
+            module, instance, name, statistic, value = record
+            if ks_class and self.classes.get((module, instance, name)) != ks_class:
+                continue
+            for matchers in compiled_specs:
+                if all(kstat_field_matches(matcher, field) for matcher, field in zip(matchers, record[:4])):
+                    records.append(kstat_names.kstat(module, instance, name) +
+                                   (kstat_names.statistic(statistic), value))
+                    break
+        return records, 0, False
+
+
+KSTAT_STRLEN = 31
+KSTAT_TYPE_NAMED = 1
+KSTAT_TYPE_IO = 3
+KSTAT_DATA_CHAR = 0
+KSTAT_DATA_INT32 = 1
+KSTAT_DATA_UINT32 = 2
+KSTAT_DATA_INT64 = 3
+KSTAT_DATA_UINT64 = 4
+KSTAT_DATA_STRING = 9
+
+if ctypes is not None:
+    # structures from /usr/include/sys/kstat.h
+    class KstatStruct(ctypes.Structure):
         pass
 
-    return output.decode('utf-8'), task_return_code, task_timeouted
+    KstatStruct._fields_ = [
+        ('ks_crtime', ctypes.c_longlong),
+        ('ks_next', ctypes.POINTER(KstatStruct)),
+        ('ks_kid', ctypes.c_int),
+        ('ks_module', ctypes.c_char * KSTAT_STRLEN),
+        ('ks_resv', ctypes.c_ubyte),
+        ('ks_instance', ctypes.c_int),
+        ('ks_name', ctypes.c_char * KSTAT_STRLEN),
+        ('ks_type', ctypes.c_ubyte),
+        ('ks_class', ctypes.c_char * KSTAT_STRLEN),
+        ('ks_flags', ctypes.c_ubyte),
+        ('ks_data', ctypes.c_void_p),
+        ('ks_ndata', ctypes.c_uint),
+        ('ks_data_size', ctypes.c_size_t),
+        ('ks_snaptime', ctypes.c_longlong),
+        ('ks_update', ctypes.c_void_p),
+        ('ks_private', ctypes.c_void_p),
+        ('ks_snapshot', ctypes.c_void_p),
+        ('ks_lock', ctypes.c_void_p),
+    ]
+
+    class KstatCtlStruct(ctypes.Structure):
+        _fields_ = [
+            ('kc_chain_id', ctypes.c_int),
+            ('kc_chain', ctypes.POINTER(KstatStruct)),
+            ('kc_kd', ctypes.c_int),
+        ]
+
+    class KstatNamedStrAddr(ctypes.Union):
+        _fields_ = [
+            ('ptr', ctypes.c_char_p),
+            ('pad', ctypes.c_char * 8),
+        ]
+
+    class KstatNamedStr(ctypes.Structure):
+        _fields_ = [
+            ('addr', KstatNamedStrAddr),
+            ('len', ctypes.c_uint32),
+        ]
+
+    class KstatNamedValue(ctypes.Union):
+        _fields_ = [
+            ('c', ctypes.c_char * 16),
+            ('i32', ctypes.c_int32),
+            ('ui32', ctypes.c_uint32),
+            ('str', KstatNamedStr),
+            ('i64', ctypes.c_int64),
+            ('ui64', ctypes.c_uint64),
+        ]
+
+    class KstatNamedStruct(ctypes.Structure):
+        _fields_ = [
+            ('name', ctypes.c_char * KSTAT_STRLEN),
+            ('data_type', ctypes.c_ubyte),
+            ('value', KstatNamedValue),
+        ]
+
+    class KstatIOStruct(ctypes.Structure):
+        _fields_ = [
+            ('nread', ctypes.c_ulonglong),
+            ('nwritten', ctypes.c_ulonglong),
+            ('reads', ctypes.c_uint),
+            ('writes', ctypes.c_uint),
+            ('wtime', ctypes.c_longlong),
+            ('wlentime', ctypes.c_longlong),
+            ('wlastupdate', ctypes.c_longlong),
+            ('rtime', ctypes.c_longlong),
+            ('rlentime', ctypes.c_longlong),
+            ('rlastupdate', ctypes.c_longlong),
+            ('wcnt', ctypes.c_uint),
+            ('rcnt', ctypes.c_uint),
+        ]
+
+
+def kstat_string(value):
+    if isinstance(value, bytes):
+        return value.decode('utf-8', 'replace')
+    return value
+
+
+class LibKstatBackend(object):
+    """
+    Reads /dev/kstat via libkstat.so.1 without forks.
+    kstat_ctl_t handle stays opened between scrapes, kstat_chain_update() is called before each read,
+    list of kstats selected by specs is cached until kstat chain is changed.
+    Raises OSError if libkstat is not available.
+    """
+
+    def __init__(self):
+        if ctypes is None:
+            raise OSError('ctypes module is not available')
+        self.libkstat = ctypes.CDLL('libkstat.so.1')
+        self.libkstat.kstat_open.restype = ctypes.POINTER(KstatCtlStruct)
+        self.libkstat.kstat_chain_update.argtypes = [ctypes.POINTER(KstatCtlStruct)]
+        self.libkstat.kstat_read.argtypes = [ctypes.POINTER(KstatCtlStruct), ctypes.POINTER(KstatStruct),
+                                             ctypes.c_void_p]
+        self.kc = self.libkstat.kstat_open()
+        if not self.kc:
+            raise OSError('kstat_open() failed')
+        # libkstat handle is not thread-safe
+        self.lock = threading.Lock()
+        # {(specs, ks_class): [(kstat pointer, statistic matchers, (module, instance, name) cleaned, ks_class)]}
+        self.selected_kstats = {}
+
+    def _select_kstats(self, specs, ks_class):
+        compiled_specs = [compile_kstat_spec(spec) for spec in specs or ['']]
+        selected = []
+        ksp = self.kc.contents.kc_chain
+        while ksp:
+            ks = ksp.contents
+            ksp_class = kstat_string(ks.ks_class)
+            if not ks_class or ksp_class == ks_class:
+                module = kstat_string(ks.ks_module)
+                instance = str(ks.ks_instance)
+                name = kstat_string(ks.ks_name)
+                statistic_matchers = [matchers[3] for matchers in compiled_specs
+                                      if kstat_field_matches(matchers[0], module) and
+                                      kstat_field_matches(matchers[1], instance) and
+                                      kstat_field_matches(matchers[2], name)]
+                if statistic_matchers:
+                    selected.append((ksp, statistic_matchers, kstat_names.kstat(module, instance, name), ksp_class))
+            ksp = ks.ks_next
+        return selected
+
+    def _kstat_values(self, ks, ks_class):
+        values = [('class', ks_class), ('crtime', ks.ks_crtime / 1e9), ('snaptime', ks.ks_snaptime / 1e9)]
+        if ks.ks_type == KSTAT_TYPE_NAMED:
+            named = ctypes.cast(ks.ks_data, ctypes.POINTER(KstatNamedStruct))
+            for i in range(ks.ks_ndata):
+                kn = named[i]
+                data_type = kn.data_type
+                if data_type == KSTAT_DATA_UINT64:
+                    value = kn.value.ui64
+                elif data_type == KSTAT_DATA_INT64:
+                    value = kn.value.i64
+                elif data_type == KSTAT_DATA_UINT32:
+                    value = kn.value.ui32
+                elif data_type == KSTAT_DATA_INT32:
+                    value = kn.value.i32
+                elif data_type == KSTAT_DATA_CHAR:
+                    value = kstat_string(kn.value.c)
+                elif data_type == KSTAT_DATA_STRING:
+                    value = kstat_string(kn.value.str.addr.ptr or b'')
+                else:
+                    continue
+                values.append((kstat_string(kn.name), value))
+        elif ks.ks_type == KSTAT_TYPE_IO:
+            io = ctypes.cast(ks.ks_data, ctypes.POINTER(KstatIOStruct)).contents
+            # hrtime values are translated to seconds, as kstat command does
+            values.extend([
+                ('nread', io.nread), ('nwritten', io.nwritten), ('reads', io.reads), ('writes', io.writes),
+                ('wtime', io.wtime / 1e9), ('wlentime', io.wlentime / 1e9), ('wlastupdate', io.wlastupdate / 1e9),
+                ('rtime', io.rtime / 1e9), ('rlentime', io.rlentime / 1e9), ('rlastupdate', io.rlastupdate / 1e9),
+                ('wcnt', io.wcnt), ('rcnt', io.rcnt),
+            ])
+        return values
+
+    def _updated_selection(self, specs, ks_class):
+        """
+        Returns kstats selected by specs, have to be called with self.lock acquired
+        """
+        if self.libkstat.kstat_chain_update(self.kc) != 0:
+            # chain is changed (or error), old kstat pointers are not valid anymore
+            self.selected_kstats.clear()
+        key = (tuple(specs), ks_class)
+        selected = self.selected_kstats.get(key)
+        if selected is None:
+            selected = self._select_kstats(specs, ks_class)
+            self.selected_kstats[key] = selected
+        return selected
+
+    def names(self, specs, ks_class):
+        with self.lock:
+            return [names for ksp, statistic_matchers, names, ksp_class in self._updated_selection(specs, ks_class)]
+
+    def read(self, specs, ks_class, timeout):
+        records = []
+        with self.lock:
+            selected = self._updated_selection(specs, ks_class)
+            for ksp, statistic_matchers, names, ksp_class in selected:
+                if self.libkstat.kstat_read(self.kc, ksp, None) == -1:
+                    continue
+                for statistic, value in self._kstat_values(ksp.contents, ksp_class):
+                    if any(kstat_field_matches(matcher, statistic) for matcher in statistic_matchers):
+                        records.append(names + (kstat_names.statistic(statistic), value))
+        return records, 0, False
+
+
+class KstatReader(object):
+    """
+    kstat access for collectors. Backend is chosen by kstat_backend setting:
+    'libkstat' - LibKstatBackend, 'command' - KstatCommandBackend, 'auto' - libkstat if it is loadable.
+    If libkstat backend fails, reader falls back to 'kstat -p' command.
+    Any object with read(specs, ks_class, timeout) method could be used as backend.
+    Example:
+    records, return_code, timeouted = kstat_reader.read(['unix::pset:ncpus'], 'misc', timeout)
+    for module, instance, name, statistic, value in records: ...
+    """
+    kstat_reader_fallbacks = Counter('solaris_exporter_kstat_reader_fallbacks',
+                                     'Number of times when libkstat failed and kstat command was used instead')
+
+    def __init__(self, backend=None):
+        if backend is None:
+            backend = KstatCommandBackend()
+            if kstat_backend in ['auto', 'libkstat']:
+                try:
+                    backend = LibKstatBackend()
+                except (OSError, AttributeError):
+                    if kstat_backend == 'libkstat':
+                        raise
+        self.backend = backend
+
+    def names(self, specs, ks_class=None):
+        """
+        Returns list of selected kstats (module, instance, name) without reading its data,
+        or None if backend can not do it without running kstat command.
+        """
+        names = getattr(self.backend, 'names', None)
+        if names is None:
+            return None
+        try:
+            return names(specs, ks_class)
+        except Exception:
+            return None
+
+    def read(self, specs, ks_class=None, timeout=4):
+        """
+        specs - list of kstat selectors 'module:instance:name:statistic' in kstat(1M) syntax, [] for all
+        ks_class - kstat class as in 'kstat -c', None for all
+        timeout - seconds, used by 'kstat -p' command only
+        returns list of records (module, instance, name, statistic, value), return_code, timeouted
+        """
+        try:
+            return self.backend.read(specs, ks_class, timeout)
+        except Exception:
+            if isinstance(self.backend, KstatCommandBackend):
+                raise
+            self.kstat_reader_fallbacks.inc()
+            self.backend = KstatCommandBackend()
+            return self.backend.read(specs, ks_class, timeout)
+
+
+def parse_iostat_e(output):
+    """
+    Splits 'iostat -E' or 'iostat -En' output into list of disks: [(disk_name, vendor_line, size_line)]
+    """
+    disks = []
+    disk_name = None
+    vendor_line = size_line = ''
+    for line in output.splitlines():
+        if "Soft" in line and not line.startswith(' '):
+            if disk_name is not None:
+                disks.append((disk_name, vendor_line, size_line))
+            disk_name = line.split()[0]
+            vendor_line = size_line = ''
+        elif "Vendor" in line:
+            vendor_line = line.strip()
+        elif "Size" in line:
+            size_line = line.strip()
+    if disk_name is not None:
+        disks.append((disk_name, vendor_line, size_line))
+    return disks
 
 
 def get_disk_dictionary():
@@ -243,283 +1154,654 @@ def get_disk_dictionary():
     # /usr/bin/iostat -E | grep Soft | awk '{ print $1}' > /tmp/a;
     # /usr/bin/iostat -En | grep Soft|awk '{ print $1 }' > /tmp/b; paste /tmp/a /tmp/b
     # /usr/bin/rm /tmp/a /tmp/b
+    Disks of both outputs are matched by their Vendor/Serial/Size lines, not by position,
+    position is used only if description is not found and both outputs have the same number of disks.
     """
 
     disk_dictionary = {}
+    # both commands take seconds on hosts with many LUNs, they are run in parallel
+    iostatEn_task = WorkerTask(run_shell_command, ('/usr/bin/iostat -En', 4))
+    iostatEn_thread = threading.Thread(target=iostatEn_task.run, name='solaris_exporter_iostat')
+    iostatEn_thread.daemon = True
+    iostatEn_thread.start()
     iostatE, iostatE_return_code, iostatE_timeouted = run_shell_command('/usr/bin/iostat -E', 4)
-    iostatEn, iostatEn_return_code, iostatEn_timeouted = run_shell_command('/usr/bin/iostat -En', 4)
+    iostatEn_task.wait()
+    if iostatEn_task.error is not None:
+        raise iostatEn_task.error
+    iostatEn, iostatEn_return_code, iostatEn_timeouted = iostatEn_task.result
 
     if iostatE_timeouted is False and iostatE_return_code == 0 and iostatEn_timeouted is False and iostatEn_return_code == 0:
-        iostatE_lines = iostatE.splitlines()
-        kernel_disk_name = []
-        for iostatE_line in iostatE_lines:
-            if "Soft" in iostatE_line:
-                diskstrings = iostatE_line.split()
-                kernel_disk_name.append(diskstrings[0])
-
-        iostatEn_lines = iostatEn.splitlines()
-        admin_disk_name = []
-        disk_size = []
-        j = 0
-        for iostatEn_line in iostatEn_lines:
-            if "Soft" in iostatEn_line:
-                diskstrings = iostatEn_line.split()
-                admin_disk_name.append(diskstrings[0])
-            elif "Vendor" in iostatEn_line:
+        kernel_disks = parse_iostat_e(iostatE)
+        admin_disks = parse_iostat_e(iostatEn)
+        admin_disk_names = {}
+        for admin_disk_name, vendor_line, size_line in admin_disks:
+            admin_disk_names.setdefault((vendor_line, size_line), []).append(admin_disk_name)
+        same_disks_number = len(kernel_disks) == len(admin_disks)
+
+        for j, (kernel_disk_name, vendor_line, size_line) in enumerate(kernel_disks):
+            if admin_disk_names.get((vendor_line, size_line)):
+                admin_disk_name = admin_disk_names[(vendor_line, size_line)].pop(0)
+            elif same_disks_number:
+                admin_disk_name = admin_disks[j][0]
+            else:
+                continue
+            one_disk_desc = 'unknown'
+            if vendor_line:
                 one_disk_desc = re.sub(r'Vendor: (.*[^ ]) *Product: (.*[^ ]) *(Revision|Size).*', r'\1 \2',
-                                       iostatEn_line)
+                                       vendor_line)
                 one_disk_desc = re.sub(r' +', ' ', one_disk_desc)  # replace double spaces by one space
-                # disk_dictionary.update({kernel_disk_name[j]: [admin_disk_name[j], one_disk_desc, disk_size[j]]})
-                # j += 1
-            elif "Size" in iostatEn_line:
-                size = re.sub(r'Size: .*<(.*[^ ]) bytes>.*', r'\1', iostatEn_line)
-                disk_size.append(size)
-                disk_dictionary.update({kernel_disk_name[j]: [admin_disk_name[j], one_disk_desc, disk_size[j]]})
-                j += 1
-    return (disk_dictionary)
+            disk_size = '0'
+            if size_line:
+                disk_size = re.sub(r'Size: .*<(.*[^ ]) bytes>.*', r'\1', size_line)
+            disk_dictionary[kernel_disk_name] = [admin_disk_name, one_disk_desc, disk_size]
+    return disk_dictionary
+
+
+class DiskIndex(object):
+    """
+    Keeps dictionary of disks made by get_disk_dictionary():
+    {kernel_disk_name: [admin_disk_name, disk_description, disk_size]}
+    'iostat -E' is repeated only when set of disks is changed (/dev/rdsk is modified or set of 'disk' kstats
+    is changed, kstats are checked only if it is possible without fork) or dictionary is older than
+    disk_index_max_age_sec.
+    New dictionary replaces old one by single assignment, readers have to take reference once:
+    disk_dictionary = disk_index.disks
+    """
+
+    def __init__(self):
+        self.disks = {}
+        self.signature = None
+        self.refresh_time = None
+        self.refresh_lock = threading.Lock()
+
+    def _signature(self):
+        try:
+            rdsk_mtime = os.stat('/dev/rdsk').st_mtime
+        except OSError:
+            rdsk_mtime = None
+        disk_kstats = kstat_reader.names([], 'disk')
+        if disk_kstats is not None:
+            disk_kstats = frozenset(disk_kstats)
+        return rdsk_mtime, disk_kstats
+
+    def refresh_if_changed(self):
+        """
+        Returns True if dictionary was rebuilt.
+        Empty dictionary means 'iostat -E' failed: previous dictionary is kept and rebuild is retried next time.
+        """
+        with self.refresh_lock:
+            signature = self._signature()
+            if signature == self.signature and monotonic_time() - self.refresh_time < disk_index_max_age_sec:
+                return False
+            disks = get_disk_dictionary()
+            if not disks:
+                return False
+            self.disks = disks
+            self.signature = signature
+            self.refresh_time = monotonic_time()
+            return True
+
+
+class SeriesRule(object):
+    """
+    Filter of one metric family made by SeriesFilter: label positions to check and to keep
+    """
+
+    def __init__(self, labelnames, label_value_deny, label_value_allow, denied=False):
+        self.denied = denied
+        self.keep = [i for i, label in enumerate(labelnames) if label not in drop_labels]
+        self.labelnames = [labelnames[i] for i in self.keep]
+        self.deny = [(i, label_value_deny[label]) for i, label in enumerate(labelnames) if label in label_value_deny]
+        self.allow = [(i, label_value_allow[label]) for i, label in enumerate(labelnames) if label in label_value_allow]
+
+    def accept(self, values):
+        for i, search in self.deny:
+            if search(values[i]):
+                return False
+        for i, search in self.allow:
+            if not search(values[i]):
+                return False
+        return True
+
+    def reduce(self, values):
+        return [values[i] for i in self.keep]
+
+
+class SeriesFilter(object):
+    """
+    Applies metric_name_deny_regex, metric_name_allow_regex, label_value_deny_regexes, label_value_allow_regexes
+    and drop_labels settings to metric families.
+    """
+
+    def __init__(self):
+        self.name_deny = metric_name_deny_regex and re.compile(metric_name_deny_regex).search
+        self.name_allow = metric_name_allow_regex and re.compile(metric_name_allow_regex).search
+        self.label_value_deny = dict((label, re.compile(regex).search)
+                                     for label, regex in label_value_deny_regexes.items())
+        self.label_value_allow = dict((label, re.compile(regex).search)
+                                      for label, regex in label_value_allow_regexes.items())
+        self.enabled = bool(self.name_deny or self.name_allow or self.label_value_deny or self.label_value_allow or
+                            drop_labels)
+        # {(family name, labelnames): SeriesRule or None}
+        self.rules = {}
+
+    def family_allowed(self, name):
+        if self.name_deny and self.name_deny(name):
+            return False
+        if self.name_allow and not self.name_allow(name):
+            return False
+        return True
+
+    def family_rule(self, name, labelnames):
+        """
+        Returns SeriesRule for metric family or None if family is not filtered
+        """
+        if not self.enabled:
+            return None
+        key = (name, tuple(labelnames))
+        if key not in self.rules:
+            rule = SeriesRule(labelnames, self.label_value_deny, self.label_value_allow,
+                              denied=not self.family_allowed(name))
+            if not rule.denied and not rule.deny and not rule.allow and len(rule.keep) == len(labelnames):
+                rule = None
+            self.rules[key] = rule
+        return self.rules[key]
+
+    def filter_sample(self, sample):
+        """
+        Filters sample of family not made by FilteredMetricFamily, returns None if sample is dropped
+        """
+        for label, search in self.label_value_deny.items():
+            if label in sample.labels and search(sample.labels[label]):
+                return None
+        for label, search in self.label_value_allow.items():
+            if label in sample.labels and not search(sample.labels[label]):
+                return None
+        if drop_labels and any(label in sample.labels for label in drop_labels):
+            labels = dict((label, value) for label, value in sample.labels.items() if label not in drop_labels)
+            return sample._replace(labels=labels)
+        return sample
+
+
+series_filter = SeriesFilter()
+
+
+class FilteredMetricFamily(object):
+    """
+    Mixin for metric families, applies series_filter in add_metric() before sample is made,
+    so filtered out series cost nothing.
+    """
+    series_filtered = True
+
+    def __init__(self, name, documentation, value=None, labels=None, **kwargs):
+        super(FilteredMetricFamily, self).__init__(name, documentation, value=value, labels=labels, **kwargs)
+        self.series_rule = series_filter.family_rule(self.name, labels or [])
+        if self.series_rule is not None:
+            self._labelnames = tuple(self.series_rule.labelnames)
+
+    def add_metric(self, labels, value, *args, **kwargs):
+        rule = self.series_rule
+        if rule is not None:
+            if rule.denied or not rule.accept(labels):
+                return
+            labels = rule.reduce(labels)
+        super(FilteredMetricFamily, self).add_metric(labels, value, *args, **kwargs)
+
+
+class FilteredCounterMetricFamily(FilteredMetricFamily, CounterMetricFamily):
+    pass
+
+
+class FilteredGaugeMetricFamily(FilteredMetricFamily, GaugeMetricFamily):
+    pass
+
+
+def collector_name(collector):
+    return getattr(collector, 'name', type(collector).__name__)
+
+
+def collector_run_errors(collector):
+    """
+    Number of errors counted by collector during its last collect(), 0 for collectors which do not count them
+    """
+    return getattr(collector, 'run_errors', 0)
+
+
+def collector_commands(collector):
+    commands = getattr(collector, 'commands', None)
+    return commands() if commands is not None else []
+
+
+class FilteredCollector(object):
+    """
+    Wraps collector: drops metric families denied by series_filter, filters families not made by
+    FilteredMetricFamily (for example from text files) and limits number of series returned by collector
+    (collector_max_series setting).
+    """
+    series_budget_overflows = Counter('solaris_exporter_series_budget_overflows',
+                                      'Number of series dropped because collector exceeded its series limit',
+                                      ['collector'])
+
+    def __init__(self, collector):
+        self.collector = collector
+        self.name = collector_name(collector)
+        self.max_series = collector_max_series.get(self.name, collector_max_series_default)
+
+    def describe(self):
+        return []
+
+    def commands(self):
+        return collector_commands(self.collector)
+
+    @property
+    def run_errors(self):
+        return collector_run_errors(self.collector)
+
+    def collect(self):
+        series = 0
+        for family in self.collector.collect():
+            if not series_filter.family_allowed(family.name):
+                continue
+            if series_filter.enabled and not getattr(family, 'series_filtered', False):
+                # copy family, it could be cached by collector
+                samples = [series_filter.filter_sample(sample) for sample in family.samples]
+                family = copy.copy(family)
+                family.samples = [sample for sample in samples if sample is not None]
+            if self.max_series:
+                allowed = max(self.max_series - series, 0)
+                if len(family.samples) > allowed:
+                    self.series_budget_overflows.labels(self.name).inc(len(family.samples) - allowed)
+                    family = copy.copy(family)
+                    family.samples = family.samples[:allowed]
+                series += len(family.samples)
+            yield family
+
+
+class BaseCollector(object):
+    """
+    Base class of collectors. Subclass yields metric families from collect_metrics()
+    and reports failed commands by count_error(timeouted).
+    Duration, errors, timeouts and number of series are exported for all collectors by the same metrics
+    with 'collector' label. Old per collector metrics are made from processing_metric, errors_metric
+    and timeouts_metric names, as they are used by existing dashboards.
+    """
+    processing_metric = None
+    errors_metric = None
+    timeouts_metric = None
+    collector_duration = Histogram('solaris_exporter_collector_duration_seconds', 'Time of collector run',
+                                   ['collector'],
+                                   buckets=(.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 25, 50, 100))
+    collector_errors = Counter('solaris_exporter_collector_errors', 'Number of times when collector ran with errors',
+                               ['collector'])
+    collector_timeouts = Counter('solaris_exporter_collector_timeouts',
+                                 'Number of times when collector commands ran more than max_time_to_run seconds',
+                                 ['collector'])
+    collector_series = Gauge('solaris_exporter_collector_series', 'Number of series returned by collector last time',
+                             ['collector'])
+    # old style metrics by name, shared by all instances of collector class
+    legacy_metrics = {}
+    legacy_metrics_lock = threading.Lock()
+    # errors counted during the last collect()
+    run_errors = 0
+
+    def __init__(self):
+        self.name = type(self).__name__
+        self.processing = self.legacy_metric(Gauge, self.processing_metric, 'Time spent processing request')
+        self.errors = self.legacy_metric(Counter, self.errors_metric, 'Number of times when collector ran with errors')
+        self.timeouts = self.legacy_metric(Counter, self.timeouts_metric, 'timeouts')
+
+    def legacy_metric(self, metric_class, metric_name, documentation):
+        if metric_name is None:
+            return None
+        with self.legacy_metrics_lock:
+            metric = self.legacy_metrics.get(metric_name)
+            if metric is None:
+                metric = metric_class(metric_name, documentation)
+                self.legacy_metrics[metric_name] = metric
+        return metric
+
+    def count_error(self, timeouted=False):
+        self.run_errors += 1
+        self.collector_errors.labels(self.name).inc()
+        if self.errors is not None:
+            self.errors.inc()
+        if timeouted:
+            self.collector_timeouts.labels(self.name).inc()
+            if self.timeouts is not None:
+                self.timeouts.inc()
+
+    def describe(self):
+        # REGISTRY would run collect() at registration to get names of metrics, it makes startup slow
+        return []
+
+    def collect_metrics(self):
+        return []
+
+    def commands(self):
+        """
+        OS commands which collect_metrics() runs on this collection: [(commandline, timeout, ttl)],
+        ttl is None for run_shell_command(). asyncio runtime runs them as subprocesses before collect(),
+        so thread of collector does not wait for them.
+        """
+        return []
 
+    def collect(self):
+        start_time = monotonic_time()
+        self.run_errors = 0
+        try:
+            families = list(self.collect_metrics())
+        except Exception:
+            self.run_errors += 1
+            self.collector_errors.labels(self.name).inc()
+            raise
+        finally:
+            duration = monotonic_time() - start_time
+            self.collector_duration.labels(self.name).observe(duration)
+            if self.processing is not None:
+                self.processing.set(duration)
+        self.collector_series.labels(self.name).set(sum(len(family.samples) for family in families))
+        return families
+
+
+class ExporterProcessCollector(BaseCollector):
+    """
+    RSS, CPU time and threads of exporter itself.
+    Process metrics of prometheus_client are made from Linux /proc files only, so they are absent on Solaris.
+    """
 
-class NetworkCollector(object):
+    def collect_metrics(self):
+        with exporter_process.oneshot():
+            memory = exporter_process.memory_info()
+            cpu_times = exporter_process.cpu_times()
+            threads = exporter_process.num_threads()
+        process_memory = FilteredGaugeMetricFamily('solaris_exporter_process_memory_bytes',
+                                                   'memory of exporter process', labels=['host', 'statistic'])
+        process_memory.add_metric([host_name, 'rss'], memory.rss)
+        process_memory.add_metric([host_name, 'vms'], memory.vms)
+        yield process_memory
+        process_cpu = FilteredCounterMetricFamily('solaris_exporter_process_cpu_seconds_total',
+                                                  'CPU time of exporter process', labels=['host', 'mode'])
+        process_cpu.add_metric([host_name, 'user'], cpu_times.user)
+        process_cpu.add_metric([host_name, 'system'], cpu_times.system)
+        yield process_cpu
+        process_threads = FilteredGaugeMetricFamily('solaris_exporter_process_threads',
+                                                    'threads of exporter process', labels=['host'])
+        process_threads.add_metric([host_name], threads)
+        yield process_threads
+
+
+class NetworkCollector(BaseCollector):
     """
     Network Interfaces stats
     """
     # timeout how match seconds is allowed to collect data
     max_time_to_run = 4
-    NetworkCollector_Timeouts = Counter('solaris_exporter_network_usage_timeouts',
-                                        'Number of times when collector ran' +
-                                        ' more than ' + str(max_time_to_run) + ' seconds')
-    NetworkCollector_Errors = Counter('solaris_exporter_network_usage_errors', 'Number of times when collector ran' +
-                                      ' with errors')
-    network_collector_run_time = Gauge('solaris_exporter_network_usage_processing', 'Time spent processing request')
+    timeouts_metric = 'solaris_exporter_network_usage_timeouts'
+    errors_metric = 'solaris_exporter_network_usage_errors'
+    processing_metric = 'solaris_exporter_network_usage_processing'
 
     def collect_unused(self):
-        with self.network_collector_run_time.time():
-            output, task_return_code, task_timeouted = run_shell_command('kstat -p -c net :::*bytes64',
-                                                                         self.max_time_to_run)
-            if task_return_code == 0 and task_timeouted is False:
-                lines = output.splitlines()
-                network_usage = CounterMetricFamily("solaris_exporter_network_usage", 'kstat counters',
-                                                    labels=['driver', 'name', 'statistic', 'host'])
-                for line in lines:
-                    kstatkeyvalue = line.split("\t")
-                    kstatkeyvalue[0] = re.sub('[ ,!=]', '_', kstatkeyvalue[0]).replace(",", ".")
-                    kstatkey = kstatkeyvalue[0].split(":")
-                    driver = kstatkey[0]
-                    # instance = kstatkey[1]
-                    name = kstatkey[2]
-                    statistic = kstatkey[3].replace('obytes', 'output-bytes').replace('rbytes', 'input-bytes').replace(
-                        'odropbytes', 'output-dropped-bytes').replace('idropbytes', 'input-dropped-bytes')
-                    value = kstatkeyvalue[1]
-                    if value == "" or name == "class":
-                        continue
-                    network_usage.add_metric([driver, name, statistic, host_name], value)
-            else:
-                self.NetworkCollector_Errors.inc()
-                if task_timeouted:
-                    self.NetworkCollector_Timeouts.inc()
+        output, task_return_code, task_timeouted = run_shell_command('kstat -p -c net :::*bytes64',
+                                                                     self.max_time_to_run)
+        if task_return_code == 0 and task_timeouted is False:
+            lines = output.splitlines()
+            network_usage = FilteredCounterMetricFamily("solaris_exporter_network_usage", 'kstat counters',
+                                                        labels=['driver', 'name', 'statistic', 'host'])
+            for line in lines:
+                kstatkeyvalue = line.split("\t")
+                kstatkeyvalue[0] = re.sub('[ ,!=]', '_', kstatkeyvalue[0]).replace(",", ".")
+                kstatkey = kstatkeyvalue[0].split(":")
+                driver = kstatkey[0]
+                # instance = kstatkey[1]
+                name = kstatkey[2]
+                statistic = kstatkey[3].replace('obytes', 'output-bytes').replace('rbytes', 'input-bytes').replace(
+                    'odropbytes', 'output-dropped-bytes').replace('idropbytes', 'input-dropped-bytes')
+                value = kstatkeyvalue[1]
+                if value == "" or name == "class":
+                    continue
+                network_usage.add_metric([driver, name, statistic, host_name], value)
+        else:
+            self.count_error(task_timeouted)
         yield network_usage
 
-    def collect(self):
-        with self.network_collector_run_time.time():
-            try:
-                net_stats = psutil.net_io_counters(pernic=True)
-            except RuntimeError:
-                self.NetworkCollector_Errors.inc()
-            else:
-                network_usage = CounterMetricFamily("solaris_exporter_network_usage", 'kstat counters',
-                                                    labels=['NIC', 'statistic', 'host'])
-                for NIC in net_stats:
-                    network_usage.add_metric([NIC, 'bytes_sent', host_name], net_stats[NIC].bytes_sent)
-                    network_usage.add_metric([NIC, 'bytes_recv', host_name], net_stats[NIC].bytes_recv)
-                    network_usage.add_metric([NIC, 'errin', host_name], net_stats[NIC].errin)
-                    network_usage.add_metric([NIC, 'errout', host_name], net_stats[NIC].errout)
-                    network_usage.add_metric([NIC, 'dropin', host_name], net_stats[NIC].dropin)
-                    network_usage.add_metric([NIC, 'dropout', host_name], net_stats[NIC].dropout)
-            yield network_usage
+    def collect_metrics(self):
+        try:
+            net_stats = psutil.net_io_counters(pernic=True)
+        except RuntimeError:
+            self.count_error()
+        else:
+            network_usage = FilteredCounterMetricFamily("solaris_exporter_network_usage", 'kstat counters',
+                                                        labels=['NIC', 'statistic', 'host'])
+            for NIC in net_stats:
+                network_usage.add_metric([NIC, 'bytes_sent', host_name], net_stats[NIC].bytes_sent)
+                network_usage.add_metric([NIC, 'bytes_recv', host_name], net_stats[NIC].bytes_recv)
+                network_usage.add_metric([NIC, 'errin', host_name], net_stats[NIC].errin)
+                network_usage.add_metric([NIC, 'errout', host_name], net_stats[NIC].errout)
+                network_usage.add_metric([NIC, 'dropin', host_name], net_stats[NIC].dropin)
+                network_usage.add_metric([NIC, 'dropout', host_name], net_stats[NIC].dropout)
+        yield network_usage
 
 
-class DiskIOCollector(object):
+class IostatCalculator(object):
+    """
+    Translates kstat io counters of disks into 'iostat -x' values between two collections.
+    Interval is the difference of kstat snaptime, so it does not depend on scrape timings.
+    Example:
+    iostat_values = iostat_calculator.update({('sd', 'sd0'): {'reads': 10.0, ..., 'snaptime': 1234.5}})
+    returns {('sd', 'sd0'): [('reads_per_sec', 2.0), ...]} for devices known from previous update
+    """
+    # kstat statistics required for calculation
+    statistics = ('reads', 'writes', 'nread', 'nwritten', 'wtime', 'rtime', 'wlentime', 'rlentime', 'snaptime')
+    # 32-bit (uint_t) counters of kstat_io_t, they wrap while 64-bit counters go on
+    wrapping_statistics = ('reads', 'writes')
+
+    def __init__(self):
+        self.previous = {}
+        self.lock = threading.Lock()
+
+    def update(self, current):
+        with self.lock:
+            previous = self.previous
+            self.previous = current
+        iostat_values = {}
+        for device, new in current.items():
+            old = previous.get(device)
+            if old is None or len(old) != len(self.statistics) or len(new) != len(self.statistics):
+                continue
+            delta = dict((statistic, new[statistic] - old[statistic]) for statistic in self.statistics)
+            if min(value for statistic, value in delta.items() if statistic not in self.wrapping_statistics) >= 0:
+                for statistic in self.wrapping_statistics:
+                    if delta[statistic] < 0 and old[statistic] < 2 ** 32:
+                        delta[statistic] += 2 ** 32
+            elapsed = delta['snaptime']
+            if elapsed <= 0 or min(delta.values()) < 0:
+                # no new snapshot or counters were reset
+                continue
+            operations = delta['reads'] + delta['writes']
+            if operations > 0:
+                wsvc_t = delta['wlentime'] / operations * 1000
+                asvc_t = delta['rlentime'] / operations * 1000
+            else:
+                wsvc_t = asvc_t = 0.0
+            iostat_values[device] = [
+                ('reads_per_sec', delta['reads'] / elapsed),
+                ('writes_per_sec', delta['writes'] / elapsed),
+                ('kbytes_read_per_sec', delta['nread'] / 1024 / elapsed),
+                ('kbytes_written_per_sec', delta['nwritten'] / 1024 / elapsed),
+                ('wait', delta['wlentime'] / elapsed),
+                ('actv', delta['rlentime'] / elapsed),
+                ('wsvc_t_ms', wsvc_t),
+                ('asvc_t_ms', asvc_t),
+                ('wait_percent', delta['wtime'] / elapsed * 100),
+                ('busy_percent', delta['rtime'] / elapsed * 100),
+            ]
+        return iostat_values
+
+
+class DiskIOCollector(BaseCollector):
     """
     Disk IO Stats
     """
     # timeout how match seconds is allowed to collect data
     max_time_to_run = 4
-    disk_io_collector_timeouts = Counter('solaris_exporter_diskio_usage_timeouts',
-                                         'Number of times when collector ran' +
-                                         ' more than ' + str(max_time_to_run) + ' seconds')
-    disk_io_collector_errors = Counter('solaris_exporter_diskio_usage_errors', 'Number of times when collector ran' +
-                                       ' with errors')
-    disk_io_collector_run_time = Gauge('solaris_exporter_diskio_usage_processing', 'Time spent processing request')
-
-    def collect(self):
-        with self.disk_io_collector_run_time.time():
-            output, task_return_code, task_timeouted = run_shell_command('kstat -p -c disk', self.max_time_to_run)
-            disk_io_usage = CounterMetricFamily("solaris_exporter_diskio_usage", 'kstat counters',
-                                                labels=['driver', 'name', 'statistic', 'stat_desc',
-                                                        'admin_name', 'admin_desc', 'host'])
-            if task_return_code == 0 and task_timeouted is False:
-                lines = output.splitlines()
-                for line in lines:
-                    kstatkeyvalue = line.split("\t")
-                    kstatkeyvalue[0] = re.sub('[ ,!=]', '_', kstatkeyvalue[0]).replace(",", ".")
-                    kstatkey = kstatkeyvalue[0].split(":")
-                    driver = kstatkey[0]
-                    # instance = kstatkey[1]
-                    name = kstatkey[2]
-                    statistic = kstatkey[3]
-                    value = kstatkeyvalue[1]
-
-                    # skip useless values
-                    if value == "" or value == "disk":
-                        continue
-                    # skip useless statistic
-                    if statistic in ['wlastupdate', 'rlastupdate', 'rcnt', 'wcnt', 'crtime', 'snaptime']:
-                        continue
-
-                    # resolve admin_name and admin_desc via dictionary
-                    try:
-                        admin_name = disk_dictionary[name][0]
-                        admin_desc = disk_dictionary[name][1]
-                    except KeyError:
-                        admin_name = "unknown"
-                        admin_desc = "unknown"
-
-                    # resolve stat_desc via dictionary
-                    try:
-                        stat_desc = disk_operations_dictionary[statistic]
-                    except KeyError:
-                        stat_desc = "unknown"
+    timeouts_metric = 'solaris_exporter_diskio_usage_timeouts'
+    errors_metric = 'solaris_exporter_diskio_usage_errors'
+    processing_metric = 'solaris_exporter_diskio_usage_processing'
+    skipped_statistics = frozenset(['wlastupdate', 'rlastupdate', 'rcnt', 'wcnt', 'crtime', 'snaptime'])
+
+    def __init__(self):
+        super(DiskIOCollector, self).__init__()
+        self.iostat_calculator = IostatCalculator()
+
+    def collect_metrics(self):
+        records, task_return_code, task_timeouted = kstat_reader.read([], 'disk', self.max_time_to_run)
+        disk_dictionary = disk_index.disks
+        disk_io_usage = FilteredCounterMetricFamily("solaris_exporter_diskio_usage", 'kstat counters',
+                                                    labels=['driver', 'name', 'statistic', 'stat_desc',
+                                                            'admin_name', 'admin_desc', 'host'])
+        disk_iostat = FilteredGaugeMetricFamily("solaris_exporter_diskio_iostat",
+                                                "'iostat -x' values calculated between two collections",
+                                                labels=['driver', 'name', 'statistic', 'admin_name', 'host'])
+        # {(driver, name): {statistic: value}} for iostat_calculator
+        disk_io_counters = {}
+        # {name: (admin_name, admin_desc)}
+        disk_admin_labels = {}
+        if task_return_code == 0 and task_timeouted is False:
+            for driver, instance, name, statistic, value in records:
+                # skip useless values
+                if value == "" or value == "disk":
+                    continue
+                if diskio_iostat_gauges and statistic in IostatCalculator.statistics:
+                    disk_io_counters.setdefault((driver, name), {})[statistic] = float(value)
+                # skip useless statistic
+                if statistic in self.skipped_statistics:
+                    continue
 
-                    disk_io_usage.add_metric([driver, name, statistic, stat_desc, admin_name, admin_desc,
-                                              host_name], float(value))
-            else:
-                self.disk_io_collector_errors.inc()
-                if task_timeouted:
-                    self.disk_io_collector_timeouts.inc()
-            yield disk_io_usage
+                # admin_name and admin_desc are resolved via dictionary once per disk
+                admin_labels = disk_admin_labels.get(name)
+                if admin_labels is None:
+                    admin_labels = tuple(disk_dictionary.get(name, ["unknown", "unknown"])[:2])
+                    disk_admin_labels[name] = admin_labels
+
+                disk_io_usage.add_metric([driver, name, statistic,
+                                          disk_operations_dictionary.get(statistic, "unknown"),
+                                          admin_labels[0], admin_labels[1], host_name], float(value))
+
+            if diskio_iostat_gauges:
+                iostat_values = self.iostat_calculator.update(disk_io_counters)
+                for driver, name in sorted(iostat_values):
+                    admin_name = disk_dictionary.get(name, ["unknown"])[0]
+                    for statistic, value in iostat_values[(driver, name)]:
+                        disk_iostat.add_metric([driver, name, statistic, admin_name, host_name], value)
+        else:
+            self.count_error(task_timeouted)
+        yield disk_io_usage
+        if diskio_iostat_gauges:
+            yield disk_iostat
 
 
-class DiskErrorCollector(object):
+class DiskErrorCollector(BaseCollector):
     """
     Disk Error Stats
     """
     # timeout how match seconds is allowed to collect data
     max_time_to_run = 4
-    disk_er_collector_timeouts = Counter('solaris_exporter_disk_error_collector_timeouts',
-                                         'Number of times when collector ran' +
-                                         ' more than ' + str(max_time_to_run) + ' seconds')
-    disk_er_collector_errors = Counter('solaris_exporter_disk_error_collector_errors',
-                                       'Number of times when collector ran' +
-                                       ' with errors')
-    disk_er_collector_run_time = Gauge('solaris_exporter_disk_errors_collector_processing',
-                                       'Time spent processing request')
-
-    def collect(self):
-        with self.disk_er_collector_run_time.time():
-            output, task_return_code, task_timeouted = run_shell_command('kstat -p -c device_error :::/.*Errors/',
-                                                                         self.max_time_to_run)
-            disk_errors = CounterMetricFamily("solaris_exporter_disk_errors", 'kstat counters',
-                                              labels=['driver', 'name', 'statistic',
-                                                      'admin_name', 'admin_desc', 'host'])
-            if task_return_code == 0 and task_timeouted is False:
-                lines = output.splitlines()
-
-                for line in lines:
-                    kstatkeyvalue = line.split("\t")  # sderr:58:sd58,err:Transport Errors
-                    kstatkeyvalue[0] = re.sub('[ ,!=]', '_', kstatkeyvalue[0]).replace(",", ".")
-                    kstatkey = kstatkeyvalue[0].split(":")
-                    module = kstatkey[0].replace('err', '')
-                    # instance = kstatkey[1]
-                    name = kstatkey[2].replace('_err', '')
-                    statistic = kstatkey[3]
-                    value = kstatkeyvalue[1]
-
-                    # resolve admin_name and admin_desc via dictionary
-                    try:
-                        admin_name = disk_dictionary[name][0]
-                        admin_desc = disk_dictionary[name][1]
-                    except KeyError:
-                        admin_name = "unknown"
-                        admin_desc = "unknown"
-
-                    disk_errors.add_metric([module, name, statistic, admin_name, admin_desc,
-                                            host_name], float(value))
-            else:
-                self.disk_er_collector_errors.inc()
-                if task_timeouted:
-                    self.disk_er_collector_timeouts.inc()
-            yield disk_errors
+    timeouts_metric = 'solaris_exporter_disk_error_collector_timeouts'
+    errors_metric = 'solaris_exporter_disk_error_collector_errors'
+    processing_metric = 'solaris_exporter_disk_errors_collector_processing'
+
+    def collect_metrics(self):
+        records, task_return_code, task_timeouted = kstat_reader.read([':::/.*Errors/'], 'device_error',
+                                                                      self.max_time_to_run)
+        disk_dictionary = disk_index.disks
+        disk_errors = FilteredCounterMetricFamily("solaris_exporter_disk_errors", 'kstat counters',
+                                                  labels=['driver', 'name', 'statistic',
+                                                          'admin_name', 'admin_desc', 'host'])
+        if task_return_code == 0 and task_timeouted is False:
+            # {(module, name): (driver, disk name, admin_name, admin_desc)}, resolved once per disk
+            disk_labels = {}
+            for module, instance, name, statistic, value in records:
+                labels = disk_labels.get((module, name))
+                if labels is None:
+                    # sderr:58:sd58_err:Transport_Errors
+                    disk_name = name.replace('_err', '')
+                    admin_labels = disk_dictionary.get(disk_name, ["unknown", "unknown"])
+                    labels = (module.replace('err', ''), disk_name, admin_labels[0], admin_labels[1])
+                    disk_labels[(module, name)] = labels
+
+                disk_errors.add_metric([labels[0], labels[1], statistic, labels[2], labels[3],
+                                        host_name], float(value))
+        else:
+            self.count_error(task_timeouted)
+        yield disk_errors
 
 
-class CpuLoadCollector(object):
+class CpuLoadCollector(BaseCollector):
     """
     CPU load average 1, 5, 15 min, cpu count
     """
-    cpu_load_collector_run_time = Gauge('solaris_exporter_cpu_load_processing', 'Time spent processing request')
-
-    def collect(self):
-        with self.cpu_load_collector_run_time.time():
-            worker_stat_cpu_load = GaugeMetricFamily('solaris_exporter_cpu_load',
-                                                     'python psutil counters, system load avg.',
-                                                     labels=['host', 'statistic'])
-            cpuinfo = os.getloadavg()
-            worker_stat_cpu_load.add_metric([host_name, 'load1m'], cpuinfo[0])
-            worker_stat_cpu_load.add_metric([host_name, 'load5m  '], cpuinfo[1])
-            worker_stat_cpu_load.add_metric([host_name, 'load15m'], cpuinfo[2])
-            cpuinfo = len(psutil.cpu_percent(interval=None, percpu=True))
-            worker_stat_cpu_load.add_metric([host_name, 'vcpu'], cpuinfo)
+    processing_metric = 'solaris_exporter_cpu_load_processing'
+
+    def collect_metrics(self):
+        worker_stat_cpu_load = FilteredGaugeMetricFamily('solaris_exporter_cpu_load',
+                                                         'python psutil counters, system load avg.',
+                                                         labels=['host', 'statistic'])
+        cpuinfo = os.getloadavg()
+        worker_stat_cpu_load.add_metric([host_name, 'load1m'], cpuinfo[0])
+        worker_stat_cpu_load.add_metric([host_name, 'load5m  '], cpuinfo[1])
+        worker_stat_cpu_load.add_metric([host_name, 'load15m'], cpuinfo[2])
+        cpuinfo = len(psutil.cpu_percent(interval=None, percpu=True))
+        worker_stat_cpu_load.add_metric([host_name, 'vcpu'], cpuinfo)
         yield worker_stat_cpu_load
 
 
-class CpuTimeCollector(object):
+class CpuTimeCollector(BaseCollector):
     """
     CPU time may be translated in percent later
     """
-    cpu_time_collector_run_time = Gauge('solaris_exporter_cpu_time_processing', 'Time spent processing request')
-
-    def collect(self):
-        with self.cpu_time_collector_run_time.time():
-            worker_stat_cpu_time = CounterMetricFamily('solaris_exporter_cpu_time',
-                                                       'python psutil counters, CPU usage time.',
-                                                       labels=['host', 'statistic'])
-            cpuinfo = psutil.cpu_times(percpu=False)
-            worker_stat_cpu_time.add_metric([host_name, 'user'], cpuinfo.user)
-            worker_stat_cpu_time.add_metric([host_name, 'system'], cpuinfo.system)
-            worker_stat_cpu_time.add_metric([host_name, 'idle'], cpuinfo.idle)
-            worker_stat_cpu_time.add_metric([host_name, 'oiwait'], cpuinfo.iowait)
+    processing_metric = 'solaris_exporter_cpu_time_processing'
+
+    def collect_metrics(self):
+        worker_stat_cpu_time = FilteredCounterMetricFamily('solaris_exporter_cpu_time',
+                                                           'python psutil counters, CPU usage time.',
+                                                           labels=['host', 'statistic'])
+        cpuinfo = psutil.cpu_times(percpu=False)
+        worker_stat_cpu_time.add_metric([host_name, 'user'], cpuinfo.user)
+        worker_stat_cpu_time.add_metric([host_name, 'system'], cpuinfo.system)
+        worker_stat_cpu_time.add_metric([host_name, 'idle'], cpuinfo.idle)
+        worker_stat_cpu_time.add_metric([host_name, 'oiwait'], cpuinfo.iowait)
         yield worker_stat_cpu_time
 
 
-class MemCollector(object):
+class MemCollector(BaseCollector):
     """
     Memory and SWAP Stats
     """
-    mem_collector_run_time = Gauge('solaris_exporter_MemCollector_processing', 'Time spent processing request')
-
-    def collect(self):
-        with self.mem_collector_run_time.time():
-            worker_stat_mem = GaugeMetricFamily('solaris_exporter_memory_usage_bytes',
-                                                'python psutil counters, Memory usage in bytes.',
-                                                labels=['host', 'type', 'counter'])
-            ram = psutil.virtual_memory()
-            worker_stat_mem.add_metric([host_name, 'virtual', 'used'], ram.used)
-            worker_stat_mem.add_metric([host_name, 'virtual', 'available'], ram.available)
-            worker_stat_mem.add_metric([host_name, 'virtual', 'total'], ram.total)
-            worker_stat_mem.add_metric([host_name, 'virtual', 'free'], ram.free)
-
-            # try:
-            #    swap = psutil.swap_memory()
-            # except ValueError:
-            # print('old version of psutil module, skipping swap stat, you need to update it to 5.9.0+ and run '
-            #       'Python3.7')
-            # see https://github.com/n27051538/solaris_exporter/issues/7
-            swap = psutil_local_swap_memory()
-
-            worker_stat_mem.add_metric([host_name, 'swap', 'total'], swap.total)
-            worker_stat_mem.add_metric([host_name, 'swap', 'used'], swap.used)
-            worker_stat_mem.add_metric([host_name, 'swap', 'free'], swap.free)
-            worker_stat_mem.add_metric([host_name, 'swap', 'sin'], swap.sin)
-            worker_stat_mem.add_metric([host_name, 'swap', 'sout'], swap.sout)
+    processing_metric = 'solaris_exporter_MemCollector_processing'
+
+    def collect_metrics(self):
+        worker_stat_mem = FilteredGaugeMetricFamily('solaris_exporter_memory_usage_bytes',
+                                                    'python psutil counters, Memory usage in bytes.',
+                                                    labels=['host', 'type', 'counter'])
+        ram = psutil.virtual_memory()
+        worker_stat_mem.add_metric([host_name, 'virtual', 'used'], ram.used)
+        worker_stat_mem.add_metric([host_name, 'virtual', 'available'], ram.available)
+        worker_stat_mem.add_metric([host_name, 'virtual', 'total'], ram.total)
+        worker_stat_mem.add_metric([host_name, 'virtual', 'free'], ram.free)
+
+        # try:
+        #    swap = psutil.swap_memory()
+        # except ValueError:
+        # print('old version of psutil module, skipping swap stat, you need to update it to 5.9.0+ and run '
+        #       'Python3.7')
+        # see https://github.com/n27051538/solaris_exporter/issues/7
+        swap = psutil_local_swap_memory()
+
+        worker_stat_mem.add_metric([host_name, 'swap', 'total'], swap.total)
+        worker_stat_mem.add_metric([host_name, 'swap', 'used'], swap.used)
+        worker_stat_mem.add_metric([host_name, 'swap', 'free'], swap.free)
+        worker_stat_mem.add_metric([host_name, 'swap', 'sin'], swap.sin)
+        worker_stat_mem.add_metric([host_name, 'swap', 'sout'], swap.sout)
 
         yield worker_stat_mem
 
@@ -593,267 +1875,366 @@ def psutil_local_swap_memory():
     return sswap(total, used, free, percent, sin * page_size, sout * page_size)
 
 
-class DiskSpaceCollector(object):
+def statvfs_usage(st):
     """
-    Disk space stats
-    Note that UFS inode info is NOT collected.
+    Returns (total, used, free, percent) from os.statvfs() result, calculated as psutil.disk_usage() does
     """
-    max_time_to_run = 4
-    disk_space_collector_run_time = Gauge('solaris_exporter_diskspace_worker', 'Time spent processing request')
+    total = st.f_blocks * st.f_frsize
+    avail_to_root = st.f_bfree * st.f_frsize
+    avail_to_user = st.f_bavail * st.f_frsize
+    used = total - avail_to_root
+    total_user = used + avail_to_user
+    try:
+        percent = round(float(used) / total_user * 100, 1)
+    except ZeroDivisionError:
+        percent = 0.0
+    return total, used, avail_to_user, percent
 
-    def collect(self):
-        with self.disk_space_collector_run_time.time():
-            worker_stat_space = GaugeMetricFamily('solaris_exporter_diskspace_usage_bytes',
-                                                  'python psutil counters, diskspace usage in bytes.',
-                                                  labels=['host', 'statistic', 'mountpoint', 'device', 'fstype', ])
-
-            # disk_partitions = my_disk_partitions(all=False)   # rewritten due to bug: https://github.com/giampaolo/psutil/issues/1674
-            disk_partitions = cext.disk_partitions()
-            ufs_total = 0
-            zfs_total = 0
-            for partition in disk_partitions:
-                device, mountpoint, fstype, opts = partition
-                if fstype not in ['zfs', 'ufs']:
-                    continue
-                if '/VARSHARE' in device:
-                    continue
-                try:
-                    spaceinfo = psutil.disk_usage(mountpoint)
-                except OSError:
-                    continue
 
-                if fstype == 'ufs':
-                    ufs_total = ufs_total + spaceinfo.total
+class MountIndex(object):
+    """
+    zfs and ufs filesystems from /etc/mnttab.
+    mnttab is parsed again only when its mtime, size or inode is changed (mntfs changes them on mount/umount).
+    """
 
-                worker_stat_space.add_metric([host_name, 'used', mountpoint, device, fstype], spaceinfo.used)
-                worker_stat_space.add_metric([host_name, 'total', mountpoint, device, fstype], spaceinfo.total)
-                worker_stat_space.add_metric([host_name, 'free', mountpoint, device, fstype], spaceinfo.free)
-                worker_stat_space.add_metric([host_name, 'percent', mountpoint, device, fstype], spaceinfo.percent)
-        yield worker_stat_space
+    def __init__(self):
+        self.mounts = []
+        self.mnttab_key = None
+        self.lock = threading.Lock()
 
-        # zfs info from ps_util is wrong when getting quota in solaris zone, get if from 'df -k /'
+    def get_mounts(self):
+        """
+        Returns list of (device, mountpoint, fstype)
+        """
+        try:
+            stat = os.stat('/etc/mnttab')
+            mnttab_key = (stat.st_mtime, stat.st_size, stat.st_ino)
+        except OSError:
+            mnttab_key = None
+        with self.lock:
+            if mnttab_key is None or mnttab_key != self.mnttab_key:
+                mounts = []
+                # disk_partitions = my_disk_partitions(all=False)   # rewritten due to bug: https://github.com/giampaolo/psutil/issues/1674
+                for device, mountpoint, fstype, opts in cext.disk_partitions():
+                    if fstype not in ['zfs', 'ufs']:
+                        continue
+                    if '/VARSHARE' in device:
+                        continue
+                    mounts.append((device, mountpoint, fstype))
+                self.mounts = mounts
+                self.mnttab_key = mnttab_key
+            return self.mounts
+
+
+class DiskSpaceCollector(BaseCollector):
+    """
+    Disk space stats
+    Note that UFS inode info is NOT collected.
+    """
+    max_time_to_run = 4
+    processing_metric = 'solaris_exporter_diskspace_worker'
+    disk_space_statvfs_timeouts = Counter('solaris_exporter_diskspace_statvfs_timeouts',
+                                          'Number of mountpoints skipped due to statvfs timeout')
+
+    # value of 'host' label, None - host_name
+    host = None
+
+    def __init__(self, mount_index=None, statvfs_pool=None):
+        super(DiskSpaceCollector, self).__init__()
+        self.mount_index = mount_index or MountIndex()
+        self.statvfs_pool = statvfs_pool or WorkerPool(diskspace_statvfs_workers, 'solaris_exporter_statvfs')
+        # statvfs tasks not completed in previous collections, {path: WorkerTask}
+        self.pending_tasks = {}
+
+    def get_mounts(self):
+        """
+        Returns list of (device, mountpoint, fstype, path for statvfs)
+        """
+        return [(device, mountpoint, fstype, mountpoint)
+                for device, mountpoint, fstype in self.mount_index.get_mounts()]
+
+    def statvfs_mounts(self, mounts):
+        """
+        Returns list of (device, mountpoint, fstype, statvfs result) for mounts answered in max_time_to_run.
+        Mountpoint with hung statvfs gets no new task until the old one is completed,
+        so it could not occupy all workers of the pool.
+        """
+        stop_time = monotonic_time() + self.max_time_to_run
+        tasks = []
+        for device, mountpoint, fstype, path in mounts:
+            task = self.pending_tasks.get(path)
+            if task is None or task.done.is_set():
+                task = self.statvfs_pool.submit(os.statvfs, path)
+            tasks.append((device, mountpoint, fstype, path, task))
+        pending_tasks = {}
+        snapshot = []
+        for device, mountpoint, fstype, path, task in tasks:
+            if not task.wait(max(stop_time - monotonic_time(), 0)):
+                pending_tasks[path] = task
+                self.disk_space_statvfs_timeouts.inc()
+                continue
+            if task.error is not None:
+                continue
+            snapshot.append((device, mountpoint, fstype, task.result))
+        self.pending_tasks = pending_tasks
+        return snapshot
+
+    def collect_metrics(self):
+        worker_stat_space = FilteredGaugeMetricFamily('solaris_exporter_diskspace_usage_bytes',
+                                                      'python psutil counters, diskspace usage in bytes.',
+                                                      labels=['host', 'statistic', 'mountpoint', 'device', 'fstype', ])
+
+        host = self.host or host_name
+        snapshot = self.statvfs_mounts(self.get_mounts())
+        ufs_total = 0
         zfs_total = 0
-        output, task_return_code, task_timeouted = run_shell_command('df -kFzfs /', self.max_time_to_run)
-        if task_return_code == 0 and task_timeouted is False:
-            lines = output.splitlines()
-            try:
-                line = lines[1] + lines[2]
-            except IndexError:
-                try:
-                    line = lines[1]
-                except IndexError:
-                    line = ""
-            zfs_root_string = line.split()
-            try:
-                zfs_total = float(zfs_root_string[1]) * 1024
-            except IndexError, ValueError:
-                zfs_total = 0
+        for device, mountpoint, fstype, st in snapshot:
+            total, used, free, percent = statvfs_usage(st)
+
+            if fstype == 'ufs':
+                ufs_total = ufs_total + total
+            elif mountpoint == '/':
+                # every zfs dataset reports size of the whole pool, take only root (it is limited by zone quota)
+                zfs_total = total
+
+            worker_stat_space.add_metric([host, 'used', mountpoint, device, fstype], used)
+            worker_stat_space.add_metric([host, 'total', mountpoint, device, fstype], total)
+            worker_stat_space.add_metric([host, 'free', mountpoint, device, fstype], free)
+            worker_stat_space.add_metric([host, 'percent', mountpoint, device, fstype], percent)
+        yield worker_stat_space
 
-        inventory_space_family = GaugeMetricFamily('solaris_exporter_inventory_diskspace_gb', 'diskspace inventory',
-                                                   labels=['host'])
+        inventory_space_family = FilteredGaugeMetricFamily('solaris_exporter_inventory_diskspace_gb', 'diskspace inventory',
+                                                           labels=['host'])
 
-        if zonename != "global":
+        if zonename != "global" or self.host is not None:
             # use for non-global zones
             inventory_space = ufs_total + zfs_total
         else:
             # use for global zones information from iostat -En
             inventory_space = 0
+            disk_dictionary = disk_index.disks
             for key in disk_dictionary:
                 try:
                     value = float(disk_dictionary[key][2])
-                except IndexError, ValueError:
+                except (IndexError, ValueError):
                     value = 0
                 inventory_space = inventory_space + value
             if inventory_space == 0:
                 inventory_space = ufs_total + zfs_total
         inventory_space = round(inventory_space / 1024 / 1024 / 1024, 1)
-        inventory_space_family.add_metric([host_name], inventory_space)
+        inventory_space_family.add_metric([host], inventory_space)
         yield inventory_space_family
 
 
-class CurTimeCollector(object):
+class ZoneDiskSpaceCollector(DiskSpaceCollector):
+    """
+    Disk space of local zone for zone target of global zone exporter.
+    Zone filesystems are taken from mnttab of global zone (mounted under zonepath/root),
+    mountpoints are exported as they are seen in zone, 'host' label is zone name.
+    """
+    processing_metric = None
+
+    def __init__(self, zone, zonepath, mount_index=None, statvfs_pool=None):
+        super(ZoneDiskSpaceCollector, self).__init__(mount_index, statvfs_pool)
+        self.host = zone
+        self.zone_root = zonepath.rstrip('/') + '/root'
+
+    def get_mounts(self):
+        mounts = []
+        for device, path, fstype in self.mount_index.get_mounts():
+            if path == self.zone_root:
+                mounts.append((device, '/', fstype, path))
+            elif path.startswith(self.zone_root + '/'):
+                mounts.append((device, path[len(self.zone_root):], fstype, path))
+        return mounts
+
+
+class CurTimeCollector(BaseCollector):
     """
     current_time - For Dirty comparation with Prometheus server time.
     """
 
-    def collect(self):
-        cur_time_metric_family = CounterMetricFamily('solaris_exporter_current_time_seconds', 'Current time of system',
-                                                     labels=[])
+    def collect_metrics(self):
+        cur_time_metric_family = FilteredCounterMetricFamily('solaris_exporter_current_time_seconds', 'Current time of system',
+                                                             labels=[])
         cur_time_metric_family.add_metric([], time.time())
         yield cur_time_metric_family
 
 
-class InventoryCPUCollector(object):
+class InventoryCPUCollector(BaseCollector):
     """
     'inventory' cpu checker
     """
     # timeout how match seconds is allowed to collect data
     max_time_to_run = 4
-    inventory_cpu_collector_run_time = Gauge('solaris_exporter_inventory_vcpu_processing',
-                                             'Time spent processing request')
+    # seconds to use cached command output
+    cache_ttl_sec = 600
+    processing_metric = 'solaris_exporter_inventory_vcpu_processing'
 
-    def collect(self):
-        with self.inventory_cpu_collector_run_time.time():
-            output, task_return_code, task_timeouted = run_shell_command('/usr/sbin/psrinfo',
-                                                                         self.max_time_to_run)
-            if task_return_code == 0 and task_timeouted is False:
-                lines = output.splitlines()
-                inventory_cpu_family = GaugeMetricFamily("solaris_exporter_inventory_vcpu",
-                                                         'vcpu inventory information',
-                                                         labels=['host'])
-                cpus = 0
-                for line in lines:
-                    line = line.strip()
-                    if any(s in line for s in ['on-line']):
-                        cpus += 1
-                inventory_cpu_family.add_metric([host_name], float(cpus))
-                yield inventory_cpu_family
+    def collect_metrics(self):
+        output, task_return_code, task_timeouted = run_cached_command('/usr/sbin/psrinfo',
+                                                                      self.max_time_to_run, self.cache_ttl_sec)
+        if task_return_code == 0 and task_timeouted is False:
+            lines = output.splitlines()
+            inventory_cpu_family = FilteredGaugeMetricFamily("solaris_exporter_inventory_vcpu",
+                                                             'vcpu inventory information',
+                                                             labels=['host'])
+            cpus = 0
+            for line in lines:
+                line = line.strip()
+                if any(s in line for s in ['on-line']):
+                    cpus += 1
+            inventory_cpu_family.add_metric([host_name], float(cpus))
+            yield inventory_cpu_family
 
 
-class InventoryMemCollector(object):
+class InventoryMemCollector(BaseCollector):
     """
     'inventory' mem checker
     """
     # timeout how match seconds is allowed to collect data
     max_time_to_run = 4
-    inventory_mem_collector_run_time = Gauge('solaris_exporter_inventory_memory_processing',
-                                             'Time spent processing request')
+    # seconds to use cached command output
+    cache_ttl_sec = 3600
+    processing_metric = 'solaris_exporter_inventory_memory_processing'
+    errors_metric = 'solaris_exporter_inventory_memory_errors'
+    timeouts_metric = 'solaris_exporter_inventory_memory_timeouts'
 
-    def collect(self):
-        with self.inventory_mem_collector_run_time.time():
+    def collect_metrics(self):
 
-            inventory_mem_family = GaugeMetricFamily("solaris_exporter_inventory_memory_gb",
-                                                     'mem inventory information',
-                                                     labels=['host'])
+        inventory_mem_family = FilteredGaugeMetricFamily("solaris_exporter_inventory_memory_gb",
+                                                         'mem inventory information',
+                                                         labels=['host'])
 
-            output, task_return_code, task_timeouted = run_shell_command(
-                "/usr/bin/prctl -n zone.max-swap -t privileged -P " + str(os.getpid()),
-                self.max_time_to_run)
-            swap = 0
-            if task_return_code == 0 and task_timeouted is False:
-                lines = output.splitlines()
-                for line in lines:
-                    line = line.strip()
-                    if any(s in line for s in ['privileged']):
-                        memkeyvalue = line.split(" ")
-                        try:
-                            swap = memkeyvalue[2]
-                            swap = round(float(swap) / 1024 / 1024 / 1024, 1)
-                        except IndexError, ValueError:
-                            swap = 0
-
-            mem = 0
-            output, task_return_code, task_timeouted = run_shell_command("/usr/sbin/prtconf",
-                                                                         self.max_time_to_run)
-            if task_return_code == 0 and task_timeouted is False:
-                lines = output.splitlines()
-                for line in lines:
-                    line = line.strip()
-                    if any(s in line for s in ['Megabytes']):
-                        memkeyvalue = line.split(" ")
-                        try:
-                            mem = memkeyvalue[2]
-                            mem = round(float(mem) / 1024, 1)
-                        except IndexError, ValueError:
-                            mem = 0
-            else:
-                self.inventory_mem_collector_errors.inc()
-                if task_timeouted:
-                    self.inventory_mem_collector_timeouts.inc()
+        output, task_return_code, task_timeouted = run_cached_command(
+            "/usr/bin/prctl -n zone.max-swap -t privileged -P " + str(os.getpid()),
+            self.max_time_to_run, self.cache_ttl_sec)
+        swap = 0
+        if task_return_code == 0 and task_timeouted is False:
+            lines = output.splitlines()
+            for line in lines:
+                line = line.strip()
+                if any(s in line for s in ['privileged']):
+                    memkeyvalue = line.split(" ")
+                    try:
+                        swap = memkeyvalue[2]
+                        swap = round(float(swap) / 1024 / 1024 / 1024, 1)
+                    except (IndexError, ValueError):
+                        swap = 0
+
+        mem = 0
+        output, task_return_code, task_timeouted = run_cached_command("/usr/sbin/prtconf",
+                                                                      self.max_time_to_run, self.cache_ttl_sec)
+        if task_return_code == 0 and task_timeouted is False:
+            lines = output.splitlines()
+            for line in lines:
+                line = line.strip()
+                if any(s in line for s in ['Megabytes']):
+                    memkeyvalue = line.split(" ")
+                    try:
+                        mem = memkeyvalue[2]
+                        mem = round(float(mem) / 1024, 1)
+                    except (IndexError, ValueError):
+                        mem = 0
+        else:
+            self.count_error(task_timeouted)
 
-            if swap == 0 or mem < swap:
-                inventory_mem = mem
-            else:
-                inventory_mem = swap
+        if swap == 0 or mem < swap:
+            inventory_mem = mem
+        else:
+            inventory_mem = swap
 
-            inventory_mem_family.add_metric([host_name], inventory_mem)
-            yield inventory_mem_family
+        inventory_mem_family.add_metric([host_name], inventory_mem)
+        yield inventory_mem_family
 
 
-class InventoryOSinfoCollector(object):
+class InventoryOSinfoCollector(BaseCollector):
     """
     Read OS info
     """
-    InventoryOSinfoCollector_run_time = Gauge('solaris_exporter_inventory_osinfo_processing',
-                                              'Time spent processing request')
+    processing_metric = 'solaris_exporter_inventory_osinfo_processing'
     # timeout how match seconds is allowed to collect data
     max_time_to_run = 4
+    # seconds to use cached command output
+    cache_ttl_sec = 3600
+
+    def collect_metrics(self):
+        pretty_name = "Solaris"
+        uname_v = 'unknown'
+        model = 'unknown'
+        virttype = 'none'
+        vmname = 'none'
+
+        # pretty_name
+        with open('/etc/release', 'r') as text_object:
+            output = text_object.read()
+            text_object.close
+            lines = output.splitlines()
+            pretty_name = lines[0].strip()
 
-    def collect(self):
-        with self.InventoryOSinfoCollector_run_time.time():
-            pretty_name = "Solaris"
-            uname_v = 'unknown'
-            model = 'unknown'
-            virttype = 'none'
-            vmname = 'none'
-
-            # pretty_name
-            with open('/etc/release', 'r') as text_object:
-                output = text_object.read()
-                text_object.close
-                lines = output.splitlines()
-                pretty_name = lines[0].strip()
+        inventory_os = FilteredGaugeMetricFamily("solaris_exporter_inventory_osinfo", 'os inventory information',
+                                                 labels=['host', 'pretty_name', 'uname_v', 'model', 'virttype',
+                                                         'vmname'])
 
-            inventory_os = GaugeMetricFamily("solaris_exporter_inventory_osinfo", 'os inventory information',
-                                             labels=['host', 'pretty_name', 'uname_v', 'model', 'virttype', 'vmname'])
+        # uname_v
+        output, task_return_code, task_timeouted = run_cached_command("/usr/bin/uname -v",
+                                                                      self.max_time_to_run, self.cache_ttl_sec)
+        if task_return_code == 0 and task_timeouted is False:
+            lines = output.splitlines()
+            uname_v = lines[0].strip()
 
-            # uname_v
-            output, task_return_code, task_timeouted = run_shell_command("/usr/bin/uname -v",
-                                                                         self.max_time_to_run)
-            if task_return_code == 0 and task_timeouted is False:
-                lines = output.splitlines()
-                uname_v = lines[0].strip()
+        # model
+        output, task_return_code, task_timeouted = run_cached_command("/usr/sbin/prtconf -b", self.max_time_to_run,
+                                                                      self.cache_ttl_sec)
+        if task_return_code == 0 and task_timeouted is False:
+            lines = output.splitlines()
+            line = lines[0]
+            line = line.strip()
+            modelkeyvalue = line.split(":")
+            try:
+                model = modelkeyvalue[1]
+                model = model.strip()
+                model = model.replace("SUNW,", "").replace("ORCL,", "")
+            except IndexError:
+                model = 'unknown'
 
-            # model
-            output, task_return_code, task_timeouted = run_shell_command("/usr/sbin/prtconf -b", self.max_time_to_run)
+        # virttype, vmname
+        if zonename != "global":
+            virttype = "SolarisZone"
+            vmname = zonename
+        else:
+            ldom_name = 'unknown'
+            output, task_return_code, task_timeouted = run_cached_command("/usr/sbin/virtinfo -ap",
+                                                                          self.max_time_to_run,
+                                                                          self.cache_ttl_sec)
             if task_return_code == 0 and task_timeouted is False:
                 lines = output.splitlines()
-                line = lines[0]
-                line = line.strip()
-                modelkeyvalue = line.split(":")
-                try:
-                    model = modelkeyvalue[1]
-                    model = model.strip()
-                    model = model.replace("SUNW,", "").replace("ORCL,", "")
-                except IndexError:
-                    model = 'unknown'
-
-            # virttype, vmname
-            if zonename != "global":
-                virttype = "SolarisZone"
-                vmname = zonename
-            else:
-                ldom_name = 'unknown'
-                output, task_return_code, task_timeouted = run_shell_command("/usr/sbin/virtinfo -ap",
-                                                                             self.max_time_to_run)
-                if task_return_code == 0 and task_timeouted is False:
-                    lines = output.splitlines()
-                    for line in lines:
-                        line = line.strip()
-                        if any(s in line for s in ['DOMAINNAME|name=']):
-                            ldomkeyvalue = line.split("=")
-                            try:
-                                ldom_name = ldomkeyvalue[1]
-                            except IndexError:
-                                pass
-                    if ldom_name != 'unknown' and ldom_name != 'primary':
-                        virttype = "SolarisLDOM"
-                        vmname = ldom_name
-                    elif ldom_name == 'primary':
-                        vmname = ldom_name
-                        virttype = "none"
-
-            inventory_os.add_metric([host_name, pretty_name, uname_v, model, virttype, vmname], 1)
-            yield inventory_os
-
-
-class UpTimeCollector(object):
+                for line in lines:
+                    line = line.strip()
+                    if any(s in line for s in ['DOMAINNAME|name=']):
+                        ldomkeyvalue = line.split("=")
+                        try:
+                            ldom_name = ldomkeyvalue[1]
+                        except IndexError:
+                            pass
+                if ldom_name != 'unknown' and ldom_name != 'primary':
+                    virttype = "SolarisLDOM"
+                    vmname = ldom_name
+                elif ldom_name == 'primary':
+                    vmname = ldom_name
+                    virttype = "none"
+
+        inventory_os.add_metric([host_name, pretty_name, uname_v, model, virttype, vmname], 1)
+        yield inventory_os
+
+
+class UpTimeCollector(BaseCollector):
     """
     uptime - for reboot alarming.
     """
 
-    def collect(self):
-        uptime_metric_family = CounterMetricFamily('solaris_exporter_uptime_seconds', 'uptime of system', labels=[])
+    def collect_metrics(self):
+        uptime_metric_family = FilteredCounterMetricFamily('solaris_exporter_uptime_seconds', 'uptime of system', labels=[])
         uptime_metric_family.add_metric([], time.time() - psutil.boot_time())
         yield uptime_metric_family
 
@@ -864,608 +2245,2205 @@ def get_pset_dictionary():
     """
     pset_dictionary = {}
 
-    output, return_code, timeouted = run_shell_command("kstat -p -c misc unix::pset:ncpus", 5)
-    lines = output.splitlines()
-    for line in lines:
-        kstatkeyvalue = line.split("\t")
-        kstatkeyvalue[0] = re.sub('[ ,!=]', '_', kstatkeyvalue[0]).replace(",", ".")
-        kstatkey = kstatkeyvalue[0].split(":")
-        # kstatkey[0] always set to 'unix'
-        pset_number = kstatkey[1]
-        # kstatkey[2] always set to 'pset'
-        # kstatkey[3] always set to 'ncpus'
-        value = kstatkeyvalue[1]  # cpu number in pset
-        pset_dictionary[pset_number] = float(value)
+    records, return_code, timeouted = kstat_reader.read(['unix::pset:ncpus'], 'misc', 5)
+    # module is always 'unix', name is always 'pset', statistic is always 'ncpus'
+    for module, pset_number, name, statistic, value in records:
+        pset_dictionary[pset_number] = float(value)  # cpu number in pset
     return pset_dictionary
 
 
-class PerZoneCpuCollector(object):
+class PerZoneCpuCollector(BaseCollector):
     """
-    Solaris Zones CPU Usage with processor sets info and zone activity stats
+    Solaris Zones CPU Usage with processor sets info, zone activity and VFS I/O stats.
+    Per zone totals are taken from 'cpu:<zone id>:sys_zone_accum' kstats, so cost of collection does not depend
+    on number of CPUs. If kernel has no sys_zone_accum kstats, per CPU 'cpu:<cpu>:sys_zone_<zone id>' are summed.
     """
     # timeout how match seconds is allowed to collect data
     max_time_to_run = 25
-    per_zone_cpu_collector_timeouts = Counter('solaris_exporter_per_zone_cpu_timeouts',
-                                              'Number of times when collector ran' +
-                                              ' more than ' + str(max_time_to_run) + ' seconds')
-    per_zone_cpu_collector_errors = Counter('solaris_exporter_per_zone_cpu_errors',
-                                            'Number of times when collector ran with errors')
-    per_zone_cpu_collector_run_time = Gauge('solaris_exporter_per_zone_cpu_processing', 'Time spent processing request')
-
-    def collect(self):
-        with self.per_zone_cpu_collector_run_time.time():
-            per_zone_usage = CounterMetricFamily("solaris_exporter_per_zone_usage_total", 'kstat counters',
-                                                 labels=['zone', 'statistic', 'stat_desc', 'pset', 'host'])
-            per_zone_usage_dict = {}  # will be nested dict
+    timeouts_metric = 'solaris_exporter_per_zone_cpu_timeouts'
+    errors_metric = 'solaris_exporter_per_zone_cpu_errors'
+    processing_metric = 'solaris_exporter_per_zone_cpu_processing'
+
+    def __init__(self):
+        super(PerZoneCpuCollector, self).__init__()
+        # statistic -> index of its array, [(statistic, stat_desc, divider)] by index
+        self.statistics = []
+        for statistic in per_zone_cpu_counters_dictionary:
+            divider = 1
+            if statistic in ['cpu_nsec_kernel', 'cpu_nsec_user']:
+                divider = 1000000000  # translate nsec in sec, divided by cpus in pset later
+            self.statistics.append((statistic, statistic, per_zone_cpu_counters_dictionary[statistic], divider))
+        for statistic in per_zone_vfs_counters_dictionary:
+            name, stat_desc, divider = per_zone_vfs_counters_dictionary[statistic]
+            self.statistics.append((statistic, name, stat_desc, divider))
+        self.statistic_index = dict((s[0], i) for i, s in enumerate(self.statistics))
+        # arrays are indexed by zone id and grow to the largest seen zone id
+        self.zone_slots = 64
+        # None - not known yet, then True if sys_zone_accum kstats exist
+        self.accum_available = None
+        cpu_counters = '|'.join('^' + counter + '$' for counter in per_zone_cpu_counters_dictionary)
+        self.accum_query = "cpu::/^sys_zone_(accum|pset_[0-9]+_accum)$/:/(" + cpu_counters + "|^zonename$)/"
+        self.per_cpu_query = "cpu::/^sys_zone_([0-9]+|pset_[0-9]+_accum)$/:/(" + cpu_counters + "|^zonename$)/"
+        # zone names are also in swap caps kstats, for releases without zone_misc kstats
+        self.zone_query = ["zone_vfs:::/^(nread|nwritten|rtime|wtime)$/", "zones:::/^(zonename|nsec_waitrq)$/",
+                           "caps::/^swapresv_zone_[0-9]+$/:zonename"]
+
+    def read_cpu_records(self):
+        if self.accum_available is not False:
+            records, task_return_code, task_timeouted = kstat_reader.read([self.accum_query], 'zones',
+                                                                          self.max_time_to_run)
+            if task_return_code != 0 and not task_timeouted and self.accum_available is None:
+                # 'kstat -p' exits with 1 if nothing is matched: kernel has no sys_zone_accum kstats
+                self.accum_available = False
+            elif task_return_code != 0 or task_timeouted:
+                return records, task_return_code, task_timeouted
+            elif self.accum_available is None:
+                self.accum_available = any(name == 'sys_zone_accum' for module, instance, name, statistic, value
+                                           in records)
+            if self.accum_available:
+                return records, task_return_code, task_timeouted
+        return kstat_reader.read([self.per_cpu_query], 'zones', self.max_time_to_run)
+
+    def collect_metrics(self):
+        per_zone_usage = FilteredCounterMetricFamily("solaris_exporter_per_zone_usage_total", 'kstat counters',
+                                                     labels=['zone', 'statistic', 'stat_desc', 'pset', 'host'])
+        records, task_return_code, task_timeouted = self.read_cpu_records()
+        if task_return_code == 0 and task_timeouted is False:
+            zone_records, zone_return_code, zone_timeouted = kstat_reader.read(self.zone_query, None,
+                                                                               self.max_time_to_run)
+            if zone_return_code != 0 or zone_timeouted:
+                # zone_vfs and zone_misc are absent in some releases, cpu stats are still exported
+                zone_records = []
+            statistic_index = self.statistic_index
+            totals = [[0.0] * self.zone_slots for s in self.statistics]
+            zone_seen = [False] * self.zone_slots
+            statistic_seen = [False] * len(self.statistics)
             zonename_dict = {}
             zone_pset_dict = {}
-            query = ''
-            for counter in per_zone_cpu_counters_dictionary:
-                query += "|^" + counter + "$"
-            query = "-c zones cpu::/^sys_zone_*/:/(" + query[1:] + "|^zonename$)/"
-            # print('kstat -p '+query)
-            output, task_return_code, task_timeouted = run_shell_command('kstat -p ' + query, self.max_time_to_run)
-            if task_return_code == 0 and task_timeouted is False:
-                lines = output.splitlines()
-                for line in lines:
-                    kstatkeyvalue = line.split("\t")
-                    kstatkeyvalue[0] = re.sub('[ ,!=]', '_', kstatkeyvalue[0]).replace(",", ".")
-                    kstatkey = kstatkeyvalue[0].split(":")
-                    # kstatkey[0]            # always set to 'cpu'
-                    # kstatkey[1]            # zone_sys_number or cpu_number
-                    # kstatkey[2]            # 'sys_zone_21' or 'sys_zone_accum' or 'sys_zone_pset_0_accum'
-                    if kstatkey[2].startswith('sys_zone_pset_'):
-                        zone_pset_number = re.sub(r'sys_zone_pset_([0-9]+)_accum', r'\1', kstatkey[2])
-                        zone_sys_number = kstatkey[1]
-                        zone_pset_dict[zone_sys_number] = zone_pset_number
-                        continue
-                    elif kstatkey[2] == 'sys_zone_accum':
+            for records_set in [records, zone_records]:
+                for module, instance, name, statistic, value in records_set:
+                    # cpu:<zone id>:sys_zone_accum, cpu:<zone id>:sys_zone_pset_<pset>_accum,
+                    # cpu:<cpu>:sys_zone_<zone id>, zone_vfs:<zone id>:<zonename>, zones:<zone id>:<zonename>,
+                    # caps:<zone id>:swapresv_zone_<zone id>
+                    if module == 'cpu' and not name.endswith('_accum'):
+                        zone_id = name[9:]
+                    else:
+                        zone_id = instance
+                    if name.startswith('sys_zone_pset_'):
+                        zone_pset_dict[zone_id] = name[14:-6]
                         continue
-                    zone_sys_number = re.sub(r'^sys_zone_([0-9]+)$', r'\1', kstatkey[2])
-                    statistic = kstatkey[3]
-                    value = kstatkeyvalue[1]
                     if statistic == 'zonename':
-                        zonename_dict[zone_sys_number] = value
+                        zonename_dict[zone_id] = value
                         continue
-                    # create new nested dictionary for zone_sys_name, or preserve it if it exists
-                    per_zone_usage_dict[zone_sys_number] = per_zone_usage_dict.get(zone_sys_number, {})
-                    # add value to nested dictionary of statistic for zone_sys_name
-                    per_zone_usage_dict[zone_sys_number][statistic] = \
-                        per_zone_usage_dict[zone_sys_number].get(statistic, 0.0) + float(value)
-                # evacuate stored in dictionaries info into metrics
-                for zone_sys_number in per_zone_usage_dict.keys():
-                    for statistic in per_zone_usage_dict[zone_sys_number].keys():
-                        local_zone_name = zonename_dict.get(zone_sys_number, 'sys_zone_' + zone_sys_number)
-                        pset_number = zone_pset_dict.get(zone_sys_number, 'unknown')
-                        stat_desc = per_zone_cpu_counters_dictionary.get(statistic, 'unknown')
-                        value = per_zone_usage_dict.get(zone_sys_number, {}).get(statistic, 0.0)
-                        if statistic in ['cpu_nsec_kernel', 'cpu_nsec_user']:
-                            statistic = statistic[9:]
-                            cpus_in_pset = pset_dictionary.get(pset_number, 0)
-                            try:
-                                value = value / cpus_in_pset / 1000000000  # translate nsec in sec
-                            except ZeroDivisionError:
-                                value = 0
-                        per_zone_usage.add_metric([local_zone_name, statistic, stat_desc, pset_number, host_name],
-                                                  value)
-                    per_zone_usage.add_metric([local_zone_name, 'cpus', 'cpu number in pset', pset_number, host_name],
-                                              cpus_in_pset)
-            else:
-                self.per_zone_cpu_collector_errors.inc()
-                if task_timeouted:
-                    self.per_zone_cpu_collector_timeouts.inc()
+                    index = statistic_index.get(statistic)
+                    if index is None:
+                        continue
+                    try:
+                        zone_id = int(zone_id)
+                        value = float(value)
+                    except ValueError:
+                        continue
+                    if zone_id >= self.zone_slots:
+                        grow = zone_id + 1 - self.zone_slots
+                        for array in totals:
+                            array.extend([0.0] * grow)
+                        zone_seen.extend([False] * grow)
+                        self.zone_slots = zone_id + 1
+                    totals[index][zone_id] += value
+                    zone_seen[zone_id] = True
+                    statistic_seen[index] = True
+            # evacuate stored in arrays info into metrics
+            for zone_id in range(self.zone_slots):
+                if not zone_seen[zone_id]:
+                    continue
+                zone_sys_number = str(zone_id)
+                local_zone_name = zonename_dict.get(zone_sys_number, 'sys_zone_' + zone_sys_number)
+                pset_number = zone_pset_dict.get(zone_sys_number, 'unknown')
+                cpus_in_pset = pset_dictionary.get(pset_number, 0)
+                for index, (kstat_statistic, statistic, stat_desc, divider) in enumerate(self.statistics):
+                    if not statistic_seen[index]:
+                        continue
+                    value = totals[index][zone_id]
+                    if kstat_statistic in ['cpu_nsec_kernel', 'cpu_nsec_user']:
+                        statistic = kstat_statistic[9:]
+                        try:
+                            value = value / cpus_in_pset / divider
+                        except ZeroDivisionError:
+                            value = 0
+                    elif divider != 1:
+                        value = value / divider
+                    per_zone_usage.add_metric([local_zone_name, statistic, stat_desc, pset_number, host_name],
+                                              value)
+                per_zone_usage.add_metric([local_zone_name, 'cpus', 'cpu number in pset', pset_number, host_name],
+                                          cpus_in_pset)
+        else:
+            self.count_error(task_timeouted)
         yield per_zone_usage
 
 
-class PerZoneCapsCollector(object):
+class PerZoneCapsCollector(BaseCollector):
     """
     Solaris Zones Virtual Memory (SWAP) Resource Capping, current nprocs number in zones
     """
     # timeout how match seconds is allowed to collect data
     max_time_to_run = 25
-    per_zone_caps_collector_timeouts = Counter('solaris_exporter_per_zone_caps_timeouts',
-                                               'Number of times when collector ran' +
-                                               ' more than ' + str(max_time_to_run) + ' seconds')
-    per_zone_caps_collector_errors = Counter('solaris_exporter_per_zone_caps_errors',
-                                             'Number of times when collector ran with errors')
-    per_zone_caps_collector_run_time = Gauge('solaris_exporter_per_zone_caps_processing',
-                                             'Time spent processing request')
-
-    def collect(self):
-        with self.per_zone_caps_collector_run_time.time():
-            per_zone_caps = GaugeMetricFamily("solaris_exporter_per_zone_caps_total",
-                                              'kstat counters about zone resources',
-                                              labels=['zone', 'statistic', 'host'])
-            per_zone_caps_dict = {}  # will be nested dict
-            zonename_dict = {}
-            query = "-c zone_caps caps::/^swapresv_zone_[0-9]+$/:/^(usage|value|zonename)$/ caps::/^nprocs_zone_[0-9]+$/:usage"
-            # print('kstat -p '+query)
-            output, task_return_code, task_timeouted = run_shell_command('kstat -p ' + query, self.max_time_to_run)
-            if task_return_code == 0 and task_timeouted is False:
-                lines = output.splitlines()
-                for line in lines:
-                    kstatkeyvalue = line.split("\t")
-                    kstatkeyvalue[0] = re.sub('[ ,!=]', '_', kstatkeyvalue[0]).replace(",", ".")
-                    kstatkey = kstatkeyvalue[0].split(":")
-                    # kstatkey[0]            # always set to 'caps'
-                    # kstatkey[1]            # zone_sys_number
-                    # kstatkey[2]            # 'swapresv_zone_28' or 'nprocs_zone_18'
-                    # kstatkey[3]            # 'zonename', 'usage' or 'value' text
-                    zone_sys_number = kstatkey[1]
-                    value = kstatkeyvalue[1]
-
-                    if kstatkey[2].startswith('nprocs_zone'):
-                        statistic = 'nprocs_current'
-                    else:
-                        if kstatkey[3] == 'value':
-                            statistic = 'swap_limit_bytes'
-                        elif kstatkey[3] == 'usage':
-                            statistic = 'swap_usage_bytes'
-                    if kstatkey[3] == 'zonename':
-                        zonename_dict[zone_sys_number] = value
-                        continue
-                    # create new nested dictionary for zone_sys_name, or preserve it if it exists
-                    per_zone_caps_dict[zone_sys_number] = per_zone_caps_dict.get(zone_sys_number, {})
-                    # add value to nested dictionary of statistic for zone_sys_name
-                    per_zone_caps_dict[zone_sys_number][statistic] = float(value)
-                # evacuate stored in dictionaries info into metrics
-                for zone_sys_number in per_zone_caps_dict.keys():
-                    for statistic in per_zone_caps_dict[zone_sys_number].keys():
-                        local_zone_name = zonename_dict.get(zone_sys_number, 'sys_zone_' + zone_sys_number)
-                        value = per_zone_caps_dict.get(zone_sys_number, {}).get(statistic, 0.0)
-                        per_zone_caps.add_metric([local_zone_name, statistic, host_name], value)
-            else:
-                self.per_zone_caps_collector_errors.inc()
-                if task_timeouted:
-                    self.per_zone_caps_collector_timeouts.inc()
+    timeouts_metric = 'solaris_exporter_per_zone_caps_timeouts'
+    errors_metric = 'solaris_exporter_per_zone_caps_errors'
+    processing_metric = 'solaris_exporter_per_zone_caps_processing'
+
+    def collect_metrics(self):
+        per_zone_caps = FilteredGaugeMetricFamily("solaris_exporter_per_zone_caps_total",
+                                                  'kstat counters about zone resources',
+                                                  labels=['zone', 'statistic', 'host'])
+        per_zone_caps_dict = {}  # will be nested dict
+        zonename_dict = {}
+        query = ["caps::/^swapresv_zone_[0-9]+$/:/^(usage|value|zonename)$/", "caps::/^nprocs_zone_[0-9]+$/:usage"]
+        records, task_return_code, task_timeouted = kstat_reader.read(query, 'zone_caps', self.max_time_to_run)
+        if task_return_code == 0 and task_timeouted is False:
+            for module, zone_sys_number, name, kstat_statistic, value in records:
+                # module                 # always set to 'caps'
+                # zone_sys_number        # instance
+                # name                   # 'swapresv_zone_28' or 'nprocs_zone_18'
+                # kstat_statistic        # 'zonename', 'usage' or 'value' text
+                if name.startswith('nprocs_zone'):
+                    statistic = 'nprocs_current'
+                else:
+                    if kstat_statistic == 'value':
+                        statistic = 'swap_limit_bytes'
+                    elif kstat_statistic == 'usage':
+                        statistic = 'swap_usage_bytes'
+                if kstat_statistic == 'zonename':
+                    zonename_dict[zone_sys_number] = value
+                    continue
+                # create new nested dictionary for zone_sys_name, or preserve it if it exists
+                per_zone_caps_dict[zone_sys_number] = per_zone_caps_dict.get(zone_sys_number, {})
+                # add value to nested dictionary of statistic for zone_sys_name
+                per_zone_caps_dict[zone_sys_number][statistic] = float(value)
+            # evacuate stored in dictionaries info into metrics
+            for zone_sys_number in per_zone_caps_dict.keys():
+                for statistic in per_zone_caps_dict[zone_sys_number].keys():
+                    local_zone_name = zonename_dict.get(zone_sys_number, 'sys_zone_' + zone_sys_number)
+                    value = per_zone_caps_dict.get(zone_sys_number, {}).get(statistic, 0.0)
+                    per_zone_caps.add_metric([local_zone_name, statistic, host_name], value)
+        else:
+            self.count_error(task_timeouted)
         yield per_zone_caps
 
 
-class FCinfoCollector(object):
+def mpath_device_name(lu_name):
     """
-    FC links Multipath
+    '/dev/rdsk/c0t5000CCA0d0s2' -> 'c0t5000CCA0d0', None for LUs which are not disks
+    """
+    if not lu_name.startswith('/dev/rdsk/'):
+        return None
+    return re.sub(r'/dev/rdsk/(.*)s2', r'\1', lu_name)
+
+
+def parse_mpathadm_list(output):
+    """
+    Parses 'mpathadm list lu' into {device: {'total': paths, 'operational': paths}}.
+    Line without ':' is name of LU, counts are given to the latest LU, LUs which are not disks are skipped.
+    """
+    lus = {}
+    counts = None
+    for line in output.splitlines():
+        content = line.strip()
+        if not content:
+            continue
+        if ':' not in content:
+            device = mpath_device_name(content)
+            counts = None if device is None else lus.setdefault(device, {})
+            continue
+        if counts is None:
+            continue
+        key, value = content.split(':', 1)
+        try:
+            if key == 'Total Path Count':
+                counts['total'] = int(value)
+            elif key == 'Operational Path Count':
+                counts['operational'] = int(value)
+        except ValueError:
+            pass
+    return lus
+
+
+def parse_mpathadm_show(output):
+    """
+    Parses 'mpathadm show lu <lu> ...' into {device: {'vendor': ..., 'product': ..., 'paths': [path]}},
+    path is {'initiator': wwn, 'target': wwn, 'state': 'OK', 'disabled': 'no'}
+    """
+    lus = {}
+    lu = None
+    path = None
+    path_keys = {'Initiator Port Name': 'initiator', 'Target Port Name': 'target', 'Path State': 'state',
+                 'Disabled': 'disabled'}
+    for line in output.splitlines():
+        if ':' not in line:
+            continue
+        key, value = line.split(':', 1)
+        key, value = key.strip(), value.strip()
+        if key == 'Logical Unit':
+            device = mpath_device_name(value)
+            lu = None if device is None else lus.setdefault(device, {'vendor': '', 'product': '', 'paths': []})
+            path = None
+        elif lu is None:
+            continue
+        elif key in ('Vendor', 'Product') and path is None:
+            lu[key.lower()] = value
+        elif key == 'Initiator Port Name':
+            path = {'initiator': value, 'target': '', 'state': '', 'disabled': ''}
+            lu['paths'].append(path)
+        elif key == 'Target Port Groups':
+            # 'Name' and 'Access State' of target port groups are not paths
+            path = None
+            lu = None
+        elif path is not None and key in path_keys:
+            path[path_keys[key]] = value
+    return lus
+
+
+def parse_fcinfo_hba_ports(output):
+    """
+    Parses 'fcinfo hba-port -l' into {port wwn: {field: value}}, fields of 'Link Error Statistics'
+    are in 'errors' as {'link_failure': count, 'loss_of_sync': count, ...}
+    """
+    ports = {}
+    port = None
+    for line in output.splitlines():
+        if ':' not in line:
+            continue
+        key, value = line.split(':', 1)
+        key, value = key.strip(), value.strip()
+        if key == 'HBA Port WWN':
+            port = ports.setdefault(value, {'errors': {}})
+        elif port is None:
+            continue
+        elif key.endswith(' Count'):
+            try:
+                port['errors'][key[:-len(' Count')].lower().replace(' ', '_')] = int(value)
+            except ValueError:
+                pass
+        else:
+            port[key] = value
+    return ports
+
+
+class FCinfoCollector(BaseCollector):
+    """
+    FC links Multipath: path counts of LUs from 'mpathadm list lu', link error counters and state of HBA ports
+    from 'fcinfo hba-port -l' (both reused for fc_cache_ttl_sec, refreshed in background).
+    State of every path is taken from 'mpathadm show lu' topology (fc_path_details). Topology is read
+    in background thread, as CommandCache refreshes stale results, only for new LUs, LUs with changed path counts
+    and LUs older than fc_topology_max_age_sec. Scrape never waits for it and exports topology as it is,
+    old entries are kept until their LUs are read again.
     """
     # timeout how match seconds is allowed to collect data
     max_time_to_run = 4
-    fc_lun_collector_timeouts = Counter('solaris_exporter_fc_paths_timeouts',
-                                        'timeouts')
-    fc_lun_collector_errors = Counter('solaris_exporter_fc_paths_errors', 'Number of times when collector ran' +
-                                      ' with errors')
-    fc_lun_collector_run_time = Gauge('solaris_exporter_fc_paths_processing', 'Time spent processing request')
-
-    def collect(self):
-        with self.fc_lun_collector_run_time.time():
-            output, task_return_code, task_timeouted = run_shell_command('/usr/sbin/mpathadm list lu',
-                                                                         self.max_time_to_run)
-            if task_return_code == 0 and task_timeouted is False:
-                lines = output.splitlines()
-                fc_lun = GaugeMetricFamily("solaris_exporter_fc_paths", '/usr/sbin/mpathadm list lu',
+    # 'mpathadm show lu' of topology refresh is run for this number of LUs at once
+    show_lu_batch = 64
+    # timeout of one 'mpathadm show lu' batch, it runs in background
+    show_lu_max_time_to_run = 30
+    timeouts_metric = 'solaris_exporter_fc_paths_timeouts'
+    errors_metric = 'solaris_exporter_fc_paths_errors'
+    processing_metric = 'solaris_exporter_fc_paths_processing'
+    list_lu_command = '/usr/sbin/mpathadm list lu'
+    hba_port_command = '/usr/sbin/fcinfo hba-port -l'
+
+    def __init__(self):
+        super(FCinfoCollector, self).__init__()
+        # {device: lu of parse_mpathadm_show with 'counts' from 'mpathadm list lu' at time of reading
+        #  and 'time' of reading}
+        self.topology = {}
+        self.topology_lock = threading.Lock()
+        self.topology_refreshing = False
+
+    def commands(self):
+        return [(self.list_lu_command, self.max_time_to_run, fc_cache_ttl_sec),
+                (self.hba_port_command, self.max_time_to_run, fc_cache_ttl_sec)]
+
+    def start_topology_refresh(self, lus):
+        """
+        Starts background refresh of LUs which are new, have changed path counts or are too old,
+        LUs which are not listed any more are dropped. Only one refresh runs at a time.
+        """
+        now = monotonic_time()
+        with self.topology_lock:
+            for device in list(self.topology):
+                if device not in lus:
+                    del self.topology[device]
+            if self.topology_refreshing:
+                return
+            changed = sorted(device for device, counts in lus.items()
+                             if device not in self.topology or self.topology[device]['counts'] != counts or
+                             now - self.topology[device]['time'] >= fc_topology_max_age_sec)
+            if not changed:
+                return
+            self.topology_refreshing = True
+        refresher = threading.Thread(target=self.refresh_topology, args=(changed, lus),
+                                     name='solaris_exporter_fc_topology')
+        refresher.daemon = True
+        refresher.start()
+
+    def refresh_topology(self, changed, lus):
+        """
+        Reads 'mpathadm show lu' of changed LUs by batches, every batch replaces its entries of topology
+        """
+        try:
+            for first in range(0, len(changed), self.show_lu_batch):
+                batch = changed[first:first + self.show_lu_batch]
+                output, task_return_code, task_timeouted = run_shell_command(
+                    '/usr/sbin/mpathadm show lu ' + ' '.join('/dev/rdsk/%ss2' % device for device in batch),
+                    self.show_lu_max_time_to_run)
+                if task_return_code != 0 or task_timeouted:
+                    self.count_error(task_timeouted)
+                    shown = {}
+                else:
+                    shown = parse_mpathadm_show(output)
+                now = monotonic_time()
+                with self.topology_lock:
+                    for device in batch:
+                        old_lu = self.topology.get(device)
+                        lu = shown.get(device)
+                        if lu is None and old_lu is not None:
+                            # failed read keeps known paths, LU is retried when its counts are changed or after max age
+                            lu = dict(old_lu)
+                        elif lu is None:
+                            lu = {'vendor': '', 'product': '', 'paths': []}
+                        lu['counts'] = lus[device]
+                        lu['time'] = now
+                        self.topology[device] = lu
+        finally:
+            with self.topology_lock:
+                self.topology_refreshing = False
+
+    def collect_metrics(self):
+        fc_lun = FilteredGaugeMetricFamily("solaris_exporter_fc_paths", '/usr/sbin/mpathadm list lu',
                                            labels=['device', 'stat', 'host'])
-                fc_total_paths = {}
-                fc_active_paths = {}
-                for line in lines:
-                    content = line.strip()
-                    if '/dev/rdsk/' in content:
-                        device = re.sub(r'/dev/rdsk/(.*)s2', r'\1', content)
-                    elif 'Total Path Count' in content:
-                        content = content.split(':')
-                        fc_total_paths[device] = content[1]
-                    elif 'Operational Path Count:' in content:
-                        content = content.split(':')
-                        fc_active_paths[device] = content[1]
-                    else:
-                        device = "unknown"
-                for device in fc_total_paths.keys():
-                    if device == "unknown":
-                        continue
-                    fc_lun.add_metric([device, 'active', host_name], float(fc_active_paths.get(device, 0)))
-                    fc_lun.add_metric([device, 'total', host_name], float(fc_total_paths.get(device, 0)))
-                yield fc_lun
-            else:
-                self.fc_lun_collector_errors.inc()
-                if task_timeouted:
-                    self.fc_lun_collector_timeouts.inc()
-
+        fc_path = FilteredGaugeMetricFamily("solaris_exporter_fc_path_state",
+                                            'path of LU from mpathadm show lu: 1 - OK, 0 - other state or disabled',
+                                            labels=['device', 'initiator_port', 'target_port', 'host'])
+        hba_port_state = FilteredGaugeMetricFamily("solaris_exporter_fc_hba_port_state",
+                                                   'HBA port state from fcinfo hba-port: 1 - online',
+                                                   labels=['port', 'device', 'host'])
+        hba_port_speed = FilteredGaugeMetricFamily("solaris_exporter_fc_hba_port_speed_gbps",
+                                                   'current speed of HBA port from fcinfo hba-port',
+                                                   labels=['port', 'device', 'host'])
+        hba_port_errors = FilteredCounterMetricFamily("solaris_exporter_fc_hba_port_link_errors",
+                                                      'link error statistics of HBA port from fcinfo hba-port -l',
+                                                      labels=['port', 'device', 'statistic', 'host'])
+        output, task_return_code, task_timeouted = run_cached_command(self.list_lu_command,
+                                                                      self.max_time_to_run, fc_cache_ttl_sec)
+        if task_return_code == 0 and task_timeouted is False:
+            lus = parse_mpathadm_list(output)
+            for device, counts in sorted(lus.items()):
+                fc_lun.add_metric([device, 'active', host_name], float(counts.get('operational', 0)))
+                fc_lun.add_metric([device, 'total', host_name], float(counts.get('total', 0)))
+            if fc_path_details:
+                self.start_topology_refresh(lus)
+                with self.topology_lock:
+                    topology = sorted(self.topology.items())
+                for device, lu in topology:
+                    for path in lu['paths']:
+                        path_ok = path['state'] == 'OK' and path['disabled'] != 'yes'
+                        fc_path.add_metric([device, path['initiator'], path['target'], host_name], 1 if path_ok else 0)
+        else:
+            self.count_error(task_timeouted)
 
-class SVCSCollector(object):
+        output, task_return_code, task_timeouted = run_cached_command(self.hba_port_command,
+                                                                      self.max_time_to_run, fc_cache_ttl_sec)
+        if task_return_code == 0 and task_timeouted is False:
+            for wwn, port in sorted(parse_fcinfo_hba_ports(output).items()):
+                device = port.get('OS Device Name', '').replace('/dev/cfg/', '')
+                hba_port_state.add_metric([wwn, device, host_name], 1 if port.get('State') == 'online' else 0)
+                speed = re.match(r'([\d.]+)Gb', port.get('Current Speed', ''))
+                hba_port_speed.add_metric([wwn, device, host_name], float(speed.group(1)) if speed else 0)
+                for statistic, count in sorted(port['errors'].items()):
+                    hba_port_errors.add_metric([wwn, device, statistic, host_name], count)
+        elif task_timeouted or 'No Adapters Found' not in output:
+            self.count_error(task_timeouted)
+        yield fc_lun
+        yield fc_path
+        yield hba_port_state
+        yield hba_port_speed
+        yield hba_port_errors
+
+
+class SVCSCollector(BaseCollector):
     """
     'svcs -x' checker
     """
     # timeout how match seconds is allowed to collect data
     max_time_to_run = 4
-    svcs_x_collector_timeouts = Counter('solaris_exporter_svcs_x_timeouts',
-                                        'timeouts')
-    svcs_x_collector_errors = Counter('solaris_exporter_svcs_x_errors', 'Number of times when collector ran' +
-                                      ' with errors')
-    svcs_x_collector_run_time = Gauge('solaris_exporter_svcs_x_processing', 'Time spent processing request')
-
-    def collect(self):
-        with self.svcs_x_collector_run_time.time():
-            output, task_return_code, task_timeouted = run_shell_command('/usr/bin/svcs -x',
-                                                                         self.max_time_to_run)
-            if task_return_code == 0 and task_timeouted is False:
-                lines = output.splitlines()
-                svcs_x = GaugeMetricFamily("solaris_exporter_svcs_x_failed_services",
+    timeouts_metric = 'solaris_exporter_svcs_x_timeouts'
+    errors_metric = 'solaris_exporter_svcs_x_errors'
+    processing_metric = 'solaris_exporter_svcs_x_processing'
+    command = '/usr/bin/svcs -x'
+    # value of 'host' label, None - host_name
+    host = None
+
+    def commands(self):
+        return [(self.command, self.max_time_to_run, None)]
+
+    def collect_metrics(self):
+        svcs_x = FilteredGaugeMetricFamily("solaris_exporter_svcs_x_failed_services",
                                            'failed services counter in svcs -x',
                                            labels=['host'])
-                svcs_fail = 0
-                for line in lines:
-                    if line.strip().startswith('svc:'):
-                        svcs_fail += 1
-                svcs_x.add_metric([host_name], float(svcs_fail))
-            else:
-                self.svcs_x_collector_errors.inc()
-                if task_timeouted:
-                    self.svcs_x_collector_timeouts.inc()
+        output, task_return_code, task_timeouted = run_shell_command(self.command, self.max_time_to_run)
+        if task_return_code == 0 and task_timeouted is False:
+            lines = output.splitlines()
+            svcs_fail = 0
+            for line in lines:
+                if line.strip().startswith('svc:'):
+                    svcs_fail += 1
+            svcs_x.add_metric([self.host or host_name], float(svcs_fail))
+        else:
+            self.count_error(task_timeouted)
         yield svcs_x
 
 
-class FmadmCollector(object):
+class ZoneSVCSCollector(SVCSCollector):
     """
-    'fmadm faulty' checker
+    'svcs -x -z zonename' checker for zone target of global zone exporter, 'host' label is zone name
+    """
+    timeouts_metric = None
+    errors_metric = None
+    processing_metric = None
+
+    def __init__(self, zone):
+        super(ZoneSVCSCollector, self).__init__()
+        self.host = zone
+        self.command = '/usr/bin/svcs -x -z ' + zone
+
+
+# values of solaris_exporter_smf_state, other states are 7
+smf_states = {'online': 0, 'degraded': 1, 'offline': 2, 'maintenance': 3, 'disabled': 4, 'uninitialized': 5,
+              'legacy_run': 6}
+
+
+def smf_signature(root=''):
+    """
+    Changes of SMF under root: stat of repository.db (configuration) and the latest restarter log in /var/svc/log,
+    svc.startd writes there on state transitions, which are not saved to repository.db
+    """
+    try:
+        stat = os.stat(root + '/etc/svc/repository.db')
+        repository = (stat.st_mtime, stat.st_size)
+    except OSError:
+        repository = None
+    log_dir = root + '/var/svc/log'
+    try:
+        names = os.listdir(log_dir)
+    except OSError:
+        names = []
+    latest_log = 0
+    for name in names:
+        try:
+            latest_log = max(latest_log, os.stat(os.path.join(log_dir, name)).st_mtime)
+        except OSError:
+            pass
+    return repository, len(names), latest_log
+
+
+class SMFStateCollector(BaseCollector):
+    """
+    State of every SMF service from 'svcs -a -H -o state,fmri', kept in per FMRI state table.
+    svcs runs again only when smf_signature() is changed or after smf_state_max_age_sec,
+    between them collection costs a few stat() calls. Series of solaris_exporter_smf_state are limited
+    by smf_fmri_allow_regex and smf_fmri_deny_regex, solaris_exporter_smf_services counts all services.
     """
     # timeout how match seconds is allowed to collect data
-    max_time_to_run = 15
-    fmadm_collector_timeouts = Counter('solaris_exporter_fmadm_timeouts',
-                                       'timeouts')
-    fmadm_collector_errors = Counter('solaris_exporter_fmadm_errors', 'Number of times when collector ran' +
-                                     ' with errors')
-    fmadm_collector_run_time = Gauge('solaris_exporter_fmadm_processing', 'Time spent processing request')
+    max_time_to_run = 4
+    command = '/usr/bin/svcs -a -H -o state,fmri'
+    columns = ['state', 'fmri']
+    # labels of series besides 'host', values are taken from columns
+    labels = []
+
+    def __init__(self):
+        super(SMFStateCollector, self).__init__()
+        # {(values of labels, fmri): state}
+        self.states = {}
+        self.signature = None
+        self.refresh_time = None
+        self.fmri_allow = smf_fmri_allow_regex and re.compile(smf_fmri_allow_regex).search
+        self.fmri_deny = smf_fmri_deny_regex and re.compile(smf_fmri_deny_regex).search
+
+    def current_signature(self):
+        return smf_signature()
+
+    def refresh_states(self):
+        """
+        Reads state table from svcs, returns False on error
+        """
+        output, task_return_code, task_timeouted = run_shell_command(self.command, self.max_time_to_run)
+        if task_return_code != 0 or task_timeouted:
+            self.count_error(task_timeouted)
+            return False
+        states = {}
+        for line in output.splitlines():
+            fields = line.split()
+            if len(fields) != len(self.columns):
+                continue
+            row = dict(zip(self.columns, fields))
+            # '*' is added to state of service in transition
+            states[(tuple(row[label] for label in self.labels), row['fmri'])] = row['state'].rstrip('*')
+        self.states = states
+        return True
+
+    def exported(self, fmri):
+        if self.fmri_allow and not self.fmri_allow(fmri):
+            return False
+        return not (self.fmri_deny and self.fmri_deny(fmri))
+
+    def collect_metrics(self):
+        signature = self.current_signature()
+        if self.refresh_time is None or signature != self.signature or \
+                monotonic_time() - self.refresh_time >= smf_state_max_age_sec:
+            if self.refresh_states():
+                self.signature = signature
+                self.refresh_time = monotonic_time()
+            else:
+                self.refresh_time = None
+        smf_state = FilteredGaugeMetricFamily("solaris_exporter_smf_state",
+                                              'state of SMF service: 0 - online, 1 - degraded, 2 - offline, '
+                                              '3 - maintenance, 4 - disabled, 5 - uninitialized, 6 - legacy_run, '
+                                              '7 - other',
+                                              labels=self.labels + ['fmri', 'host'])
+        smf_services = FilteredGaugeMetricFamily("solaris_exporter_smf_services",
+                                                 'number of SMF services in state',
+                                                 labels=self.labels + ['state', 'host'])
+        if self.refresh_time is not None:
+            counts = {}
+            for (label_values, fmri), state in sorted(self.states.items()):
+                counts[(label_values, state)] = counts.get((label_values, state), 0) + 1
+                if self.exported(fmri):
+                    smf_state.add_metric(list(label_values) + [fmri, host_name], smf_states.get(state, 7))
+            for (label_values, state), count in sorted(counts.items()):
+                smf_services.add_metric(list(label_values) + [state, host_name], count)
+        yield smf_state
+        yield smf_services
+
+
+class PerZoneSMFStateCollector(SMFStateCollector):
+    """
+    State of SMF services of all running local zones by one 'svcs -a -Z' (Solaris 11.2+) for zone targets,
+    signature is made from repositories of zones found by ZoneTargetRegistry
+    """
+    command = '/usr/bin/svcs -a -Z -H -o zone,state,fmri'
+    columns = ['zone', 'state', 'fmri']
+    labels = ['zone']
+
+    def __init__(self, zone_registry):
+        super(PerZoneSMFStateCollector, self).__init__()
+        self.zone_registry = zone_registry
+
+    def current_signature(self):
+        return [(zonepath, smf_signature(zonepath + '/root'))
+                for zonepath in sorted(self.zone_registry.zones.values())]
+
+
+# header row of fault in 'fmadm faulty': TIME EVENT-ID MSG-ID SEVERITY
+fmadm_fault_line = re.compile(r'^(\w{3} \d{2} \d{2}:\d{2}:\d{2})\s+'
+                              r'([0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12})\s+(\S+)\s+(\S+)')
+# 'Fault class : fault.io.disk.predictive-failure', 'FRU : "HDD0" (hc://...)'
+fmadm_field_line = re.compile(r'^\s*([A-Za-z][A-Za-z ]*?)\s*:\s*(.*)$')
+# 'fmdump -t' line: TIME UUID SUNW-MSG-ID [EVENT], there is no EVENT column in Solaris 10
+fmdump_fault_line = re.compile(r'^(\w{3} \d{2} \d{2}:\d{2}:\d{2}(?:\.\d+)?)\s+'
+                               r'([0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12})\s+(\S+)(?:\s+(\S+))?')
+# 'fmdump -e -t' line: TIME CLASS
+fmdump_ereport_line = re.compile(r'^\w{3} \d{2} \d{2}:\d{2}:\d{2}(?:\.\d+)?\s+(ereport\.\S+)')
+# events of 'fmdump' after which fault is not open any more
+fmdump_closing_events = ('Repaired', 'Resolved')
+
+
+def fmadm_fru_name(value):
+    """
+    Short FRU name: '"HDD0" (hc://...)' -> 'HDD0', 'hc://:chassis=0/hdd=0' -> 'hc://:chassis=0/hdd=0'
+    """
+    if value.startswith('"'):
+        return value[1:].split('"', 1)[0]
+    return value.split(' (', 1)[0] or 'unknown'
 
-    def collect(self):
-        with self.fmadm_collector_run_time.time():
-            output, task_return_code, task_timeouted = run_shell_command('/usr/bin/pfexec /usr/sbin/fmadm faulty',
-                                                                         self.max_time_to_run)
-            if task_return_code == 0 and task_timeouted is False:
-                lines = output.splitlines()
-                fmadm = GaugeMetricFamily("solaris_exporter_fmadm_faults", 'faults in fmadm faulty',
-                                          labels=['host'])
-                faults = 0
-                for line in lines:
-                    if line.strip().startswith('TIME'):
-                        faults += 1
-                fmadm.add_metric([host_name], float(faults))
-                yield fmadm
+
+def parse_fmadm_faulty(output):
+    """
+    Parses 'fmadm faulty' of Solaris 10, 11.3 and 11.4 into
+    {uuid: {'time': 'Jan 06 10:00:00', 'msgid': 'DISK-8000-0X', 'severity': 'Major', 'suspects': [[class, fru]]}}.
+    FRU is taken from 'FRU : "name"' line or from 'Location' of FRU block (11.4).
+    """
+    faults = {}
+    fault = None
+    suspect = None
+    fru_block = False
+    for line in output.splitlines():
+        match = fmadm_fault_line.match(line)
+        if match:
+            fault_time, uuid, msgid, severity = match.groups()
+            fault = {'time': fault_time, 'msgid': msgid, 'severity': severity, 'suspects': []}
+            faults[uuid] = fault
+            suspect = None
+            fru_block = False
+            continue
+        if fault is None:
+            continue
+        match = fmadm_field_line.match(line)
+        if not match:
+            if line.strip() == 'FRU' and suspect is not None:
+                fru_block = True
+            continue
+        key, value = match.group(1).lower(), match.group(2).strip()
+        if key in ('fault class', 'problem class'):
+            suspect = [value, 'unknown']
+            fault['suspects'].append(suspect)
+            fru_block = False
+        elif key == 'fru' and suspect is not None:
+            suspect[1] = fmadm_fru_name(value)
+        elif key == 'location' and fru_block:
+            suspect[1] = fmadm_fru_name(value)
+            fru_block = False
+        elif key == 'severity' and value:
+            fault['severity'] = value
+    return faults
+
+
+def parse_fmstat(output):
+    """
+    Parses 'fmstat' by column names of header into {module: {column: float}}, sizes ('32b', '1.2K') are in bytes
+    """
+    modules = {}
+    columns = None
+    for line in output.splitlines():
+        fields = line.split()
+        if not fields:
+            continue
+        if fields[0] == 'module':
+            columns = fields[1:]
+            continue
+        if columns is None or len(fields) != len(columns) + 1:
+            continue
+        values = {}
+        for column, value in zip(columns, fields[1:]):
+            number = zpool_number(value[:-1] if value.endswith('b') else value)
+            if number is not None:
+                values[column] = number
+        modules[fields[0]] = values
+    return modules
+
+
+class FmadmCollector(BaseCollector):
+    """
+    Fault management: open faults from 'fmadm faulty', ereports from 'fmdump -e' and modules from 'fmstat'.
+    Full 'fmadm faulty' is read at start and once in fma_full_refresh_interval_sec, between them only events
+    since previous read are read by 'fmdump -t <seconds>s': new faults are looked up by 'fmadm faulty -u <uuid>',
+    repaired and resolved ones are removed from index. Index keeps at most fma_max_faults faults.
+    """
+    # timeout how match seconds is allowed to collect data
+    max_time_to_run = 15
+    # fmadm is heavy, in background collection mode run it less often
+    collect_interval_sec = 60
+    # seconds to use cached command output
+    cache_ttl_sec = 120
+    # events are read again for these seconds before previous read, lines seen last time are skipped
+    event_overlap_sec = 5
+    # more new faults in one read are taken by full 'fmadm faulty' instead of lookups by uuid
+    max_fault_lookups = 10
+    timeouts_metric = 'solaris_exporter_fmadm_timeouts'
+    errors_metric = 'solaris_exporter_fmadm_errors'
+    processing_metric = 'solaris_exporter_fmadm_processing'
+
+    def __init__(self):
+        super(FmadmCollector, self).__init__()
+        # {uuid: fault} of open faults, see parse_fmadm_faulty
+        self.faults = {}
+        # open faults not kept in index because of fma_max_faults
+        self.faults_overflow = 0
+        self.full_refresh_time = None
+        # {command: (start time of previous read, set of lines read)}
+        self.event_reads = {}
+        # {class: number of ereports since exporter start}
+        self.ereports = {}
+
+    def read_events(self, command):
+        """
+        Returns new lines of 'fmdump <command> -t <seconds>s' since previous read, None on error.
+        The first read only remembers time.
+        """
+        start_time = monotonic_time()
+        previous = self.event_reads.get(command)
+        if previous is None:
+            self.event_reads[command] = (start_time, set())
+            return []
+        previous_time, previous_lines = previous
+        since = int(start_time - previous_time) + 1 + self.event_overlap_sec
+        output, task_return_code, task_timeouted = run_shell_command(
+            '/usr/bin/pfexec /usr/sbin/fmdump %s-t %ds' % (command, since), self.max_time_to_run)
+        if task_return_code != 0 or task_timeouted:
+            self.count_error(task_timeouted)
+            return None
+        lines = set(output.splitlines())
+        self.event_reads[command] = (start_time, lines)
+        return [line for line in output.splitlines() if line not in previous_lines]
+
+    def store_faults(self, faults, replace=False):
+        """
+        Puts parsed faults into bounded index, replace=True drops faults not found in full 'fmadm faulty'
+        """
+        if replace:
+            self.faults = {}
+            self.faults_overflow = 0
+        for uuid in sorted(faults):
+            if uuid in self.faults or len(self.faults) < fma_max_faults:
+                self.faults[uuid] = faults[uuid]
+            else:
+                self.faults_overflow += 1
+
+    def refresh_faults(self):
+        """
+        Full 'fmadm faulty', returns False on error
+        """
+        self.full_refresh_time = monotonic_time()
+        output, task_return_code, task_timeouted = run_shell_command('/usr/bin/pfexec /usr/sbin/fmadm faulty',
+                                                                     self.max_time_to_run)
+        if task_return_code != 0 or task_timeouted:
+            self.count_error(task_timeouted)
+            self.full_refresh_time = None
+            return False
+        self.store_faults(parse_fmadm_faulty(output), replace=True)
+        # events before full read are already in it
+        self.event_reads.pop('', None)
+        self.read_events('')
+        return True
+
+    def update_faults(self):
+        """
+        Applies fault events since previous read to index, returns False on error
+        """
+        lines = self.read_events('')
+        if lines is None:
+            return False
+        new_uuids = set()
+        for line in lines:
+            match = fmdump_fault_line.match(line)
+            if not match:
+                continue
+            uuid, event = match.group(2), match.group(4)
+            if event in fmdump_closing_events:
+                new_uuids.discard(uuid)
+                if uuid in self.faults:
+                    del self.faults[uuid]
+                elif self.faults_overflow > 0:
+                    self.faults_overflow -= 1
             else:
-                self.fmadm_collector_errors.inc()
-                if task_timeouted:
-                    self.fmadm_collector_timeouts.inc()
+                # Diagnosed, Updated or Solaris 10 line without event
+                new_uuids.add(uuid)
+        if len(new_uuids) > self.max_fault_lookups:
+            return self.refresh_faults()
+        for uuid in sorted(new_uuids):
+            output, task_return_code, task_timeouted = run_shell_command(
+                '/usr/bin/pfexec /usr/sbin/fmadm faulty -u %s' % uuid, self.max_time_to_run)
+            if task_return_code != 0 or task_timeouted:
+                self.count_error(task_timeouted)
+                # the fault would be lost with events of this read
+                self.full_refresh_time = None
+                return False
+            faults = parse_fmadm_faulty(output)
+            if uuid in faults:
+                self.store_faults({uuid: faults[uuid]})
+        return True
+
+    def update_ereports(self):
+        lines = self.read_events('-e ')
+        if lines is None:
+            return
+        for line in lines:
+            match = fmdump_ereport_line.match(line)
+            if match:
+                ereport_class = match.group(1)
+                self.ereports[ereport_class] = self.ereports.get(ereport_class, 0) + 1
+
+    def collect_metrics(self):
+        if self.full_refresh_time is None or \
+                monotonic_time() - self.full_refresh_time >= fma_full_refresh_interval_sec:
+            faults_known = self.refresh_faults()
+        else:
+            faults_known = self.update_faults()
+        if faults_known:
+            fmadm = FilteredGaugeMetricFamily("solaris_exporter_fmadm_faults", 'faults in fmadm faulty',
+                                              labels=['host'])
+            fmadm.add_metric([host_name], float(len(self.faults) + self.faults_overflow))
+            yield fmadm
+            fma_fault = FilteredGaugeMetricFamily("solaris_exporter_fma_fault",
+                                                  'open fault of fmadm faulty, one series per suspect',
+                                                  labels=['uuid', 'class', 'fru', 'severity', 'msgid', 'host'])
+            for uuid, fault in sorted(self.faults.items()):
+                for fault_class, fru in fault['suspects'] or [['unknown', 'unknown']]:
+                    fma_fault.add_metric([uuid, fault_class, fru, fault['severity'], fault['msgid'], host_name], 1)
+            yield fma_fault
+
+        self.update_ereports()
+        fma_ereports = FilteredCounterMetricFamily("solaris_exporter_fma_ereports",
+                                                   'error reports of fmdump -e since exporter start',
+                                                   labels=['class', 'host'])
+        for ereport_class, count in sorted(self.ereports.items()):
+            fma_ereports.add_metric([ereport_class, host_name], count)
+        yield fma_ereports
+
+        output, task_return_code, task_timeouted = run_cached_command('/usr/bin/pfexec /usr/sbin/fmstat',
+                                                                      self.max_time_to_run, self.cache_ttl_sec)
+        if task_return_code == 0 and task_timeouted is False:
+            fmstat = FilteredGaugeMetricFamily("solaris_exporter_fmstat",
+                                               'fault manager module statistics of fmstat',
+                                               labels=['module', 'statistic', 'host'])
+            for module, values in sorted(parse_fmstat(output).items()):
+                for statistic, value in sorted(values.items()):
+                    fmstat.add_metric([module, statistic, host_name], value)
+            yield fmstat
+        else:
+            self.count_error(task_timeouted)
+
+
+# suffixes of numbers printed by zpool (zfs_nicenum), base 1024
+zpool_number_suffixes = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4, 'P': 1024 ** 5, 'E': 1024 ** 6}
 
 
-class ZpoolCollector(object):
+def zpool_number(value):
     """
-    'zpool status' checker
+    Converts zpool number ('1234', '1.20K', '556G', '45%', '1.00x') to float, returns None for '-' and garbage
+    """
+    value = value.rstrip('%x')
+    multiplier = zpool_number_suffixes.get(value[-1:], 1)
+    if multiplier != 1:
+        value = value[:-1]
+    try:
+        return float(value) * multiplier
+    except ValueError:
+        return None
+
+
+def parse_zpool_list(output, columns):
+    """
+    Parses 'zpool list -H -o <columns>' output into list of dicts {column: value}
+    """
+    pools = []
+    for line in output.splitlines():
+        values = line.split('\t')
+        if len(values) != len(columns):
+            continue
+        pools.append(dict(zip(columns, values)))
+    return pools
+
+
+zpool_scan_percent_done = re.compile(r'([\d.]+)% done')
+zpool_data_errors = re.compile(r'(\d+) data errors?')
+
+
+def parse_zpool_status(output):
+    """
+    Parses 'zpool status' output in one pass into list of pools:
+    [{'pool': name, 'state': state, 'scan': 'scrub'|'resilver'|None, 'scan_in_progress': bool,
+      'scan_percent_done': float or None, 'vdevs': [(vdev, parent, state, read, write, cksum)],
+      'data_errors': int or None, 'faults': int}]
+    vdev tree is restored by indentation, parent of top level vdevs is pool or section name (logs, cache, spares).
+    read, write and cksum are None for vdevs without error counters (spares).
+    data_errors is taken from 'errors:' line ('No known data errors' is 0).
+    faults is the number of lines with FAILED or DEGRADED, as it was counted before.
+    """
+    pools = []
+    pool = None
+    section = None  # None, 'scan', 'config', 'tree'
+    stack = []  # [(indent, vdev name)] from pool to the current vdev
+    for line in output.splitlines():
+        stripped = line.strip()
+        if pool is not None and any(s in stripped for s in ['FAILED', 'DEGRADED']):
+            pool['faults'] += 1
+        key, sep, value = stripped.partition(':')
+        if sep and key == 'pool' and not line.startswith('\t'):
+            pool = {'pool': value.strip(), 'state': None, 'scan': None, 'scan_in_progress': False,
+                    'scan_percent_done': None, 'vdevs': [], 'data_errors': None, 'faults': 0}
+            pools.append(pool)
+            section = None
+            continue
+        if pool is None:
+            continue
+        if section == 'tree':
+            if stripped == '':
+                if pool['vdevs'] or stack:
+                    section = None
+                continue
+            fields = stripped.split()
+            if fields[0] == 'NAME':
+                continue
+            indent = len(line.expandtabs()) - len(line.expandtabs().lstrip())
+            while stack and stack[-1][0] >= indent:
+                stack.pop()
+            parent = stack[-1][1] if stack else ''
+            stack.append((indent, fields[0]))
+            if len(fields) == 1:
+                # section name: logs, cache, spares
+                continue
+            counters = [None, None, None]
+            if len(fields) >= 5:
+                counters = [zpool_number(v) for v in fields[2:5]]
+            pool['vdevs'].append((fields[0], parent, fields[1], counters[0], counters[1], counters[2]))
+            continue
+        if sep and key in ['state', 'scan', 'config', 'errors'] and value[:1] in ['', ' ']:
+            section = None
+            if key == 'state':
+                pool['state'] = value.strip()
+            elif key == 'scan':
+                section = 'scan'
+                value = value.strip()
+                for scan in ['scrub', 'resilver']:
+                    if value.startswith(scan):
+                        pool['scan'] = scan
+                if 'in progress' in value:
+                    pool['scan_in_progress'] = True
+                elif pool['scan'] is not None and 'canceled' not in value:
+                    pool['scan_percent_done'] = 100.0
+            elif key == 'config':
+                section = 'config'
+            elif key == 'errors':
+                value = value.strip()
+                match = zpool_data_errors.match(value)
+                if match:
+                    pool['data_errors'] = int(match.group(1))
+                elif value.startswith('No known data errors'):
+                    pool['data_errors'] = 0
+            continue
+        if section == 'scan':
+            match = zpool_scan_percent_done.search(stripped)
+            if match:
+                pool['scan_percent_done'] = float(match.group(1))
+        elif section == 'config' and stripped.startswith('NAME'):
+            section = 'tree'
+            stack = []
+    return pools
+
+
+class ZpoolCollector(BaseCollector):
+    """
+    zpool capacity and health from 'zpool list' (every collection)
+    and vdev tree from 'zpool status' (once in zpool_status_refresh_interval_sec or when health of pools is changed)
     """
     # timeout how match seconds is allowed to collect data
     max_time_to_run = 4
-    zpool_collector_timeouts = Counter('solaris_exporter_zpool_timeouts',
-                                       'timeouts')
-    zpool_collector_errors = Counter('solaris_exporter_zpool_errors', 'Number of times when collector ran' +
-                                     ' with errors')
-    zpool_collector_run_time = Gauge('solaris_exporter_zpool_processing', 'Time spent processing request')
+    timeouts_metric = 'solaris_exporter_zpool_timeouts'
+    errors_metric = 'solaris_exporter_zpool_errors'
+    processing_metric = 'solaris_exporter_zpool_processing'
+    # 'frag' and '-p' are not supported by all zpool versions, the second command is used then
+    zpool_list_commands = [
+        ('/usr/sbin/zpool list -H -p -o name,size,alloc,free,frag,cap,health',
+         ['name', 'size', 'alloc', 'free', 'frag', 'cap', 'health']),
+        ('/usr/sbin/zpool list -H -o name,size,alloc,free,cap,health',
+         ['name', 'size', 'alloc', 'free', 'cap', 'health']),
+    ]
 
-    def collect(self):
-        with self.zpool_collector_run_time.time():
-            output, task_return_code, task_timeouted = run_shell_command('/usr/sbin/zpool status',
-                                                                         self.max_time_to_run)
+    def __init__(self):
+        super(ZpoolCollector, self).__init__()
+        self.zpool_list_command = 0
+        self.status_pools = []
+        self.status_health = None
+        self.status_time = None
+
+    def commands(self):
+        # 'zpool status' is run only when tree has to be refreshed
+        return [(self.zpool_list_commands[self.zpool_list_command][0], self.max_time_to_run, None)]
+
+    def run_zpool_list(self):
+        """
+        Returns parsed 'zpool list' or None on error
+        """
+        while True:
+            command, columns = self.zpool_list_commands[self.zpool_list_command]
+            output, task_return_code, task_timeouted = run_shell_command(command, self.max_time_to_run)
             if task_return_code == 0 and task_timeouted is False:
-                lines = output.splitlines()
-                zpool = GaugeMetricFamily("solaris_exporter_zpool_faults", 'faults in zpool status',
-                                          labels=['host'])
-                faults = 0
-                for line in lines:
-                    line = line.strip()
-                    if any(s in line for s in ['FAILED', 'DEGRADED']):
-                        faults += 1
-                zpool.add_metric([host_name], float(faults))
-                yield zpool
-            else:
-                self.zpool_collector_errors.inc()
-                if task_timeouted:
-                    self.zpool_collector_timeouts.inc()
-
+                return parse_zpool_list(output, columns)
+            if task_timeouted or self.zpool_list_command == len(self.zpool_list_commands) - 1:
+                self.count_error(task_timeouted)
+                return None
+            self.zpool_list_command += 1
+
+    def refresh_status(self, health):
+        """
+        Runs 'zpool status' if interval is passed or health of pools is changed, keeps previous tree on error
+        """
+        now = monotonic_time()
+        if self.status_time is not None and health == self.status_health and \
+                now - self.status_time < zpool_status_refresh_interval_sec:
+            return
+        output, task_return_code, task_timeouted = run_shell_command('/usr/sbin/zpool status', self.max_time_to_run)
+        if task_return_code == 0 and task_timeouted is False:
+            self.status_pools = parse_zpool_status(output)
+            self.status_health = health
+            self.status_time = now
+        else:
+            self.count_error(task_timeouted)
 
-class MetaStatCollector(object):
+    def collect_metrics(self):
+        list_pools = self.run_zpool_list()
+        if list_pools is not None:
+            health = tuple(sorted((p['name'], p['health']) for p in list_pools))
+        else:
+            # 'zpool list' is failed, the status tree and legacy solaris_exporter_zpool_faults are refreshed on interval
+            health = self.status_health
+        self.refresh_status(health)
+        status_pools = self.status_pools
+
+        space = FilteredGaugeMetricFamily("solaris_exporter_zpool_space_bytes", "zpool list, space in bytes",
+                                          labels=['host', 'pool', 'statistic'])
+        percent = FilteredGaugeMetricFamily("solaris_exporter_zpool_capacity_percent",
+                                            "zpool list, capacity and fragmentation in percent",
+                                            labels=['host', 'pool', 'statistic'])
+        pool_health = FilteredGaugeMetricFamily("solaris_exporter_zpool_health",
+                                                "zpool list, 1 for the current health of pool",
+                                                labels=['host', 'pool', 'health'])
+        for p in list_pools or []:
+            for column, statistic in [('size', 'size'), ('alloc', 'allocated'), ('free', 'free')]:
+                value = zpool_number(p[column])
+                if value is not None:
+                    space.add_metric([host_name, p['name'], statistic], value)
+            for column, statistic in [('cap', 'capacity'), ('frag', 'fragmentation')]:
+                value = zpool_number(p.get(column, '-'))
+                if value is not None:
+                    percent.add_metric([host_name, p['name'], statistic], value)
+            pool_health.add_metric([host_name, p['name'], p['health']], 1)
+
+        vdev_state = FilteredGaugeMetricFamily("solaris_exporter_zpool_vdev_state",
+                                               "zpool status, 1 for the current state of vdev",
+                                               labels=['host', 'pool', 'vdev', 'parent', 'state'])
+        vdev_errors = FilteredGaugeMetricFamily("solaris_exporter_zpool_vdev_errors",
+                                                "zpool status, vdev error counters (reset by 'zpool clear')",
+                                                labels=['host', 'pool', 'vdev', 'parent', 'type'])
+        scan_in_progress = FilteredGaugeMetricFamily("solaris_exporter_zpool_scan_in_progress",
+                                                     "zpool status, 1 if scrub or resilver is running",
+                                                     labels=['host', 'pool', 'scan'])
+        scan_percent_done = FilteredGaugeMetricFamily("solaris_exporter_zpool_scan_percent_done",
+                                                      "zpool status, progress of running or last scrub or resilver",
+                                                      labels=['host', 'pool', 'scan'])
+        data_errors = FilteredGaugeMetricFamily("solaris_exporter_zpool_data_errors",
+                                                "zpool status, number of data errors in 'errors:' line",
+                                                labels=['host', 'pool'])
+        zpool = FilteredGaugeMetricFamily("solaris_exporter_zpool_faults", 'faults in zpool status',
+                                          labels=['host'])
+        faults = 0
+        for p in status_pools:
+            faults += p['faults']
+            for vdev, parent, state, read, write, cksum in p['vdevs']:
+                vdev_state.add_metric([host_name, p['pool'], vdev, parent, state], 1)
+                for error_type, value in [('read', read), ('write', write), ('checksum', cksum)]:
+                    if value is not None:
+                        vdev_errors.add_metric([host_name, p['pool'], vdev, parent, error_type], value)
+            if p['scan'] is not None:
+                scan_in_progress.add_metric([host_name, p['pool'], p['scan']], float(p['scan_in_progress']))
+                if p['scan_percent_done'] is not None:
+                    scan_percent_done.add_metric([host_name, p['pool'], p['scan']], p['scan_percent_done'])
+            if p['data_errors'] is not None:
+                data_errors.add_metric([host_name, p['pool']], p['data_errors'])
+        if self.status_time is not None:
+            zpool.add_metric([host_name], float(faults))
+        yield zpool
+        yield space
+        yield percent
+        yield pool_health
+        yield vdev_state
+        yield vdev_errors
+        yield scan_in_progress
+        yield scan_percent_done
+        yield data_errors
+
+
+class MetaStatCollector(BaseCollector):
     """
     'metastat -a' checker
     """
     # timeout how match seconds is allowed to collect data
     max_time_to_run = 5
-    metastat_collector_timeouts = Counter('solaris_exporter_metastat_timeouts',
-                                          'timeouts')
-    metastat_collector_errors = Counter('solaris_exporter_metastat_errors', 'Number of times when collector ran' +
-                                        ' with errors')
-    metastat_collector_run_time = Gauge('solaris_exporter_metastat_processing', 'Time spent processing request')
-
-    def collect(self):
-        with self.metastat_collector_run_time.time():
-            output, task_return_code, task_timeouted = run_shell_command('/usr/sbin/metastat -a',
-                                                                         self.max_time_to_run)
-            if task_return_code == 0 and task_timeouted is False:
-                lines = output.splitlines()
-                metastat = GaugeMetricFamily("solaris_exporter_metastat_faults", 'faults in metastat',
-                                             labels=['host'])
-                faults = 0
-                for line in lines:
-                    line = line.strip()
-                    if any(s in line for s in ['Needs maintenance', 'Last erred', 'Unavailable']):
-                        faults += 1
-                metastat.add_metric([host_name], float(faults))
-                yield metastat
-            else:
-                self.metastat_collector_errors.inc()
-                if task_timeouted:
-                    self.metastat_collector_timeouts.inc()
+    # seconds to use cached command output
+    cache_ttl_sec = 120
+    timeouts_metric = 'solaris_exporter_metastat_timeouts'
+    errors_metric = 'solaris_exporter_metastat_errors'
+    processing_metric = 'solaris_exporter_metastat_processing'
+    command = '/usr/sbin/metastat -a'
+
+    def commands(self):
+        return [(self.command, self.max_time_to_run, self.cache_ttl_sec)]
+
+    def collect_metrics(self):
+        output, task_return_code, task_timeouted = run_cached_command(self.command, self.max_time_to_run,
+                                                                      self.cache_ttl_sec)
+        if task_return_code == 0 and task_timeouted is False:
+            lines = output.splitlines()
+            metastat = FilteredGaugeMetricFamily("solaris_exporter_metastat_faults", 'faults in metastat',
+                                                 labels=['host'])
+            faults = 0
+            for line in lines:
+                line = line.strip()
+                if any(s in line for s in ['Needs maintenance', 'Last erred', 'Unavailable']):
+                    faults += 1
+            metastat.add_metric([host_name], float(faults))
+            yield metastat
+        else:
+            self.count_error(task_timeouted)
 
 
-class MetaDBCollector(object):
+class MetaDBCollector(BaseCollector):
     """
     'metadb' checker
     """
     # timeout how match seconds is allowed to collect data
     max_time_to_run = 5
-    metadb_collector_timeouts = Counter('solaris_exporter_metadb_timeouts',
-                                        'timeouts')
-    metadb_collector_errors = Counter('solaris_exporter_metadb_errors', 'Number of times when collector ran' +
-                                      ' with errors')
-    metadb_collector_run_time = Gauge('solaris_exporter_metadb_processing', 'Time spent processing request')
+    timeouts_metric = 'solaris_exporter_metadb_timeouts'
+    errors_metric = 'solaris_exporter_metadb_errors'
+    processing_metric = 'solaris_exporter_metadb_processing'
+    command = '/usr/sbin/metadb'
 
-    def collect(self):
-        with self.metadb_collector_run_time.time():
-            output, task_return_code, task_timeouted = run_shell_command('/usr/sbin/metadb',
-                                                                         self.max_time_to_run)
-            if task_return_code == 0 and task_timeouted is False:
-                lines = output.splitlines()
-                metadb = GaugeMetricFamily("solaris_exporter_metadb_faults", 'faults in metadb',
-                                           labels=['host'])
-                faults = 0
-                for line in lines:
-                    line = line.strip()
-                    if any(s in line for s in ['W', 'D', 'M']):
-                        faults += 1
-                metadb.add_metric([host_name], float(faults))
-                yield metadb
-            else:
-                self.metadb_collector_errors.inc()
-                if task_timeouted:
-                    self.metadb_collector_timeouts.inc()
+    def commands(self):
+        return [(self.command, self.max_time_to_run, None)]
+
+    def collect_metrics(self):
+        output, task_return_code, task_timeouted = run_shell_command(self.command, self.max_time_to_run)
+        if task_return_code == 0 and task_timeouted is False:
+            lines = output.splitlines()
+            metadb = FilteredGaugeMetricFamily("solaris_exporter_metadb_faults", 'faults in metadb',
+                                               labels=['host'])
+            faults = 0
+            for line in lines:
+                line = line.strip()
+                if any(s in line for s in ['W', 'D', 'M']):
+                    faults += 1
+            metadb.add_metric([host_name], float(faults))
+            yield metadb
+        else:
+            self.count_error(task_timeouted)
 
 
-class PrtdiagCollector(object):
+class PrtdiagCollector(BaseCollector):
     """
     'prtdiag' checker
     """
     # timeout how match seconds is allowed to collect data
     max_time_to_run = 50
-    prtdiag_collector_timeouts = Counter('solaris_exporter_prtdiag_timeouts', 'timeouts')
-    prtdiag_collector_run_time = Gauge('solaris_exporter_prtdiag_processing', 'Time spent processing request')
-
-    its_time_to_run_now = 0
-    # repeat prtdiag only after each 60 times, write result from cache instead (prtdiag is heavy)
-    repeat_prtdiag_after_times = 60
-
-    def collect(self):
-        global prtdiag_return_code
-        global prtdiag_timeouted
-        if self.its_time_to_run_now == 0:
-            with self.prtdiag_collector_run_time.time():
-                prtdiag_output, prtdiag_return_code, prtdiag_timeouted = run_shell_command('/usr/sbin/prtdiag -v',
-                                                                                           self.max_time_to_run)
-                if prtdiag_timeouted is True:
-                    self.prtdiag_collector_timeouts.inc()
-        self.its_time_to_run_now += 1
-        self.its_time_to_run_now %= self.repeat_prtdiag_after_times
+    timeouts_metric = 'solaris_exporter_prtdiag_timeouts'
+    processing_metric = 'solaris_exporter_prtdiag_processing'
+    # prtdiag is heavy, repeat it only once in cache_ttl_sec, return result from cache instead
+    cache_ttl_sec = 3600
+    command = '/usr/sbin/prtdiag -v'
+
+    def commands(self):
+        return [(self.command, self.max_time_to_run, self.cache_ttl_sec)]
+
+    def collect_metrics(self):
+        prtdiag_output, prtdiag_return_code, prtdiag_timeouted = run_cached_command(self.command,
+                                                                                    self.max_time_to_run,
+                                                                                    self.cache_ttl_sec)
+        if prtdiag_timeouted is True:
+            self.count_error(prtdiag_timeouted)
 
         if prtdiag_timeouted is False:
-            prtdiag = GaugeMetricFamily("solaris_exporter_prtdiag_rc", 'prtdiag return code', labels=['host'])
+            prtdiag = FilteredGaugeMetricFamily("solaris_exporter_prtdiag_rc", 'prtdiag return code', labels=['host'])
             prtdiag.add_metric([host_name], float(prtdiag_return_code))
             yield prtdiag
 
 
-class TextFileCollector(object):
+class TextFileCollector(BaseCollector):
     """
     Read Input from a textfile to include in output. Thanks to Marcel Peter
+    Parsed files are cached until file mtime, size or inode is changed.
+    File changed during reading is being written now, it is skipped and its previous version is used.
+    File with syntax error, bigger than text_file_max_size_bytes or with more than text_file_max_series
+    series is skipped, other files are returned.
     """
-    TextFileCollector_run_time = Gauge('solaris_exporter_textfile_processing', 'Time spent processing request')
+    processing_metric = 'solaris_exporter_textfile_processing'
+    textfile_parse_errors = Counter('solaris_exporter_textfile_parse_errors',
+                                    'Number of times when text file was skipped due to syntax error or limits',
+                                    ['file'])
+
+    def __init__(self):
+        super(TextFileCollector, self).__init__()
+        # {file_name: ((mtime, size, inode), [metric families])}
+        self.parsed_files = {}
+
+    def parse_file(self, file_name_r, file_key):
+        """
+        Returns (file_key, [metric families]) or None if file was changed while reading
+        """
+        if file_key[1] > text_file_max_size_bytes:
+            self.textfile_parse_errors.labels(file_name_r).inc()
+            return file_key, []
+        try:
+            with open(file_name_r, 'r') as text_object:
+                output = text_object.read()
+            stat = os.stat(file_name_r)
+        except (IOError, OSError):
+            return None
+        if (stat.st_mtime, stat.st_size, stat.st_ino) != file_key:
+            return None
+        # parser is imported on first text file, most hosts have none
+        from prometheus_client.parser import text_string_to_metric_families
+        try:
+            families = list(text_string_to_metric_families(output))
+        except Exception:
+            self.textfile_parse_errors.labels(file_name_r).inc()
+            return file_key, []
+        if sum(len(family.samples) for family in families) > text_file_max_series:
+            self.textfile_parse_errors.labels(file_name_r).inc()
+            return file_key, []
+        return file_key, families
+
+    def collect_metrics(self):
+        fpath = text_file_path
+        fnames = sorted(glob(fpath + '*.prom'))
+        textfile_mtime = FilteredGaugeMetricFamily('solaris_exporter_textfile_mtime_seconds',
+                                                   'modification time of text file', labels=['file', 'host'])
+        parsed_files = {}
+        for file_name_r in fnames:
+            try:
+                stat = os.stat(file_name_r)
+            except OSError:
+                continue
+            file_key = (stat.st_mtime, stat.st_size, stat.st_ino)
+            parsed = self.parsed_files.get(file_name_r)
+            if parsed is None or parsed[0] != file_key:
+                parsed = self.parse_file(file_name_r, file_key) or parsed
+            if parsed is None:
+                continue
+            parsed_files[file_name_r] = parsed
+            textfile_mtime.add_metric([file_name_r, host_name], parsed[0][0])
+        self.parsed_files = parsed_files
+
+        for file_name_r in fnames:
+            for family in parsed_files.get(file_name_r, (None, []))[1]:
+                yield family
+        yield textfile_mtime
+
+
+# flags column of 'ldm list -p': (position, flag, name of flag in solaris_exporter_ldom_flag), see ldm(8)
+ldom_flags_table = [
+    (0, 's', 'starting_or_stopping'),
+    (1, 'n', 'normal'),
+    (1, 't', 'transition'),
+    (1, 'd', 'degraded'),
+    (2, 'd', 'delayed_reconfiguration'),
+    (2, 'r', 'memory_dynamic_reconfiguration'),
+    (3, 'c', 'control_domain'),
+    (4, 'v', 'service_domain'),
+    (5, 's', 'migration_source'),
+    (5, 't', 'migration_target'),
+    (5, 'e', 'migration_error'),
+]
+ldom_states = {'active': 0, 'bound': 1, 'inactive': 2}
+ldom_migration_states = {'s': 1, 't': 2, 'e': 3}
+
+
+def parse_ldm_output(output):
+    """
+    Parses parseable (-p) output of 'ldm list', 'ldm list -l' and 'ldm list-bindings' by field names,
+    so new columns of ldmd are ignored. Returns list of domains: {'DOMAIN': {field: value}, section: [{field: value}]}.
+    Record is 'SECTION|field=value|...', next records of section are lines started with '|'.
+    """
+    domains = []
+    domain = None
+    section = None
+    for line in output.splitlines():
+        if not line or line.startswith('VERSION '):
+            continue
+        name, separator, rest = line.partition('|')
+        fields = {}
+        for item in rest.split('|'):
+            key, equal, value = item.partition('=')
+            if equal:
+                fields[key] = value
+        if name == 'DOMAIN':
+            domain = {'DOMAIN': fields}
+            domains.append(domain)
+            section = None
+        elif domain is None:
+            continue
+        elif name:
+            section = domain.setdefault(name, [])
+            if fields:
+                section.append(fields)
+        elif section is not None and fields:
+            section.append(fields)
+    return domains
+
+
+def ldom_flags_code(flags):
+    """
+    Flags of 'ldm list' as base-10 number, one digit per flags column, as 'flags' statistic of solaris_exporter_ldoms
+    """
+    code = 0
+    for position in range(6):
+        code *= 10
+        variants = [flag for flag_position, flag, name in ldom_flags_table if flag_position == position]
+        if position < len(flags) and flags[position] in variants:
+            code += variants.index(flags[position]) + 1
+    return code
 
-    def collect(self):
-        with self.TextFileCollector_run_time.time():
-            fpath = text_file_path
-            fnames = glob(fpath + '*.prom')
-            for file_name_r in fnames:
-                # filename to open for read
-                with open(file_name_r, 'r') as text_object:
-                    output = text_object.read()
-                    for family in text_string_to_metric_families(output):
-                        yield family
-                    text_object.close
 
+def ldom_number(value, default):
+    try:
+        return float(value)
+    except ValueError:
+        return default
 
-class LdomsLsCollector(object):
+
+class LdomsLsCollector(BaseCollector):
     """
-    Read input from 'ldm list' command
+    LDOMs of control domain from 'ldm list -p' (reused for ldom_list_cache_ttl_sec) and their bindings
+    from 'ldm list -l -p'. Long listing is slow with many guests, it is read again only when domains,
+    their state, ncpu or mem are changed, or after ldom_bindings_max_age_sec.
     """
     # timeout how match seconds is allowed to collect data
     max_time_to_run = 3
-    ldom_collector_timeouts = Counter('solaris_exporter_ldom_collector_timeouts',
-                                      'Number of times when ldom collector ran' +
-                                      ' more than ' + str(max_time_to_run) + ' seconds')
-    ldom_collector_errors = Counter('solaris_exporter_ldom_collector_errors',
-                                    'Number of times when ldom collector ran with errors')
-    ldom_collector_run_time = Gauge('solaris_exporter_ldom_collector_processing',
-                                    'Time spent processing request')
+    bindings_max_time_to_run = 30
+    timeouts_metric = 'solaris_exporter_ldom_collector_timeouts'
+    errors_metric = 'solaris_exporter_ldom_collector_errors'
+    processing_metric = 'solaris_exporter_ldom_collector_processing'
+    list_command = '/usr/sbin/ldm list -p'
+
+    def __init__(self):
+        super(LdomsLsCollector, self).__init__()
+        # {ldom: {resource: value}} from the last 'ldm list -l -p'
+        self.bindings = {}
+        self.bindings_signature = None
+        self.bindings_time = None
+
+    def commands(self):
+        # 'ldm list -l -p' is run only when bindings have to be refreshed
+        return [(self.list_command, self.max_time_to_run, ldom_list_cache_ttl_sec)]
+
+    def refresh_bindings(self, signature):
+        """
+        Reads bindings of domains, failed listing is retried when domains are changed or after max age
+        """
+        self.bindings_signature = signature
+        self.bindings_time = monotonic_time()
+        output, task_return_code, task_timeouted = run_shell_command('/usr/sbin/ldm list -l -p',
+                                                                     self.bindings_max_time_to_run)
+        if task_return_code != 0 or task_timeouted:
+            self.count_error(task_timeouted)
+            return
+        bindings = {}
+        for domain in parse_ldm_output(output):
+            name = domain['DOMAIN'].get('name')
+            if not name:
+                continue
+            memory = 0
+            for memory_block in domain.get('MEMORY', []):
+                memory += ldom_number(memory_block.get('size', ''), 0)
+            bindings[name] = {
+                'cores': len(domain.get('CORE', [])),
+                'vcpus': len(domain.get('VCPU', [])),
+                'memory_bytes': memory,
+                'io_devices': len(domain.get('IO', [])),
+            }
+        self.bindings = bindings
+
+    def collect_metrics(self):
+        ldoms = FilteredGaugeMetricFamily("solaris_exporter_ldoms",
+                                          'ldoms counters',
+                                          labels=['ldom', 'statistic', 'host'])
+        ldom_flag = FilteredGaugeMetricFamily("solaris_exporter_ldom_flag",
+                                              'flags of domain in ldm list, 1 - flag is set',
+                                              labels=['ldom', 'flag', 'host'])
+        ldom_migration = FilteredGaugeMetricFamily("solaris_exporter_ldom_migration_state",
+                                                   'migration of domain: 0 - none, 1 - source, 2 - target, 3 - error',
+                                                   labels=['ldom', 'host'])
+        ldom_bindings = FilteredGaugeMetricFamily("solaris_exporter_ldom_bindings",
+                                                  'resources bound to domain: cores, vcpus, memory_bytes, io_devices',
+                                                  labels=['ldom', 'resource', 'host'])
+        output, task_return_code, task_timeouted = run_cached_command(self.list_command, self.max_time_to_run,
+                                                                      ldom_list_cache_ttl_sec)
+        if task_return_code == 0 and task_timeouted is False:
+            domains = [domain['DOMAIN'] for domain in parse_ldm_output(output)]
+            signature = sorted((domain.get('name'), domain.get('state'), domain.get('ncpu'), domain.get('mem'))
+                               for domain in domains)
+            if signature != self.bindings_signature or \
+                    monotonic_time() - self.bindings_time >= ldom_bindings_max_age_sec:
+                self.refresh_bindings(signature)
+
+            for domain in domains:
+                # DOMAIN|name=dom50|state=active|flags=-n----|cons=5001|ncpu=88|mem=182536110080|util=5.7|uptime=17930944|norm_util=5.7
+                ldom_name = domain.get('name')
+                if not ldom_name:
+                    continue
+                flags = domain.get('flags', '')
+                ldom_cons = domain.get('cons', '')
+                ldom_cons = -1 if ldom_cons == 'UART' else ldom_number(ldom_cons, 0)
+
+                ldoms.add_metric([ldom_name, "ncpu", host_name], ldom_number(domain.get('ncpu', ''), 0))
+                ldoms.add_metric([ldom_name, "mem", host_name], ldom_number(domain.get('mem', ''), 0))
+                ldoms.add_metric([ldom_name, "util", host_name], ldom_number(domain.get('util', ''), -1))
+                ldoms.add_metric([ldom_name, "uptime_seconds", host_name], ldom_number(domain.get('uptime', ''), -1))
+                ldoms.add_metric([ldom_name, "norm_util", host_name], ldom_number(domain.get('norm_util', ''), -1))
+                ldoms.add_metric([ldom_name, "state", host_name], float(ldom_states.get(domain.get('state'), 3)))
+                ldoms.add_metric([ldom_name, "flags", host_name], float(ldom_flags_code(flags)))
+                ldoms.add_metric([ldom_name, "console_port", host_name], float(ldom_cons))
+
+                for position, flag, flag_name in ldom_flags_table:
+                    flag_set = flags[position:position + 1] == flag
+                    ldom_flag.add_metric([ldom_name, flag_name, host_name], 1 if flag_set else 0)
+                ldom_migration.add_metric([ldom_name, host_name], ldom_migration_states.get(flags[5:6], 0))
+                for resource, value in sorted(self.bindings.get(ldom_name, {}).items()):
+                    ldom_bindings.add_metric([ldom_name, resource, host_name], value)
+        else:
+            self.count_error(task_timeouted)
+        yield ldoms
+        yield ldom_flag
+        yield ldom_migration
+        yield ldom_bindings
+
+
+class BackgroundCollectionScheduler(object):
+    """
+    Runs collectors in background WorkerPool, each collector on its own schedule
+    (attribute 'collect_interval_sec' or background_collection_interval_sec).
+    Result of every successful collect() is saved as snapshot, scrape of /metrics only returns saved snapshots,
+    so it never waits for shell commands. collect() which raised or counted errors keeps the previous snapshot.
+    """
+    background_collection_errors = Counter('solaris_exporter_background_collection_errors',
+                                           'Number of times when collector failed in background',
+                                           ['collector'])
+
+    def __init__(self, collectors, workers=None, interval=None):
+        self.collectors = collectors
+        self.workers = workers or background_collection_workers
+        self.interval = interval or background_collection_interval_sec
+        # {collector_name: (list of metric families, time of collection)}
+        self.snapshots = {}
+        self.snapshots_lock = threading.Lock()
+        # set by workers when collector completes, wakes up scheduling loop
+        self.wakeup = threading.Event()
+        self.pool = None
+
+    def describe(self):
+        return []
+
+    def start(self):
+        self.pool = WorkerPool(self.workers, 'solaris_exporter_background')
+        scheduler = threading.Thread(target=self._schedule_loop, name='solaris_exporter_scheduler')
+        scheduler.daemon = True
+        scheduler.start()
+
+    def _collect_one(self, name, collector):
+        try:
+            families = list(collector.collect())
+        except Exception:
+            self.background_collection_errors.labels(name).inc()
+        else:
+            if collector_run_errors(collector):
+                # families of failed run are empty or partial
+                self.background_collection_errors.labels(name).inc()
+            else:
+                with self.snapshots_lock:
+                    self.snapshots[name] = (families, time.time())
+        self.wakeup.set()
+
+    def _schedule_loop(self):
+        next_run = {}
+        running = {}
+        while True:
+            self.wakeup.clear()
+            now = monotonic_time()
+            for collector in self.collectors:
+                name = collector_name(collector)
+                task = running.get(name)
+                if task is not None and not task.done.is_set():
+                    # do not run the same collector twice in parallel
+                    continue
+                if now >= next_run.get(name, 0):
+                    running[name] = self.pool.submit(self._collect_one, name, collector)
+                    next_run[name] = now + getattr(collector, 'collect_interval_sec', self.interval)
+            self.wakeup.wait(max(min(next_run.values()) - monotonic_time(), 0.1))
 
     def collect(self):
-        with self.ldom_collector_run_time.time():
-            ldoms = GaugeMetricFamily("solaris_exporter_ldoms",
-                                      'ldoms counters',
-                                      labels=['ldom', 'statistic', 'host'])
-            output, task_return_code, task_timeouted = run_shell_command('/usr/sbin/ldm list -p', self.max_time_to_run)
-            if task_return_code == 0 and task_timeouted is False:
-                lines = output.splitlines()
-                for line in lines:
-                    keyvalue = line.split("|")
-                    if keyvalue[0].startswith('VERSION '):
-                        ldm_version = keyvalue[0].split(" ")[1].split(".")
-                        # TODO: compatible version check here, tested for VERSION 1.21
-                        # if float(ldm_version[0]) != 1 and float(ldm_version[1]) != 21:
-                        #     print("Version " + ldm_version[0] + "." + ldm_version[1] + " is not tested with 'ldm list'")
-                        #     self.ldom_collector_errors.inc()
-                        #     break
-                        continue
-                    if keyvalue[0] == "DOMAIN":
-                        # DOMAIN|name=dom50|state=active|flags=-n----|cons=5001|ncpu=88|mem=182536110080|util=5.7|uptime=17930944|norm_util=5.7
-                        ldom_name = keyvalue[1].split("=")[1]
-
-                        ldom_state = keyvalue[2].split("=")[1]
-                        if ldom_state == "active":
-                            ldom_state = 0
-                        elif ldom_state == "bound":
-                            ldom_state = 1
-                        elif ldom_state == "inactive":
-                            ldom_state = 2
-                        else:
-                            ldom_state = 3
-
-                        # ldom flags is coded flag-state of domain, see comments
-                        ldom_flags = 0
-                        ldom_flags_all = keyvalue[3].split("=")[1]
-
-                        # should be not less then 4 - number of flag variants per position
-                        ldom_flags_code_base = 10
-
-                        # Column 1 - Starting or stopping domains:
-                        #               s starting or stopping
-                        if ldom_flags_all[0] == 's':
-                            ldom_flags = ldom_flags + 1
-                        ldom_flags = ldom_flags * ldom_flags_code_base
-
-                        # Column 2 - Domain status:
-                        #           n normal
-                        #           t transition
-                        #           d  degraded  domain  that  cannot  be started due to missing resources
-                        if ldom_flags_all[1] == 'n':
-                            ldom_flags = ldom_flags + 1
-                        elif ldom_flags_all[1] == 't':
-                            ldom_flags = ldom_flags + 2
-                        elif ldom_flags_all[1] == 'd':
-                            ldom_flags = ldom_flags + 3
-                        ldom_flags = ldom_flags * ldom_flags_code_base
-
-                        # Column 3 - Reconfiguration status:
-                        #           d delayed reconfiguration
-                        #           r memory dynamic reconfiguration
-                        if ldom_flags_all[2] == 'd':
-                            ldom_flags = ldom_flags + 1
-                        elif ldom_flags_all[2] == 'r':
-                            ldom_flags = ldom_flags + 2
-                        ldom_flags = ldom_flags * ldom_flags_code_base
-
-                        # Column 4 - Control domain
-                        #           c control domain
-                        if ldom_flags_all[3] == 'c':
-                            ldom_flags = ldom_flags + 1
-                        ldom_flags = ldom_flags * ldom_flags_code_base
-
-                        # Column 5 - Service domain
-                        #           v virtual I/O service domain
-                        if ldom_flags_all[4] == 'v':
-                            ldom_flags = ldom_flags + 1
-                        ldom_flags = ldom_flags * ldom_flags_code_base
-
-                        # Column 6 - Migration status
-                        #           s source domain in a migration
-                        #           t target domain in a migration
-                        #           e error occurred during a migration
-                        if ldom_flags_all[5] == 's':
-                            ldom_flags = ldom_flags + 1
-                        elif ldom_flags_all[5] == 't':
-                            ldom_flags = ldom_flags + 2
-                        elif ldom_flags_all[5] == 'e':
-                            ldom_flags = ldom_flags + 3
-
-                        ldom_cons = keyvalue[4].split("=")[1]
-                        if ldom_cons == "UART":
-                            ldom_cons = -1
-                        elif ldom_cons == "":
-                            ldom_cons = 0
-
-                        ldom_ncpu = keyvalue[5].split("=")[1]
-                        if ldom_ncpu == "":
-                            ldom_ncpu = 0
-                        ldom_mem = keyvalue[6].split("=")[1]
-                        if ldom_mem == "":
-                            ldom_mem = 0
-                        ldom_util = keyvalue[7].split("=")[1]
-                        if ldom_util == "":
-                            ldom_util = "-1"
-                        ldom_uptime = keyvalue[8].split("=")[1]
-                        if ldom_uptime == "":
-                            ldom_uptime = "-1"
-                        ldom_norm_util = keyvalue[9].split("=")[1]
-                        if ldom_norm_util == "":
-                            ldom_norm_util = "-1"
-
-                        # print("ldom " + ldom_name + " uptime '" + ldom_uptime + "'")
-                        ldoms.add_metric([ldom_name, "ncpu", host_name], float(ldom_ncpu))
-                        ldoms.add_metric([ldom_name, "mem", host_name], float(ldom_mem))
-                        ldoms.add_metric([ldom_name, "util", host_name], float(ldom_util))
-                        ldoms.add_metric([ldom_name, "uptime_seconds", host_name], float(ldom_uptime))
-                        ldoms.add_metric([ldom_name, "norm_util", host_name], float(ldom_norm_util))
-                        ldoms.add_metric([ldom_name, "state", host_name], float(ldom_state))
-                        ldoms.add_metric([ldom_name, "flags", host_name], float(ldom_flags))
-                        ldoms.add_metric([ldom_name, "console_port", host_name], float(ldom_cons))
+        now = time.time()
+        last_success = FilteredGaugeMetricFamily('solaris_exporter_collector_last_success_timestamp_seconds',
+                                                 'time of last successful background collection',
+                                                 labels=['collector', 'host'])
+        staleness = FilteredGaugeMetricFamily('solaris_exporter_collector_staleness_seconds',
+                                              'age of collector snapshot returned by background collection',
+                                              labels=['collector', 'host'])
+        with self.snapshots_lock:
+            snapshots = sorted(self.snapshots.items())
+        for name, (families, collected_at) in snapshots:
+            for family in families:
+                yield family
+            last_success.add_metric([name, host_name], collected_at)
+            staleness.add_metric([name, host_name], now - collected_at)
+        yield last_success
+        yield staleness
+
+
+class ConcurrentCollector(object):
+    """
+    Runs collectors in parallel in WorkerPool during scrape, so scrape takes as long as the slowest collector.
+    Collectors not completed in deadline are skipped, solaris_exporter_collector_success shows them as 0,
+    as well as collectors which counted errors during this run.
+    """
+
+    def __init__(self, collectors, workers=None, deadline=None):
+        self.collectors = collectors
+        self.deadline = deadline or concurrent_collection_deadline_sec
+        self.pool = WorkerPool(workers or concurrent_collection_workers, 'solaris_exporter_concurrent')
+        # tasks of the last scrape, {collector_name: WorkerTask}
+        self.running = {}
+        self.running_lock = threading.Lock()
+
+    def describe(self):
+        return []
 
+    def collect(self):
+        stop_time = monotonic_time() + self.deadline
+        tasks = []
+        with self.running_lock:
+            for collector in self.collectors:
+                name = collector_name(collector)
+                task = self.running.get(name)
+                if task is not None and not task.done.is_set():
+                    # collector is still running after previous scrape deadline, do not stack it
+                    tasks.append((name, collector, None))
+                    continue
+                task = self.pool.submit(lambda c: list(c.collect()), collector)
+                self.running[name] = task
+                tasks.append((name, collector, task))
+
+        success = FilteredGaugeMetricFamily('solaris_exporter_collector_success',
+                                            'collector completed in scrape deadline without errors',
+                                            labels=['collector', 'host'])
+        for name, collector, task in tasks:
+            if task is not None and task.wait(max(stop_time - monotonic_time(), 0)) and task.error is None:
+                for family in task.result:
+                    yield family
+                success.add_metric([name, host_name], 0 if collector_run_errors(collector) else 1)
             else:
-                self.ldom_collector_errors.inc()
-                if task_timeouted:
-                    self.ldom_collector_timeouts.inc()
-        yield ldoms
+                success.add_metric([name, host_name], 0)
+        yield success
 
 
 try:
     # Python 2.7
     from BaseHTTPServer import HTTPServer
-    from SocketServer import ThreadingMixIn
+    from urlparse import parse_qs, urlparse
 except ImportError:
     # Python 3
     from http.server import HTTPServer
-    from socketserver import ThreadingMixIn
+    from urllib.parse import parse_qs, urlparse
 
 from prometheus_client import MetricsHandler
+from prometheus_client.exposition import choose_encoder, generate_latest, CONTENT_TYPE_LATEST
+
+exporter_process = psutil.Process(os.getpid())
+scrape_peak_rss = Gauge('solaris_exporter_scrape_peak_rss_bytes', 'Peak RSS of exporter during the last collection')
+http_requests = Counter('solaris_exporter_http_requests', 'HTTP requests served by exporter', ['endpoint', 'code'])
+http_request_duration = Histogram('solaris_exporter_http_request_duration_seconds', 'Time of HTTP request',
+                                  ['endpoint'],
+                                  buckets=(.001, .005, .01, .05, .1, .25, .5, 1, 2.5, 5, 10, 25, 50, 100))
+http_rejected = Counter('solaris_exporter_http_rejected', 'HTTP requests answered by 503: queue_full, scrape_limit',
+                        ['reason'])
+http_connections = Gauge('solaris_exporter_http_connections', 'HTTP connections served by worker threads now')
+http_connection_errors = Counter('solaris_exporter_http_connection_errors',
+                                 'HTTP connections dropped by errors (broken pipe, reset by client)')
+
+
+def process_rss():
+    try:
+        return exporter_process.memory_info().rss
+    except (psutil.Error, OSError):
+        return 0
 
 
-class _ThreadingSimpleServer(ThreadingMixIn, HTTPServer):
-    daemon_threads = True
+class MetricFamilies(object):
+    """
+    List of metric families with collect() method, to encode families by generate_latest()
+    """
 
+    def __init__(self, families):
+        self.families = families
 
-def start_http_server(port, addr='', registry=REGISTRY):
-    """Starts an HTTP server for prometheus metrics as a daemon thread"""
+    def collect(self):
+        return self.families
+
+
+class ExpositionCache(object):
+    """
+    Shares collected and encoded registry output between scrapes.
+    Scrape arrived while collection is in progress waits for it and returns its result (coalesced).
+    Result is returned to all scrapes during exposition_cache_min_interval_sec (cached).
+    Gzip-compressed copy of result is made once for all scrapes that accept gzip.
+    """
+    exposition_requests = Counter('solaris_exporter_exposition_requests',
+                                  'Scrapes by the way of getting result: collected, coalesced or cached',
+                                  ['result'])
+
+    def __init__(self, registry, min_interval=None):
+        self.registry = registry
+        if min_interval is None:
+            min_interval = exposition_cache_min_interval_sec
+        self.min_interval = min_interval
+        # {content_type: [output, gzipped output or None, monotonic time of collection]}
+        self.results = {}
+        self.in_progress = set()
+        self.condition = threading.Condition()
+
+    def get(self, encoder, content_type, use_gzip=False):
+        """
+        Returns output of encoder(registry), gzip-compressed if use_gzip is set
+        """
+        waited_since = None
+        with self.condition:
+            while True:
+                result = self.results.get(content_type)
+                waited = waited_since is not None and result is not None and result[2] >= waited_since
+                if result is not None and (waited or monotonic_time() - result[2] < self.min_interval):
+                    self.exposition_requests.labels('coalesced' if waited else 'cached').inc()
+                    if use_gzip and result[1] is None:
+                        result[1] = gzip_compress(result[0])
+                    return result[1] if use_gzip else result[0]
+                if content_type not in self.in_progress:
+                    break
+                if waited_since is None:
+                    waited_since = monotonic_time()
+                self.condition.wait()
+            self.in_progress.add(content_type)
+
+        self.exposition_requests.labels('collected').inc()
+        result = None
+        try:
+            output = encoder(self.registry)
+            result = [output, gzip_compress(output) if use_gzip else None, monotonic_time()]
+            scrape_peak_rss.set(process_rss())
+        finally:
+            with self.condition:
+                self.in_progress.discard(content_type)
+                if result is not None:
+                    self.results[content_type] = result
+                self.condition.notify_all()
+        return result[1] if use_gzip else result[0]
+
+
+def gzip_compress(data):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
 
-    def my_http_error_handler(request, client_address):
-        print('Request from ' + client_address[0] + ':' + str(client_address[1]) + ' dropped. Broken pipe.')
 
-    CustomMetricsHandler = MetricsHandler.factory(registry)
-    httpd = _ThreadingSimpleServer((addr, port), CustomMetricsHandler)
-    httpd.handle_error = my_http_error_handler
+def accepts_gzip(accept_encoding):
+    """
+    True if gzip output is enabled and allowed by 'Accept-Encoding' header ('gzip', 'gzip;q=0.5', but not 'gzip;q=0')
+    """
+    if not exposition_gzip:
+        return False
+    for coding in (accept_encoding or '').split(','):
+        name, separator, params = coding.partition(';')
+        if name.strip().lower() != 'gzip':
+            continue
+        params = params.replace(' ', '')
+        try:
+            return not params.startswith('q=') or float(params[2:]) > 0
+        except ValueError:
+            return True
+    return False
+
+
+class SampleNamesExposition(object):
+    """
+    Output of registry restricted to samples named in 'name[]' parameters, collected on every request.
+    Used instead of registry.restricted_registry(), which finds collectors by names from their describe(),
+    but collectors describe nothing to avoid collection at registration.
+    """
+
+    def __init__(self, registry, names):
+        self.registry = registry
+        self.names = set(names)
+
+    def get(self, encoder, content_type, use_gzip=False):
+        families = []
+        for family in self.registry.collect():
+            samples = [sample for sample in family.samples if sample.name in self.names]
+            if samples:
+                family = copy.copy(family)
+                family.samples = samples
+                families.append(family)
+        output = encoder(MetricFamilies(families))
+        return gzip_compress(output) if use_gzip else output
+
+
+class SharedSnapshot(object):
+    """
+    Metric families of collector shared by zone targets: collector runs once in ttl seconds,
+    concurrent requests wait for one run.
+    """
+
+    def __init__(self, collector, ttl=None):
+        self.collector = collector
+        self.ttl = ttl or zone_targets_snapshot_ttl_sec
+        self.families = []
+        self.collected_at = None
+        self.lock = threading.Lock()
+
+    def get(self):
+        with self.lock:
+            if self.collected_at is None or monotonic_time() - self.collected_at >= self.ttl:
+                self.families = list(self.collector.collect())
+                self.collected_at = monotonic_time()
+            return self.families
+
+
+class ZoneFilterCollector(object):
+    """
+    Series of one zone from SharedSnapshot of per zone collector, value of 'host' label is replaced by zone name
+    """
+
+    def __init__(self, snapshot, zone):
+        self.snapshot = snapshot
+        self.zone = zone
+        self.name = 'Zone' + collector_name(snapshot.collector)
+
+    def collect(self):
+        for family in self.snapshot.get():
+            samples = [sample for sample in family.samples if sample.labels.get('zone') == self.zone]
+            if not samples:
+                continue
+            family = copy.copy(family)
+            family.samples = [sample._replace(labels=dict(sample.labels, host=self.zone))
+                              if 'host' in sample.labels else sample for sample in samples]
+            yield family
+
+
+class ZoneTargetRegistry(object):
+    """
+    Metrics of running local zones served by global zone exporter (zone_targets setting).
+    Registry of zone is made on its first scrape: ZoneSVCSCollector, ZoneDiskSpaceCollector
+    (mnttab index and statvfs threads are shared by all zones) and zone series from shared snapshots
+    of PerZoneCpuCollector, PerZoneCapsCollector and PerZoneSMFStateCollector. So forks and memory grow
+    with scraped zones, not with number of exporter processes. Registries of zones which are not running are dropped.
+    """
+
+    def __init__(self):
+        # {zonename: zonepath} of running local zones
+        self.zones = {}
+        self.zones_refresh_time = None
+        # {zonename: ExpositionCache of zone registry}
+        self.expositions = {}
+        self.lock = threading.Lock()
+        self.mount_index = MountIndex()
+        self.statvfs_pool = WorkerPool(diskspace_statvfs_workers, 'solaris_exporter_zone_statvfs')
+        self.snapshots = [SharedSnapshot(PerZoneCpuCollector()), SharedSnapshot(PerZoneCapsCollector()),
+                          SharedSnapshot(PerZoneSMFStateCollector(self))]
+
+    def running_zones(self):
+        """
+        Returns {zonename: zonepath} from 'zoneadm list -p', None on error
+        """
+        output, task_return_code, task_timeouted = run_shell_command('/usr/sbin/zoneadm list -p', 3)
+        if task_return_code != 0 or task_timeouted:
+            return None
+        zones = {}
+        for line in output.splitlines():
+            # zoneid:zonename:state:zonepath:uuid:brand:ip-type
+            fields = line.split(':')
+            if len(fields) > 3 and fields[1] != 'global' and fields[2] == 'running':
+                zones[fields[1]] = fields[3]
+        return zones
+
+    def make_registry(self, zone, zonepath):
+        collectors = [ZoneSVCSCollector(zone), ZoneDiskSpaceCollector(zone, zonepath, self.mount_index,
+                                                                      self.statvfs_pool)]
+        collectors.extend(ZoneFilterCollector(snapshot, zone) for snapshot in self.snapshots)
+        if series_filter.enabled or collector_max_series or collector_max_series_default:
+            collectors = [FilteredCollector(c) for c in collectors]
+        registry = CollectorRegistry()
+        for c in collectors:
+            registry.register(c)
+        return registry
+
+    def exposition(self, zone):
+        """
+        Returns ExpositionCache of zone registry, None if zone is not running
+        """
+        with self.lock:
+            if self.zones_refresh_time is None or \
+                    monotonic_time() - self.zones_refresh_time >= zone_targets_refresh_interval_sec:
+                zones = self.running_zones()
+                if zones is not None:
+                    for name in list(self.expositions):
+                        if zones.get(name) != self.zones.get(name):
+                            del self.expositions[name]
+                    self.zones = zones
+                self.zones_refresh_time = monotonic_time()
+            zonepath = self.zones.get(zone)
+            if zonepath is None:
+                return None
+            exposition = self.expositions.get(zone)
+            if exposition is None:
+                exposition = ExpositionCache(self.make_registry(zone, zonepath))
+                self.expositions[zone] = exposition
+            return exposition
+
+
+# set in global zone if zone_targets is enabled
+zone_target_registry = None
+zone_target_path = re.compile(r'^/zones/([A-Za-z0-9][A-Za-z0-9_.-]*)/metrics/?$')
+
+
+def zone_target_name(path):
+    """
+    Returns zone name requested by '/zones/<zonename>/metrics' or '/metrics?zone=<zonename>', None for host metrics
+    """
+    url = urlparse(path)
+    match = zone_target_path.match(url.path)
+    if match:
+        return match.group(1)
+    zones = parse_qs(url.query).get('zone')
+    if zones:
+        return zones[0]
+    return None
+
+
+class CachedMetricsHandler(MetricsHandler):
+    """
+    MetricsHandler which returns output through ExpositionCache,
+    or streams it as collectors return metric families if exposition_streaming is set.
+    Serves HTTP/1.1 keep-alive connections (http_keepalive_idle_sec), /healthz answers without collection,
+    not more than http_max_concurrent_scrapes of BoundedHTTPServer are generated at once.
+    """
+    exposition_cache = None
+    protocol_version = 'HTTP/1.1' if http_keepalive_idle_sec else 'HTTP/1.0'
+    # socket timeout of StreamRequestHandler
+    timeout = http_timeout_sec
+    # idle keep-alive connection checks for waiting connections this often
+    keepalive_poll_sec = 0.5
+    status = None
+
+    def handle_one_request(self):
+        if getattr(self, 'raw_requestline', None) is not None and not self.wait_next_request():
+            self.close_connection = True
+            return
+        MetricsHandler.handle_one_request(self)
+
+    def wait_next_request(self):
+        """
+        Waits for the next request of keep-alive connection by short select() polls.
+        Returns False if connection is idle for http_keepalive_idle_sec or other connections wait
+        while all threads are busy: idle connection gives its thread to them.
+        """
+        if self.request_buffered():
+            return True
+        connections = getattr(self.server, 'connections', None)
+        deadline = monotonic_time() + http_keepalive_idle_sec
+        while True:
+            if connections is not None and not connections.empty() and self.server.idle_workers == 0:
+                return False
+            remaining = deadline - monotonic_time()
+            if remaining <= 0:
+                return False
+            try:
+                readable = select.select([self.connection], [], [], min(self.keepalive_poll_sec, remaining))[0]
+            except (select.error, socket.error, ValueError):
+                return False
+            if readable:
+                return True
+
+    def request_buffered(self):
+        """
+        True if pipelined request is read already into rfile buffer, select() does not see it
+        """
+        peek = getattr(self.rfile, 'peek', None)
+        if peek is None:
+            # Python 2 socket._fileobject
+            buffered = getattr(self.rfile, '_rbuf', None)
+            return buffered is not None and buffered.tell() > 0
+        self.connection.settimeout(0.0)
+        try:
+            return len(peek(1)) > 0
+        except socket.error:
+            return False
+        finally:
+            self.connection.settimeout(http_timeout_sec)
+
+    def send_response(self, code, message=None):
+        self.status = code
+        MetricsHandler.send_response(self, code, message)
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path == '/healthz':
+            endpoint = 'healthz'
+        elif zone_target_name(self.path) is not None:
+            endpoint = 'zone'
+        else:
+            endpoint = 'metrics'
+        start_time = monotonic_time()
+        self.status = None
+        # plain HTTPServer has no limit of scrapes
+        scrapes = getattr(self.server, 'scrapes', None)
+        try:
+            if endpoint == 'healthz':
+                self.send_text(200, b'ok\n')
+            elif scrapes is None:
+                self.metrics_output()
+            elif scrapes.acquire(False):
+                try:
+                    self.metrics_output()
+                finally:
+                    scrapes.release()
+            else:
+                http_rejected.labels('scrape_limit').inc()
+                self.send_text(503, b'too many concurrent scrapes\n', ['Retry-After: 1'])
+        finally:
+            http_requests.labels(endpoint, str(self.status)).inc()
+            http_request_duration.labels(endpoint).observe(monotonic_time() - start_time)
+
+    def send_text(self, code, body, extra_headers=()):
+        self.send_response(code)
+        self.send_header('Content-Type', 'text/plain; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        for header in extra_headers:
+            self.send_header(*header.split(': ', 1))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def metrics_output(self):
+        zone = zone_target_name(self.path)
+        if zone is not None:
+            return self.zone_output(zone)
+        params = parse_qs(urlparse(self.path).query)
+        if self.exposition_cache is None:
+            # output of MetricsHandler has no Content-Length
+            self.close_connection = True
+            return MetricsHandler.do_GET(self)
+        encoder, content_type = choose_encoder(self.headers.get('Accept'))
+        use_gzip = accepts_gzip(self.headers.get('Accept-Encoding'))
+        if 'name[]' in params:
+            # filtered output is not cached
+            names = SampleNamesExposition(self.registry, params['name[]'])
+            return self.send_output(names, encoder, content_type, use_gzip)
+        if exposition_streaming and content_type == CONTENT_TYPE_LATEST:
+            return self.stream_output(use_gzip)
+        self.send_output(self.exposition_cache, encoder, content_type, use_gzip)
+
+    def zone_output(self, zone):
+        """
+        Metrics of local zone, if zone_targets is enabled
+        """
+        exposition = None
+        if zone_target_registry is not None:
+            exposition = zone_target_registry.exposition(zone)
+        if exposition is None:
+            self.send_text(404, b'zone is not running or zone targets are disabled\n')
+            return
+        encoder, content_type = choose_encoder(self.headers.get('Accept'))
+        use_gzip = accepts_gzip(self.headers.get('Accept-Encoding'))
+        self.send_output(exposition, encoder, content_type, use_gzip)
+
+    def send_output(self, exposition, encoder, content_type, use_gzip):
+        try:
+            output = exposition.get(encoder, content_type, use_gzip)
+        except Exception:
+            self.send_error(500, 'error generating metric output')
+            raise
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        if use_gzip:
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(output)))
+        self.end_headers()
+        self.wfile.write(output)
+
+    def write_chunk(self, data):
+        if data:
+            self.wfile.write(('%x\r\n' % len(data)).encode('ascii') + data + b'\r\n')
+
+    def stream_output(self, use_gzip):
+        """
+        Writes every metric family to socket as soon as it is collected, with chunked transfer encoding.
+        Whole output is never kept in memory. Error in collector breaks connection without last chunk,
+        so scrape fails.
+        """
+        # chunked transfer encoding requires HTTP/1.1 response
+        self.protocol_version = 'HTTP/1.1'
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE_LATEST)
+        self.send_header('Transfer-Encoding', 'chunked')
+        if use_gzip:
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        compressor = None
+        if use_gzip:
+            compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        peak_rss = process_rss()
+        for family in self.registry.collect():
+            data = generate_latest(MetricFamilies([family]))
+            if compressor is not None:
+                data = compressor.compress(data)
+            self.write_chunk(data)
+            peak_rss = max(peak_rss, process_rss())
+        if compressor is not None:
+            self.write_chunk(compressor.flush())
+        self.wfile.write(b'0\r\n\r\n')
+        scrape_peak_rss.set(peak_rss)
+
+
+class BoundedHTTPServer(HTTPServer):
+    """
+    HTTPServer which serves connections by fixed number of threads (http_workers) from bounded queue
+    (http_max_queued_connections). Connection which does not fit into queue gets '503 Service Unavailable'
+    from accepting thread, so slow or numerous clients can not make unlimited number of threads.
+    """
+    # accepting thread does not wait for client which does not read 503 response
+    reject_timeout_sec = 1
+    reject_response = (b'HTTP/1.0 503 Service Unavailable\r\nContent-Type: text/plain\r\nContent-Length: 21\r\n'
+                       b'Retry-After: 1\r\nConnection: close\r\n\r\ntoo many connections\n')
+
+    def __init__(self, server_address, handler_class, workers=None, max_queued=None, max_scrapes=None):
+        HTTPServer.__init__(self, server_address, handler_class)
+        self.connections = queue.Queue(max_queued or http_max_queued_connections)
+        self.scrapes = threading.Semaphore(max_scrapes or http_max_concurrent_scrapes)
+        # number of threads waiting for connection
+        self.idle_workers = 0
+        self.idle_workers_lock = threading.Lock()
+        for i in range(workers or http_workers):
+            worker = threading.Thread(target=self._worker, name='solaris_exporter_http_' + str(i))
+            worker.daemon = True
+            worker.start()
+
+    def process_request(self, request, client_address):
+        try:
+            self.connections.put_nowait((request, client_address))
+        except queue.Full:
+            http_rejected.labels('queue_full').inc()
+            try:
+                request.settimeout(self.reject_timeout_sec)
+                request.sendall(self.reject_response)
+            except socket.error:
+                pass
+            self.shutdown_request(request)
+
+    def _worker(self):
+        while True:
+            with self.idle_workers_lock:
+                self.idle_workers += 1
+            request, client_address = self.connections.get()
+            with self.idle_workers_lock:
+                self.idle_workers -= 1
+            http_connections.inc()
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                http_connections.dec()
+                self.shutdown_request(request)
+
+    def handle_error(self, request, client_address):
+        http_connection_errors.inc()
+        sys.stderr.write('Request from ' + client_address[0] + ':' + str(client_address[1]) + ' dropped: ' +
+                         str(sys.exc_info()[1]) + '\n')
+
+
+def start_http_server(port, addr='', registry=REGISTRY):
+    """Starts an HTTP server for prometheus metrics as a daemon thread"""
+    CustomMetricsHandler = CachedMetricsHandler.factory(registry)
+    CustomMetricsHandler.exposition_cache = ExpositionCache(registry)
+    httpd = BoundedHTTPServer((addr, port), CustomMetricsHandler)
     t = threading.Thread(target=httpd.serve_forever)
     t.daemon = True
     t.start()
 
 
-if __name__ == '__main__':
-    assert psutil.SUNOS, 'This program is for Solaris OS only. See installation doc in its header'
-    host_name = socket.gethostname()
-
-    # this will be refreshed once in dictionaries_refresh_interval_sec
-    disk_dictionary = get_disk_dictionary()
+def load_pset_dictionary():
+    global pset_dictionary, pset_dictionary_refresh_time
     pset_dictionary = get_pset_dictionary()
+    pset_dictionary_refresh_time = monotonic_time()
+
+
+def refresh_dictionaries():
+    """
+    Rebuilds disk_index when disks are changed and pset_dictionary once in dictionaries_refresh_interval_sec
+    """
+    disk_index.refresh_if_changed()
+    if monotonic_time() - pset_dictionary_refresh_time >= dictionaries_refresh_interval_sec:
+        load_pset_dictionary()
+
 
-    prtdiag_return_code = 0
-    prtdiag_timeouted = False
+class StartupDiscovery(object):
+    """
+    Discovery of host at startup, it runs in background threads after HTTP listener is bound:
+    'zoneadm list', 'ldm list' and 'zonename' select collectors, disk_index and pset_dictionary are built
+    in parallel with them. Collectors registered before dictionaries are ready export disks with 'unknown'
+    admin names and psets with 0 cpus.
+    Duration of every phase and time from process start to milestones are exported as metrics.
+    """
+    startup_phase_duration = Gauge('solaris_exporter_startup_phase_seconds',
+                                   'Duration of exporter startup phase', ['phase'])
+    startup_milestone = Gauge('solaris_exporter_startup_milestone_seconds',
+                              'Time from process start to startup milestone', ['milestone'])
+    startup_ready = Gauge('solaris_exporter_startup_ready', '1 when collectors and dictionaries are discovered')
 
+    def __init__(self):
+        try:
+            self.process_start = exporter_process.create_time()
+        except (psutil.Error, OSError):
+            self.process_start = module_start_time
+        self.startup_phase_duration.labels('interpreter').set(max(module_start_time - self.process_start, 0))
+        self.startup_phase_duration.labels('module').set(module_loaded_time - module_start_time)
+        self.pool = WorkerPool(6, 'solaris_exporter_discovery')
+        # {phase: WorkerTask}
+        self.tasks = {}
+
+    def timed(self, phase, function, *args):
+        start_time = monotonic_time()
+        try:
+            return function(*args)
+        finally:
+            self.startup_phase_duration.labels(phase).set(monotonic_time() - start_time)
+
+    def milestone(self, milestone):
+        self.startup_milestone.labels(milestone).set(time.time() - self.process_start)
+
+    def start(self):
+        phases = [
+            ('zones', run_shell_command, ('/usr/sbin/zoneadm list -icp', 3)),
+            # the same cached output is used by the first collection of LdomsLsCollector
+            ('ldoms', run_cached_command, ('/usr/sbin/ldm list -p', 3, ldom_list_cache_ttl_sec)),
+            ('zonename', run_shell_command, ('/usr/bin/zonename', 3)),
+            ('disk_index', disk_index.refresh_if_changed, ()),
+            ('pset_dictionary', load_pset_dictionary, ()),
+        ]
+        for phase, function, args in phases:
+            self.tasks[phase] = self.pool.submit(self.timed, phase, function, *args)
+        self.pool.submit(self.wait_dictionaries)
+
+    def command_output(self, phase):
+        """
+        Waits for command of phase, returns its output or '' on failure
+        """
+        task = self.tasks[phase]
+        task.wait()
+        if task.error is not None:
+            return ''
+        output, task_return_code, task_timeouted = task.result
+        if task_return_code != 0 or task_timeouted:
+            return ''
+        return output
+
+    def wait_dictionaries(self):
+        self.tasks['disk_index'].wait()
+        self.tasks['pset_dictionary'].wait()
+        self.milestone('dictionaries_ready')
+        self.startup_ready.set(1)
+
+
+def start_collectors(discovery, asyncio_mode=False):
+    """
+    Selects collectors by results of discovery and registers them in REGISTRY,
+    in asyncio runtime returned collectors are run by solaris_exporter_async instead
+    """
+    global zonename, zone_target_registry
     # collectors enabled for all zones:
     collectors = [
+        ExporterProcessCollector(),
         InventoryOSinfoCollector(),
         InventoryMemCollector(),
         InventoryCPUCollector(),
@@ -1474,28 +4452,22 @@ if __name__ == '__main__':
         NetworkCollector(),
         DiskSpaceCollector(),
         SVCSCollector(),
+        SMFStateCollector(),
         TextFileCollector(),
     ]
 
-    zones, rc, timeouted = run_shell_command('/usr/sbin/zoneadm list -icp', 3)
     nzones = 0
-    if rc == 0 and not timeouted:
-        zones = zones.splitlines()
-        for line in zones:
-            zone = line.split(':')
-            # print(zone)
-            zone = zone[1]
-            if zone != "global":
-                nzones += 1
-
-    ldoms, rc, timeouted = run_shell_command('/usr/sbin/ldm list -p', 3)
-    if ldoms != "":
+    for line in discovery.command_output('zones').splitlines():
+        zone = line.split(':')
+        if len(zone) > 1 and zone[1] != "global":
+            nzones += 1
+
+    if discovery.command_output('ldoms') != "":
         collectors.extend([
             LdomsLsCollector(),
         ])
 
-    zonename, rc, timeouted = run_shell_command('/usr/bin/zonename', 3)
-    zonename = zonename.strip()
+    zonename = discovery.command_output('zonename').strip()
     if zonename == "global":
         collectors.extend([
             CpuLoadCollector(),
@@ -1518,17 +4490,72 @@ if __name__ == '__main__':
             PerZoneCapsCollector(),
         ])
 
-    # start webserver and register selected collectors in prometheus.client library
-    start_http_server(exporter_port)
-    for c in collectors:
-        REGISTRY.register(c)
+    if series_filter.enabled or collector_max_series or collector_max_series_default:
+        collectors = [FilteredCollector(c) for c in collectors]
+
+    if zone_targets and zonename == "global":
+        zone_target_registry = ZoneTargetRegistry()
+
+    if background_collection:
+        scheduler = BackgroundCollectionScheduler(collectors)
+        scheduler.start()
+        collectors = [scheduler]
+    if not asyncio_mode:
+        if concurrent_collection and not background_collection:
+            REGISTRY.register(ConcurrentCollector(collectors))
+        else:
+            for c in collectors:
+                REGISTRY.register(c)
+    discovery.milestone('collectors_registered')
+    return collectors
+
+
+# end of startup 'module' phase: imports and definitions
+module_loaded_time = time.time()
+
+if __name__ == '__main__':
+    assert psutil.SUNOS, 'This program is for Solaris OS only. See installation doc in its header'
+    host_name = socket.gethostname()
+    discovery = StartupDiscovery()
+
+    use_asyncio_runtime = asyncio_runtime and sys.version_info >= (3, 7)
+    if asyncio_runtime and not use_asyncio_runtime:
+        print('asyncio_runtime requires Python 3.7+, threaded runtime is used')
+
+    # bind listener before discovery, scrapes get metrics of exporter itself until collectors are registered
+    REGISTRY.register(command_cache)
+    if not use_asyncio_runtime:
+        start_http_server(exporter_port)
+        discovery.milestone('listener')
+
+    kstat_reader = KstatReader()
+    # disk_index will be refreshed when disks are changed, pset_dictionary once in dictionaries_refresh_interval_sec,
+    # both are empty until discovery builds them
+    disk_index = DiskIndex()
+    pset_dictionary = {}
+    pset_dictionary_refresh_time = monotonic_time()
+    discovery.start()
+
+    if use_asyncio_runtime:
+        # solaris_exporter_async imports this module by name, it should not be imported twice
+        sys.modules.setdefault('solaris_exporter', sys.modules[__name__])
+        import solaris_exporter_async
+
+        def asyncio_startup():
+            discovery.milestone('listener')
+            return start_collectors(discovery, asyncio_mode=True)
+
+        try:
+            solaris_exporter_async.run([], exporter_port, startup=asyncio_startup, maintenance=refresh_dictionaries)
+        except KeyboardInterrupt:
+            print("\nExit Requested\n")
+            exit()
 
+    start_collectors(discovery)
     while True:
         try:
-            time.sleep(dictionaries_refresh_interval_sec)
-            # this will be refresh dicts once in dictionaries_refresh_interval_sec
-            disk_dictionary = get_disk_dictionary()
-            pset_dictionary = get_pset_dictionary()
+            time.sleep(disk_index_check_interval_sec)
+            refresh_dictionaries()
         except KeyboardInterrupt:
             print("\nExit Requested\n")
             exit()
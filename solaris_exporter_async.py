@@ -0,0 +1,431 @@
+#!/usr/bin/python3
+"""
+solaris_exporter_async.py
+asyncio runtime of solaris_exporter.py for Python 3.7+, it is used when 'asyncio_runtime = True' is set
+in solaris_exporter.py. Copy this file to the same folder as solaris_exporter.py.
+
+Differences from threaded runtime (BoundedHTTPServer, connections are served by http_workers threads):
+  - /metrics is served by asyncio server in event loop of main thread, connections do not take threads,
+    connection which does not send request headers in asyncio_request_timeout_sec is closed,
+    connection is closed after response (HTTP/1.0, no keep-alive);
+  - OS commands are run by asyncio subprocesses (AsyncCommandRunner), command is killed and reaped
+    at timeout or when it is cancelled, output pipes are not read by blocking threads;
+  - collectors run concurrently as asyncio tasks on every scrape (AsyncCollection), the same way as
+    concurrent_collection works: collectors not completed in concurrent_collection_deadline_sec are reported
+    by solaris_exporter_collector_success gauge.
+
+Collector classes are the same. AsyncCollection awaits collector coroutine collect_async() if collector has it.
+Otherwise commands declared by collector.commands() are run by AsyncCommandRunner first, then collector.collect()
+runs in thread of collectors executor (concurrent_collection_workers threads) and gets their output
+without waiting. Other commands of such collectors (conditional ones, kstat command backend) are passed
+to event loop by LoopCommandRunner, which replaces solaris_exporter.command_runner, and thread waits for them.
+At deadline commands of collectors are killed and collect() not started yet is cancelled, but collect()
+running in thread can not be stopped: collector keeps its thread and is not started again until it completes.
+
+Python 2.7 can not import this module, solaris_exporter.py keeps threaded runtime there.
+
+Runtime could be tried on Linux with stand-in collectors and commands, for example:
+    import solaris_exporter, solaris_exporter_async
+    solaris_exporter_async.run([MyCollector()], 9100)   # MyCollector runs 'sleep 10' by run_shell_command()
+"""
+import asyncio
+import concurrent.futures
+import threading
+import traceback
+
+from prometheus_client.core import REGISTRY
+from prometheus_client.exposition import choose_encoder
+
+import solaris_exporter as se
+
+http_reasons = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+                500: 'Internal Server Error'}
+
+
+class AsyncCommandRunner(object):
+    """
+    Runs OS commands as asyncio subprocesses with timeout, same metrics and results as CommandRunner.
+    Command is killed and reaped when timeout is expired or when waiting task is cancelled.
+    """
+
+    async def _read_output(self, process, chunks):
+        while True:
+            chunk = await process.stdout.read(65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+        await process.wait()
+
+    async def run(self, commandline, timeout):
+        """
+        Example:
+        output, task_return_code, task_timeouted = await async_command_runner.run('shell command text', timeout)
+        """
+        args = commandline.split()
+        start_time = se.monotonic_time()
+        try:
+            process = await asyncio.create_subprocess_exec(*args, stdout=asyncio.subprocess.PIPE,
+                                                           stderr=asyncio.subprocess.DEVNULL)
+        except OSError:
+            return "", 101, False
+
+        chunks = []
+        completed = False
+        try:
+            await asyncio.wait_for(self._read_output(process, chunks), timeout)
+            completed = True
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            if process.returncode is None:
+                try:
+                    process.kill()
+                except ProcessLookupError:
+                    pass
+                await process.wait()
+            output = b''.join(chunks)
+            label = se.command_label(args)
+            se.CommandRunner.command_duration.labels(label).observe(se.monotonic_time() - start_time)
+            se.CommandRunner.command_output_bytes.labels(label).inc(len(output))
+
+        if completed:
+            return output.decode('utf-8'), process.returncode, False
+        return output.decode('utf-8'), 100, True
+
+
+class LoopCommandRunner(object):
+    """
+    Replacement of solaris_exporter.command_runner for collectors running in executor threads:
+    command is run by AsyncCommandRunner in event loop, calling thread waits for its result.
+    Commands run in event loop thread itself (should not happen) are run by blocking CommandRunner.
+    """
+
+    def __init__(self, loop, runner=None, fallback=None):
+        self.loop = loop
+        self.loop_thread_id = threading.current_thread().ident
+        self.runner = runner or AsyncCommandRunner()
+        self.fallback = fallback or se.CommandRunner()
+        # {commandline: result} of commands run before function of run_prefetched() in this thread
+        self.prefetched = threading.local()
+
+    def run_prefetched(self, results, function):
+        """
+        Runs function in calling thread, its commands found in results are not run again
+        """
+        self.prefetched.results = results
+        try:
+            return function()
+        finally:
+            self.prefetched.results = None
+
+    def run(self, commandline, timeout):
+        results = getattr(self.prefetched, 'results', None)
+        if results and commandline in results:
+            return results.pop(commandline)
+        if threading.current_thread().ident == self.loop_thread_id:
+            return self.fallback.run(commandline, timeout)
+        future = asyncio.run_coroutine_threadsafe(self.runner.run(commandline, timeout), self.loop)
+        try:
+            # command is killed by its own timeout, extra time is for busy event loop
+            return future.result(timeout + 5)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            return "", 100, True
+
+
+def retrieve_exception(task):
+    """
+    Done callback of collector tasks completed after scrape deadline, their errors are counted by collectors
+    """
+    if not task.cancelled():
+        task.exception()
+
+
+class AsyncCollection(object):
+    """
+    Runs collectors concurrently as asyncio tasks of one event loop, returns families of collectors
+    completed in deadline and solaris_exporter_collector_success gauge.
+    Commands of collector.commands() are run by AsyncCommandRunner before collect() is given a thread
+    of executor. Tasks not completed in deadline are cancelled: commands are killed, collect() waiting
+    for thread is not run. Collector which is still running collect() in thread is not started again.
+    """
+
+    def __init__(self, collectors, deadline=None, command_runner=None, workers=None):
+        self.collectors = collectors
+        self.deadline = deadline or se.concurrent_collection_deadline_sec
+        # LoopCommandRunner which gives output of prefetched commands to collect()
+        self.command_runner = command_runner
+        self.async_command_runner = AsyncCommandRunner()
+        # collectors do not take threads of default executor, which encodes output and serves zone targets
+        self.executor = concurrent.futures.ThreadPoolExecutor(workers or se.concurrent_collection_workers)
+        # collect() of the last collection running in executor, {collector_name: concurrent.futures.Future}
+        self.running = {}
+
+    async def prefetch(self, collector):
+        """
+        Runs commands of collector by AsyncCommandRunner, returns {commandline: result}.
+        Cached commands are run only if command_cache has no result, stale result is refreshed by cache itself.
+        """
+        commands = [(commandline, timeout) for commandline, timeout, ttl in se.collector_commands(collector)
+                    if ttl is None or commandline not in se.command_cache.results]
+        if self.command_runner is None or not commands:
+            return {}
+        results = await asyncio.gather(*[self.async_command_runner.run(commandline, timeout)
+                                         for commandline, timeout in commands])
+        return dict(zip([commandline for commandline, timeout in commands], results))
+
+    async def collect_one(self, collector, name):
+        collect_async = getattr(collector, 'collect_async', None)
+        if collect_async is not None:
+            return list(await collect_async())
+        results = await self.prefetch(collector)
+        if self.command_runner is None:
+            future = self.executor.submit(lambda: list(collector.collect()))
+        else:
+            future = self.executor.submit(self.command_runner.run_prefetched, results,
+                                          lambda: list(collector.collect()))
+        self.running[name] = future
+        return await asyncio.wrap_future(future)
+
+    async def collect(self):
+        loop = asyncio.get_event_loop()
+        tasks = []
+        for collector in self.collectors:
+            name = se.collector_name(collector)
+            future = self.running.get(name)
+            if future is not None and not future.done():
+                # collect() is still running in thread after previous scrape deadline, do not stack it
+                tasks.append((name, collector, None))
+                continue
+            task = loop.create_task(self.collect_one(collector, name))
+            task.add_done_callback(retrieve_exception)
+            tasks.append((name, collector, task))
+
+        started = [task for name, collector, task in tasks if task is not None]
+        if started:
+            done, pending = await asyncio.wait(started, timeout=self.deadline)
+            for task in pending:
+                task.cancel()
+
+        families = []
+        success = se.FilteredGaugeMetricFamily('solaris_exporter_collector_success',
+                                               'collector completed in scrape deadline without errors',
+                                               labels=['collector', 'host'])
+        for name, collector, task in tasks:
+            if task is not None and task.done() and not task.cancelled() and task.exception() is None:
+                families.extend(task.result())
+                success.add_metric([name, se.host_name], 0 if se.collector_run_errors(collector) else 1)
+            else:
+                success.add_metric([name, se.host_name], 0)
+        families.append(success)
+        return families
+
+
+class AsyncExposition(object):
+    """
+    ExpositionCache of event loop: scrapes arrived during collection await it (coalesced),
+    result is returned to all scrapes during exposition_cache_min_interval_sec (cached).
+    Metrics of registry (exporter itself, command cache) are added to families of collectors.
+    Encoding and compression are made once per content type in executor thread.
+    """
+
+    def __init__(self, collection, registry=REGISTRY, min_interval=None):
+        self.collection = collection
+        self.registry = registry
+        if min_interval is None:
+            min_interval = se.exposition_cache_min_interval_sec
+        self.min_interval = min_interval
+        self.families = None
+        self.collected_at = None
+        self.collecting = None
+        # {(content_type, use_gzip): output} of current families
+        self.outputs = {}
+
+    async def _collect(self):
+        try:
+            families = await self.collection.collect()
+            families = list(self.registry.collect()) + families
+            se.scrape_peak_rss.set(se.process_rss())
+            self.families, self.collected_at, self.outputs = families, se.monotonic_time(), {}
+            return families
+        finally:
+            self.collecting = None
+
+    async def get_families(self):
+        if self.collecting is not None:
+            se.ExpositionCache.exposition_requests.labels('coalesced').inc()
+            return await asyncio.shield(self.collecting)
+        if self.families is not None and se.monotonic_time() - self.collected_at < self.min_interval:
+            se.ExpositionCache.exposition_requests.labels('cached').inc()
+            return self.families
+        se.ExpositionCache.exposition_requests.labels('collected').inc()
+        self.collecting = asyncio.get_event_loop().create_task(self._collect())
+        return await asyncio.shield(self.collecting)
+
+    async def get(self, encoder, content_type, use_gzip=False):
+        """
+        Returns output of encoder for collected families, gzip-compressed if use_gzip is set
+        """
+        families = await self.get_families()
+        key = (content_type, use_gzip)
+        output = self.outputs.get(key) if families is self.families else None
+        if output is None:
+            def encode():
+                data = encoder(se.MetricFamilies(families))
+                return se.gzip_compress(data) if use_gzip else data
+
+            output = await asyncio.get_event_loop().run_in_executor(None, encode)
+            if families is self.families:
+                self.outputs[key] = output
+        return output
+
+
+class AsyncMetricsServer(object):
+    """
+    HTTP/1.0 server of metrics for asyncio.start_server(), every GET request returns metrics
+    as MetricsHandler does, /healthz answers without collection. Connection is closed after response.
+    Zone targets (/zones/<zonename>/metrics) are served by ZoneTargetRegistry in executor thread.
+    """
+
+    def __init__(self, exposition, request_timeout=None):
+        self.exposition = exposition
+        self.request_timeout = request_timeout or se.asyncio_request_timeout_sec
+
+    async def read_request(self, reader):
+        """
+        Returns method, path and headers of request, header names are in lower case
+        """
+        request_line = (await reader.readline()).decode('latin-1').split()
+        if len(request_line) < 2:
+            raise ValueError('bad request line')
+        headers = {}
+        while True:
+            line = (await reader.readline()).decode('latin-1')
+            if not line.strip():
+                break
+            name, separator, value = line.partition(':')
+            if not separator:
+                raise ValueError('bad header line')
+            headers[name.strip().lower()] = value.strip()
+        return request_line[0], request_line[1], headers
+
+    def response(self, writer, status, content_type, body, extra_headers=()):
+        head = ['HTTP/1.0 %d %s' % (status, http_reasons[status]),
+                'Content-Type: ' + content_type,
+                'Content-Length: ' + str(len(body)),
+                'Connection: close']
+        head.extend(extra_headers)
+        writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1') + body)
+        return status
+
+    def zone_output(self, zone, encoder, content_type, use_gzip):
+        """
+        Returns metrics of local zone, None if zone is not running or zone_targets is disabled
+        """
+        if se.zone_target_registry is None:
+            return None
+        exposition = se.zone_target_registry.exposition(zone)
+        if exposition is None:
+            return None
+        return exposition.get(encoder, content_type, use_gzip)
+
+    async def handle(self, reader, writer):
+        endpoint = None
+        start_time = None
+        status = None
+        try:
+            try:
+                method, path, headers = await asyncio.wait_for(self.read_request(reader), self.request_timeout)
+            except (ValueError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+                self.response(writer, 400, 'text/plain', b'bad request\n')
+                return
+            start_time = se.monotonic_time()
+            zone = se.zone_target_name(path)
+            if path.split('?', 1)[0] == '/healthz':
+                endpoint = 'healthz'
+            else:
+                endpoint = 'metrics' if zone is None else 'zone'
+            if method not in ('GET', 'HEAD'):
+                status = self.response(writer, 405, 'text/plain', b'method not allowed\n')
+                return
+            if endpoint == 'healthz':
+                status = self.response(writer, 200, 'text/plain; charset=utf-8', b'' if method == 'HEAD' else b'ok\n')
+                return
+            encoder, content_type = choose_encoder(headers.get('accept'))
+            use_gzip = se.accepts_gzip(headers.get('accept-encoding'))
+            try:
+                if zone is None:
+                    output = await self.exposition.get(encoder, content_type, use_gzip)
+                else:
+                    output = await asyncio.get_event_loop().run_in_executor(
+                        None, self.zone_output, zone, encoder, content_type, use_gzip)
+                    if output is None:
+                        status = self.response(writer, 404, 'text/plain',
+                                               b'zone is not running or zone targets are disabled\n')
+                        return
+            except Exception:
+                traceback.print_exc()
+                status = self.response(writer, 500, 'text/plain', b'error generating metric output\n')
+                return
+            status = self.response(writer, 200, content_type, b'' if method == 'HEAD' else output,
+                                   ['Content-Encoding: gzip'] if use_gzip else [])
+        except (asyncio.TimeoutError, ConnectionError):
+            # client does not send request in time or closed connection, nothing to answer
+            pass
+        finally:
+            try:
+                await writer.drain()
+            except ConnectionError:
+                se.http_connection_errors.inc()
+            writer.close()
+            if endpoint is not None:
+                se.http_requests.labels(endpoint, str(status)).inc()
+                se.http_request_duration.labels(endpoint).observe(se.monotonic_time() - start_time)
+
+
+async def run_periodically(function, interval):
+    """
+    Runs blocking function in executor thread once in interval seconds
+    """
+    loop = asyncio.get_event_loop()
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await loop.run_in_executor(None, function)
+        except Exception:
+            traceback.print_exc()
+
+
+async def add_collectors(collection, startup):
+    """
+    Runs startup function in executor thread, adds collectors returned by it to collection
+    """
+    try:
+        collectors = await asyncio.get_event_loop().run_in_executor(None, startup)
+    except Exception:
+        traceback.print_exc()
+        return
+    collection.collectors = list(collection.collectors) + list(collectors)
+
+
+def run(collectors, port, addr='', maintenance=None, maintenance_interval=None, startup=None):
+    """
+    Serves metrics of collectors and registry on port, runs event loop in current (main) thread forever.
+    startup function is run in executor thread when port is bound, collectors returned by it are added
+    (discovery of host does not delay listener).
+    maintenance function is run in executor thread once in maintenance_interval (disk_index_check_interval_sec).
+    Event loop is run in main thread, because Python 3.7 child watcher of subprocesses requires it.
+    """
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    loop.set_default_executor(concurrent.futures.ThreadPoolExecutor(se.concurrent_collection_workers))
+    se.command_runner = LoopCommandRunner(loop)
+
+    collection = AsyncCollection(collectors, command_runner=se.command_runner)
+    server = AsyncMetricsServer(AsyncExposition(collection))
+    loop.run_until_complete(asyncio.start_server(server.handle, addr or None, port))
+    if startup is not None:
+        loop.create_task(add_collectors(collection, startup))
+    if maintenance is not None:
+        loop.create_task(run_periodically(maintenance, maintenance_interval or se.disk_index_check_interval_sec))
+    loop.run_forever()
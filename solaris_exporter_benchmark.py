@@ -0,0 +1,557 @@
+#!/usr/bin/python
+"""
+solaris_exporter_benchmark.py
+Offline benchmark of solaris_exporter.py collectors. Works on Linux, Solaris is not needed.
+
+Collectors get OS commands output from ReplayCommandRunner instead of running commands:
+outputs of 'kstat -p -c disk', 'kstat -p -c zones', 'iostat -En', 'mpathadm list lu', 'ldm list -p', 'ldm list -l -p',
+'zpool status', 'svcs -x', 'svcs -a', 'fmadm faulty' and others are generated for the given number of disks,
+zones and vCPUs, or taken from directory with recorded outputs (--fixtures, file names are in FIXTURE_FILES).
+kstat is read by KstatCommandBackend, so kstat output parsing is measured as it works in 'command' mode,
+recorded kstat outputs should contain 'class' statistics ('kstat -p' without selectors prints them).
+
+For every collector it reports time of collection (min and median of --repeat runs), peak of memory allocated
+during collection (Python 3 tracemalloc only), number of series and size of exposition text.
+Results could be saved by --save and compared with saved results by --compare, exit code is 1 if some
+collector became slower than saved time multiplied by (1 + --tolerance).
+
+Usage:
+    python solaris_exporter_benchmark.py                     # small, medium and large presets
+    python solaris_exporter_benchmark.py --disks 2000 --zones 100 --cpus 256
+    python solaris_exporter_benchmark.py --fixtures /var/tmp/recorded --repeat 20
+    python solaris_exporter_benchmark.py --save base.json; python solaris_exporter_benchmark.py --compare base.json
+    python solaris_exporter_benchmark.py --kstat-parser --scale medium
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+try:
+    import tracemalloc
+except ImportError:
+    # Python 2.7
+    tracemalloc = None
+
+from prometheus_client.core import CollectorRegistry
+from prometheus_client.exposition import generate_latest
+
+import solaris_exporter as se
+
+# (disks, zones, vcpus) of synthetic fixtures
+scale_presets = {
+    'small': (10, 2, 8),
+    'medium': (1000, 50, 128),
+    'large': (10000, 500, 1024),
+}
+
+# command prefix: file name of recorded output in --fixtures directory
+FIXTURE_FILES = {
+    'kstat -p -c disk': 'kstat_disk.txt',
+    'kstat -p -c device_error': 'kstat_device_error.txt',
+    'kstat -p -c zones': 'kstat_zones.txt',
+    'kstat -p -c zone_caps': 'kstat_zone_caps.txt',
+    'kstat -p -c misc': 'kstat_misc.txt',
+    'kstat -p zone_vfs': 'kstat_zone_vfs.txt',
+    '/usr/bin/iostat -E': 'iostat_E.txt',
+    '/usr/bin/iostat -En': 'iostat_En.txt',
+    '/usr/sbin/mpathadm list lu': 'mpathadm_list_lu.txt',
+    '/usr/sbin/mpathadm show lu': 'mpathadm_show_lu.txt',
+    '/usr/sbin/fcinfo hba-port -l': 'fcinfo_hba_port_l.txt',
+    '/usr/sbin/ldm list -p': 'ldm_list_p.txt',
+    '/usr/sbin/ldm list -l -p': 'ldm_list_l_p.txt',
+    '/usr/sbin/zpool list': 'zpool_list.txt',
+    '/usr/sbin/zpool status': 'zpool_status.txt',
+    '/usr/bin/svcs -x': 'svcs_x.txt',
+    '/usr/bin/svcs -a': 'svcs_a.txt',
+    '/usr/bin/pfexec /usr/sbin/fmadm faulty': 'fmadm_faulty.txt',
+    '/usr/bin/pfexec /usr/sbin/fmdump -t': 'fmdump_t.txt',
+    '/usr/bin/pfexec /usr/sbin/fmdump -e -t': 'fmdump_e_t.txt',
+    '/usr/bin/pfexec /usr/sbin/fmstat': 'fmstat.txt',
+}
+
+
+class ReplayCommandRunner(object):
+    """
+    Replaces solaris_exporter.command_runner: returns output of the longest command prefix found in outputs,
+    unknown commands fail with return code 1.
+    'kstat -p [-c class] [selectors]' gets records of all kstat outputs selected as kstat command does,
+    selection is made once per command line, so it is not measured as parsing.
+    'mpathadm show lu <lu> ...' gets only blocks of requested LUs, as mpathadm does.
+    """
+    show_lu = '/usr/sbin/mpathadm show lu'
+
+    def __init__(self, outputs):
+        self.outputs = dict((prefix, output) for prefix, output in outputs.items() if not prefix.startswith('kstat '))
+        self.prefixes = sorted(self.outputs, key=len, reverse=True)
+        self.kstat_backend = se.KstatTextBackend(''.join(output for prefix, output in sorted(outputs.items())
+                                                         if prefix.startswith('kstat ')))
+        self.kstat_outputs = {}
+        # {lu: 'Logical Unit: lu' block of 'mpathadm show lu' output}
+        self.show_lu_blocks = {}
+        lu = None
+        for line in self.outputs.get(self.show_lu, '').splitlines(True):
+            if line.startswith('Logical Unit:'):
+                lu = line.split(':', 1)[1].strip()
+                self.show_lu_blocks[lu] = []
+            if lu is not None:
+                self.show_lu_blocks[lu].append(line)
+
+    def kstat_output(self, commandline):
+        output = self.kstat_outputs.get(commandline)
+        if output is None:
+            args = commandline.split()[1:]
+            ks_class = None
+            specs = []
+            while args:
+                arg = args.pop(0)
+                if arg == '-c':
+                    ks_class = args.pop(0)
+                elif not arg.startswith('-'):
+                    specs.append(arg)
+            records = self.kstat_backend.read(specs, ks_class, 0)[0]
+            output = ''.join('%s:%s:%s:%s\t%s\n' % record for record in records)
+            self.kstat_outputs[commandline] = output
+        return output
+
+    def run(self, commandline, timeout):
+        if commandline.startswith('kstat '):
+            return self.kstat_output(commandline), 0, False
+        if commandline.startswith(self.show_lu + ' ') and self.show_lu_blocks:
+            return ''.join(''.join(self.show_lu_blocks.get(lu, [])) for lu in commandline.split()[3:]), 0, False
+        for prefix in self.prefixes:
+            if commandline.startswith(prefix):
+                return self.outputs[prefix], 0, False
+        return '', 1, False
+
+
+def disk_serial(disk):
+    return 'SN%08d' % disk
+
+
+def generate_outputs(disks, zones, cpus, per_cpu_zone_kstats=False):
+    """
+    Returns {command prefix: output} with synthetic outputs in the format of Solaris 11 commands.
+    per_cpu_zone_kstats - make 'cpu:<cpu>:sys_zone_<zone id>' kstats instead of 'cpu:<zone id>:sys_zone_accum'
+    (kernels without accum kstats), their number is zones * cpus.
+    """
+    kstat_disk = []
+    kstat_device_error = []
+    iostat_e = []
+    iostat_en = []
+    mpathadm = []
+    mpathadm_show = []
+    for disk in range(disks):
+        name = 'sd%d' % disk
+        prefix = 'sd:%d:%s:' % (disk, name)
+        kstat_disk.append(prefix + 'class\tdisk')
+        kstat_disk.append(prefix + 'crtime\t%d.123456789' % (100 + disk))
+        for statistic in ['nread', 'nwritten', 'reads', 'writes', 'rcnt', 'wcnt', 'rlastupdate', 'wlastupdate']:
+            kstat_disk.append(prefix + '%s\t%d' % (statistic, disk * 1000 + 17))
+        for statistic in ['rtime', 'wtime', 'rlentime', 'wlentime']:
+            kstat_disk.append(prefix + '%s\t%d.%09d' % (statistic, disk, disk * 7919 % 1000000000))
+        kstat_disk.append(prefix + 'snaptime\t%d.987654321' % (100000 + disk))
+
+        prefix = 'sderr:%d:%s,err:' % (disk, name)
+        kstat_device_error.append(prefix + 'class\tdevice_error')
+        for statistic in ['Soft Errors', 'Hard Errors', 'Transport Errors', 'Media Error', 'Device Not Ready',
+                          'No Device', 'Recoverable', 'Illegal Request', 'Predictive Failure Analysis']:
+            kstat_device_error.append(prefix + '%s\t%d' % (statistic, disk % 3))
+        kstat_device_error.append(prefix + 'Vendor\tSEAGATE')
+        kstat_device_error.append(prefix + 'Product\tST914603SSUN146G')
+        kstat_device_error.append(prefix + 'Serial No\t%s' % disk_serial(disk))
+
+        admin_name = 'c0t5000CCA0%08Xd0' % disk
+        block = [' Soft Errors: 0 Hard Errors: %d Transport Errors: 0 ' % (disk % 3),
+                 'Vendor: SEAGATE  Product: ST914603SSUN146G Revision: 0B92 Serial No: %s ' % disk_serial(disk),
+                 'Size: 146.80GB <146800115712 bytes>',
+                 'Media Error: 0 Device Not Ready: 0 No Device: 0 Recoverable: 0 ',
+                 'Illegal Request: 0 Predictive Failure Analysis: 0 ']
+        iostat_e.append('%-9s' % name + block[0])
+        iostat_e.extend(block[1:])
+        iostat_en.append('%-9s' % admin_name + block[0])
+        iostat_en.extend(block[1:])
+
+        mpathadm.append('        /dev/rdsk/%ss2' % admin_name)
+        mpathadm.append('                Total Path Count: 4')
+        mpathadm.append('                Operational Path Count: %d' % (4 - disk % 2))
+        mpathadm_show.extend(['Logical Unit:  /dev/rdsk/%ss2' % admin_name,
+                              '        mpath-support:  libmpscsi_vhci.so',
+                              '        Vendor:  SUN', '        Product:  CSM200_R', '        Paths:'])
+        for path in range(4):
+            mpathadm_show.extend(['                Initiator Port Name:  10000000c967b7b%d' % (path % 2),
+                                  '                Target Port Name:  20%d400a0b826b9c1' % path,
+                                  '                Override Path:  NA',
+                                  '                Path State:  %s' % ('OK' if path < 4 - disk % 2 else 'Failed'),
+                                  '                Disabled:  no', ''])
+        mpathadm_show.extend(['        Target Port Groups:', '                ID:  1',
+                              '                Access State:  active optimized'])
+
+    kstat_zones = []
+    kstat_zone_vfs = []
+    kstat_zone_caps = []
+    for zone in range(zones):
+        zonename = 'global' if zone == 0 else 'zone%d' % zone
+        if per_cpu_zone_kstats:
+            for cpu in range(cpus):
+                prefix = 'cpu:%d:sys_zone_%d:' % (cpu, zone)
+                kstat_zones.append(prefix + 'class\tzones')
+                for statistic in se.per_zone_cpu_counters_dictionary:
+                    kstat_zones.append(prefix + '%s\t%d' % (statistic, (zone + 1) * 1000003))
+                kstat_zones.append(prefix + 'zonename\t%s' % zonename)
+        else:
+            prefix = 'cpu:%d:sys_zone_accum:' % zone
+            kstat_zones.append(prefix + 'class\tzones')
+            for statistic in se.per_zone_cpu_counters_dictionary:
+                kstat_zones.append(prefix + '%s\t%d' % (statistic, (zone + 1) * cpus * 1000003))
+        kstat_zones.append('cpu:%d:sys_zone_pset_0_accum:class\tzones' % zone)
+        kstat_zones.append('cpu:%d:sys_zone_pset_0_accum:cpu_nsec_user\t%d' % (zone, (zone + 1) * cpus * 1000003))
+
+        prefix = 'zone_vfs:%d:%s:' % (zone, zonename)
+        kstat_zone_vfs.append(prefix + 'class\tzone_vfs')
+        for statistic in ['nread', 'nwritten', 'rtime', 'wtime']:
+            kstat_zone_vfs.append(prefix + '%s\t%d' % (statistic, zone * 4096 + 1))
+        prefix = 'zones:%d:%s:' % (zone, zonename)
+        kstat_zone_vfs.append(prefix + 'class\tzone_misc')
+        kstat_zone_vfs.append(prefix + 'zonename\t%s' % zonename)
+        kstat_zone_vfs.append(prefix + 'nsec_waitrq\t%d' % (zone * 1000000))
+
+        prefix = 'caps:%d:swapresv_zone_%d:' % (zone, zone)
+        kstat_zone_caps.append(prefix + 'class\tzone_caps')
+        kstat_zone_caps.append(prefix + 'usage\t%d' % (zone * 1048576))
+        kstat_zone_caps.append(prefix + 'value\t18446744073709551615')
+        kstat_zone_caps.append(prefix + 'zonename\t%s' % zonename)
+        kstat_zone_caps.append('caps:%d:nprocs_zone_%d:class\tzone_caps' % (zone, zone))
+        kstat_zone_caps.append('caps:%d:nprocs_zone_%d:usage\t%d' % (zone, zone, zone + 30))
+
+    # zpool of 2-way mirrors, 24 disks per pool
+    zpool_list = []
+    zpool_status = []
+    admin_names = ['c0t5000CCA0%08Xd0' % disk for disk in range(disks)]
+    for pool_number, first in enumerate(range(0, max(disks, 2), 24)):
+        pool = 'pool%d' % pool_number
+        pool_disks = admin_names[first:first + 24] or ['c1t0d0', 'c1t1d0']
+        zpool_list.append('\t'.join([pool, '1099511627776', '549755813888', '549755813888', '12', '50',
+                                     'ONLINE']))
+        zpool_status.extend(['  pool: ' + pool, ' state: ONLINE',
+                             '  scan: scrub repaired 0 in 0h5m with 0 errors on Sun Jan  5 03:10:02 2020',
+                             'config:', '', '\tNAME                       STATE     READ WRITE CKSUM',
+                             '\t%-26s ONLINE       0     0     0' % pool])
+        for mirror in range(0, len(pool_disks), 2):
+            zpool_status.append('\t  %-24s ONLINE       0     0     0' % ('mirror-%d' % (mirror // 2)))
+            for disk in pool_disks[mirror:mirror + 2]:
+                zpool_status.append('\t    %-22s ONLINE       0     0     0' % disk)
+        zpool_status.extend(['', 'errors: No known data errors', ''])
+
+    ldoms = max(1, zones // 10)
+    ldm = ['VERSION 1.21']
+    ldm_long = ['VERSION 1.21']
+    for ldom in range(ldoms):
+        domain = ('DOMAIN|name=%s|state=active|flags=-n-cv-|cons=%s|ncpu=%d|mem=182536110080|util=5.7|'
+                  'uptime=17930944|norm_util=5.7' % ('primary' if ldom == 0 else 'ldom%d' % ldom,
+                                                     'UART' if ldom == 0 else str(5000 + ldom), cpus))
+        ldm.append(domain)
+        ldm_long.extend([domain, 'CONTROL|failure-policy=ignore|extended-mapin-space=on|cpu-arch=native', 'CORE'])
+        ldm_long.extend('|cid=%d|cpuset=%s' % (core, ','.join(str(core * 8 + strand) for strand in range(8)))
+                        for core in range(max(1, cpus // 8)))
+        ldm_long.append('VCPU')
+        ldm_long.extend('|vid=%d|pid=%d|util=1.5%%|strand=100|cid=%d' % (vcpu, vcpu, vcpu // 8) for vcpu in range(cpus))
+        ldm_long.extend(['MEMORY', '|ra=0x30000000|pa=0x30000000|size=182536110080',
+                         'IO', '|dev=pci@400|alias=pci_0', '|dev=pci@500|alias=pci_1'])
+
+    svcs = []
+    for service in range(max(1, zones // 10)):
+        svcs.extend(['svc:/application/app%d:default (application %d)' % (service, service),
+                     ' State: maintenance since Mon Jan  6 10:00:00 2020',
+                     'Reason: Start method failed repeatedly, last exited with status 1.', ''])
+    svcs_a = ['legacy_run     lrc:/etc/rc2_d/S47pppd']
+    svcs_a.extend('online         svc:/system/service%d:default' % service for service in range(150))
+    svcs_a.extend('disabled       svc:/network/service%d:default' % service for service in range(50))
+    svcs_a.extend('maintenance    svc:/application/app%d:default' % service for service in range(max(1, zones // 10)))
+    fmadm = []
+    for fault in range(max(1, disks // 500)):
+        fmadm.extend(['--------------- ------------------------------------  -------------- ---------',
+                      'TIME            EVENT-ID                              MSG-ID         SEVERITY',
+                      '--------------- ------------------------------------  -------------- ---------',
+                      'Jan 06 10:00:00 %08x-0000-0000-0000-000000000000  DISK-8000-0X   Major' % fault, '',
+                      'Problem Status    : open',
+                      'Diag Engine       : eft / 1.16',
+                      'System',
+                      '    Manufacturer  : Oracle Corporation',
+                      '',
+                      'Suspect 1 of 1 :',
+                      '   Problem class : fault.io.disk.predictive-failure',
+                      '   Certainty   : 100%',
+                      '   Affects     : dev:///:devid=id1,sd@n5000c500%08x//scsi_vhci/disk@g5000c500%08x'
+                      % (fault, fault),
+                      '   Status      : faulted but still in service',
+                      '',
+                      '   FRU',
+                      '     Status            : faulty',
+                      '     Location          : "HDD%d"' % fault, ''])
+    fmdump = ['TIME                 UUID                                 SUNW-MSG-ID EVENT']
+    fmdump.extend('Jan 06 10:00:00.1234 %08x-0000-0000-0000-000000000000 DISK-8000-0X Diagnosed' % fault
+                  for fault in range(max(1, disks // 500)))
+    fmdump_e = ['TIME                 CLASS']
+    fmdump_e.extend('Jan 06 10:00:%02d.1234 ereport.io.scsi.cmd.disk.dev.rqs.derr' % (disk % 60)
+                    for disk in range(max(1, disks // 100)))
+    fmstat = ['module             ev_recv ev_acpt wait  svc_t  %w  %b  open solve  memsz  bufsz']
+    fmstat.extend('%-18s %7d %7d  0.0 %6.1f   0   0 %5d %5d  %5s %6s' % (module, 10, 2, 1.5, 0, 0, '32b', '1.2K')
+                  for module in ('cpumem-retire', 'disk-transport', 'eft', 'io-retire', 'zfs-diagnosis'))
+
+    return {
+        'kstat -p -c disk': '\n'.join(kstat_disk) + '\n',
+        'kstat -p -c device_error': '\n'.join(kstat_device_error) + '\n',
+        'kstat -p -c zones': '\n'.join(kstat_zones) + '\n',
+        'kstat -p -c zone_caps': '\n'.join(kstat_zone_caps) + '\n',
+        'kstat -p -c misc': 'unix:0:pset:class\tmisc\nunix:0:pset:ncpus\t%d\n' % cpus,
+        'kstat -p zone_vfs': '\n'.join(kstat_zone_vfs) + '\n',
+        '/usr/bin/iostat -E': '\n'.join(iostat_e) + '\n',
+        '/usr/bin/iostat -En': '\n'.join(iostat_en) + '\n',
+        '/usr/sbin/mpathadm list lu': '\n'.join(mpathadm) + '\n',
+        '/usr/sbin/mpathadm show lu': '\n'.join(mpathadm_show) + '\n',
+        '/usr/sbin/fcinfo hba-port -l': ''.join(
+            'HBA Port WWN: 10000000c967b7b%d\n        OS Device Name: /dev/cfg/c%d\n        State: online\n'
+            '        Current Speed: 8Gb\n        Link Error Statistics:\n                Link Failure Count: 0\n'
+            '                Loss of Sync Count: 3\n                Loss of Signal Count: 1\n'
+            '                Invalid CRC Count: 0\n' % (port, port + 3) for port in range(2)),
+        '/usr/sbin/ldm list -p': '\n'.join(ldm) + '\n',
+        '/usr/sbin/ldm list -l -p': '\n'.join(ldm_long) + '\n',
+        '/usr/sbin/zpool list': '\n'.join(zpool_list) + '\n',
+        '/usr/sbin/zpool status': '\n'.join(zpool_status) + '\n',
+        '/usr/bin/svcs -x': '\n'.join(svcs) + '\n',
+        '/usr/bin/svcs -a': '\n'.join(svcs_a) + '\n',
+        '/usr/bin/pfexec /usr/sbin/fmadm faulty': '\n'.join(fmadm) + '\n',
+        '/usr/bin/pfexec /usr/sbin/fmdump -t': '\n'.join(fmdump) + '\n',
+        '/usr/bin/pfexec /usr/sbin/fmdump -e -t': '\n'.join(fmdump_e) + '\n',
+        '/usr/bin/pfexec /usr/sbin/fmstat': '\n'.join(fmstat) + '\n',
+    }
+
+
+def read_fixtures(directory):
+    """
+    Returns {command prefix: output} of recorded outputs found in directory
+    """
+    outputs = {}
+    for prefix, file_name in FIXTURE_FILES.items():
+        path = os.path.join(directory, file_name)
+        if os.path.isfile(path):
+            with open(path) as fixture:
+                outputs[prefix] = fixture.read()
+    return outputs
+
+
+class DiskDictionaryCollector(se.BaseCollector):
+    """
+    'iostat -E' and 'iostat -En' parsing of DiskIndex, measured as collector
+    """
+
+    def collect_metrics(self):
+        disks = se.get_disk_dictionary()
+        family = se.GaugeMetricFamily('solaris_exporter_benchmark_disks', 'disks in dictionary', labels=[])
+        family.add_metric([], len(disks))
+        yield family
+
+
+class FCTopologyCollector(se.BaseCollector):
+    """
+    Full 'mpathadm show lu' topology read of FCinfoCollector, which runs in background thread of exporter
+    """
+
+    def collect_metrics(self):
+        lus = se.parse_mpathadm_list(se.run_shell_command('/usr/sbin/mpathadm list lu', 4)[0])
+        fc_collector = se.FCinfoCollector()
+        fc_collector.refresh_topology(sorted(lus), lus)
+        family = se.GaugeMetricFamily('solaris_exporter_benchmark_fc_paths', 'paths in topology', labels=[])
+        family.add_metric([], sum(len(lu['paths']) for lu in fc_collector.topology.values()))
+        yield family
+
+
+benchmark_collectors = [
+    DiskDictionaryCollector,
+    se.DiskIOCollector,
+    se.DiskErrorCollector,
+    se.PerZoneCpuCollector,
+    se.PerZoneCapsCollector,
+    se.FCinfoCollector,
+    FCTopologyCollector,
+    se.ZpoolCollector,
+    se.LdomsLsCollector,
+    se.SVCSCollector,
+    se.SMFStateCollector,
+    se.FmadmCollector,
+]
+
+
+def legacy_kstat_records(output):
+    """
+    'kstat -p' output parsing as it was made before KstatNameCache, reference for --kstat-parser
+    """
+    records = []
+    for line in output.splitlines():
+        kstatkeyvalue = line.split("\t")
+        if len(kstatkeyvalue) < 2:
+            continue
+        kstatkey = kstatkeyvalue[0].split(":")
+        if len(kstatkey) < 4:
+            continue
+        records.append((se.kstat_name_cleaner.sub('_', kstatkey[0]), kstatkey[1],
+                        se.kstat_name_cleaner.sub('_', kstatkey[2]), se.kstat_name_cleaner.sub('_', kstatkey[3]),
+                        kstatkeyvalue[1]))
+    return records
+
+
+def run_kstat_parser(name, disks, zones, cpus, repeat):
+    """
+    Compares legacy parsing with KstatNameCache on 'kstat -p' dump of disk, device_error and per CPU zone kstats
+    """
+    outputs = generate_outputs(disks, zones, cpus, per_cpu_zone_kstats=True)
+    output = ''.join(outputs[prefix] for prefix in sorted(outputs) if prefix.startswith('kstat '))
+    lines = output.count('\n')
+    print('%s: kstat -p dump of %d lines, %.1f MB' % (name, lines, len(output) / 1048576.0))
+    legacy_records = legacy_kstat_records(output)
+    name_cache = se.KstatNameCache()
+    if list(name_cache.parse(output)) != legacy_records:
+        print('  records of KstatNameCache.parse() differ from legacy parser')
+    for parser_name, parse in [('legacy', legacy_kstat_records),
+                               ('KstatNameCache cold', lambda text: list(se.KstatNameCache().parse(text))),
+                               ('KstatNameCache warm', lambda text: list(name_cache.parse(text)))]:
+        times = []
+        for i in range(repeat):
+            start_time = time.time()
+            parse(output)
+            times.append(time.time() - start_time)
+        times.sort()
+        print('  %-22s %10.1f ms %10.0f ns/line' % (parser_name, times[0] * 1000, times[0] * 1e9 / max(lines, 1)))
+
+
+def setup_exporter(outputs):
+    """
+    Sets globals of solaris_exporter as its __main__ does, commands are replayed from outputs
+    """
+    se.command_runner = ReplayCommandRunner(outputs)
+    se.host_name = 'benchmark'
+    se.zonename = 'global'
+    se.kstat_reader = se.KstatReader(se.KstatCommandBackend())
+    se.disk_index = se.DiskIndex()
+    se.disk_index.disks = se.get_disk_dictionary()
+    se.pset_dictionary = se.get_pset_dictionary()
+
+
+def measure(collector_class, repeat):
+    """
+    Returns dict of results for one collector
+    """
+    collector = collector_class()
+    times = []
+    families = []
+    peak_bytes = None
+    for i in range(repeat):
+        se.command_cache.results.clear()
+        if tracemalloc is not None and i == 0:
+            tracemalloc.start()
+        start_time = time.time()
+        families = list(collector.collect())
+        times.append(time.time() - start_time)
+        if tracemalloc is not None and i == 0:
+            peak_bytes = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+    # the first run is measured with tracemalloc, it is slower
+    if len(times) > 1:
+        times = times[1:]
+    times.sort()
+    registry = CollectorRegistry(auto_describe=False)
+    registry.register(se.MetricFamilies(families))
+    return {
+        'min_ms': times[0] * 1000,
+        'median_ms': times[len(times) // 2] * 1000,
+        'peak_kb': None if peak_bytes is None else peak_bytes / 1024.0,
+        'series': sum(len(family.samples) for family in families),
+        'exposition_bytes': len(generate_latest(registry)),
+    }
+
+
+def run_scale(name, disks, zones, cpus, fixtures, repeat, per_cpu_zone_kstats=False):
+    outputs = generate_outputs(disks, zones, cpus, per_cpu_zone_kstats)
+    outputs.update(fixtures)
+    setup_exporter(outputs)
+    results = {}
+    print('%s: %d disks, %d zones, %d vcpus%s' % (name, disks, zones, cpus,
+                                                  ', recorded: ' + ', '.join(sorted(fixtures)) if fixtures else ''))
+    print('  %-26s %10s %10s %10s %8s %12s' % ('collector', 'min ms', 'median ms', 'peak KB', 'series', 'bytes'))
+    for collector_class in benchmark_collectors:
+        result = measure(collector_class, repeat)
+        results[collector_class.__name__] = result
+        print('  %-26s %10.2f %10.2f %10s %8d %12d' % (
+            collector_class.__name__, result['min_ms'], result['median_ms'],
+            'n/a' if result['peak_kb'] is None else '%.0f' % result['peak_kb'], result['series'],
+            result['exposition_bytes']))
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """
+    Returns list of regressions: (scale, collector, baseline ms, current ms)
+    """
+    regressions = []
+    for scale in sorted(results):
+        for collector in sorted(results[scale]):
+            base = baseline.get(scale, {}).get(collector)
+            if base is None:
+                continue
+            if results[scale][collector]['min_ms'] > base['min_ms'] * (1 + tolerance):
+                regressions.append((scale, collector, base['min_ms'], results[scale][collector]['min_ms']))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline benchmark of solaris_exporter collectors')
+    parser.add_argument('--scale', action='append', choices=sorted(scale_presets),
+                        help='preset of fixtures size, could be repeated, default: all presets')
+    parser.add_argument('--disks', type=int, help='number of disks, overrides --scale')
+    parser.add_argument('--zones', type=int, default=10, help='number of zones, used with --disks')
+    parser.add_argument('--cpus', type=int, default=64, help='number of vCPUs, used with --disks')
+    parser.add_argument('--fixtures', help='directory with recorded command outputs, see FIXTURE_FILES')
+    parser.add_argument('--repeat', type=int, default=5, help='collections of every collector')
+    parser.add_argument('--iostat-gauges', action='store_true', help='enable diskio_iostat_gauges')
+    parser.add_argument('--kstat-parser', action='store_true',
+                        help='compare kstat output parsers instead of collectors')
+    parser.add_argument('--per-cpu-zone-kstats', action='store_true',
+                        help='per CPU zone kstats instead of sys_zone_accum, zones * vcpus kstats')
+    parser.add_argument('--save', help='write results to json file')
+    parser.add_argument('--compare', help='compare results with json file written by --save')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='allowed slowdown against --compare results, 0.25 is 25%%')
+    args = parser.parse_args()
+
+    se.diskio_iostat_gauges = args.iostat_gauges
+    fixtures = read_fixtures(args.fixtures) if args.fixtures else {}
+    if args.disks is not None:
+        scales = [('custom', args.disks, args.zones, args.cpus)]
+    else:
+        scales = [(name,) + scale_presets[name] for name in args.scale or ['small', 'medium', 'large']]
+
+    if args.kstat_parser:
+        for name, disks, zones, cpus in scales:
+            run_kstat_parser(name, disks, zones, cpus, max(args.repeat, 2))
+        return
+
+    results = {}
+    for name, disks, zones, cpus in scales:
+        results[name] = run_scale(name, disks, zones, cpus, fixtures, max(args.repeat, 2), args.per_cpu_zone_kstats)
+
+    if args.save:
+        with open(args.save, 'w') as save_file:
+            json.dump(results, save_file, indent=1, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            regressions = compare(results, json.load(baseline_file), args.tolerance)
+        for scale, collector, base_ms, current_ms in regressions:
+            print('REGRESSION %s %s: %.2f ms -> %.2f ms' % (scale, collector, base_ms, current_ms))
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -4,6 +4,8 @@ profile_name=Prometheus
 
 uid0_commands="
 /usr/sbin/fmadm
+/usr/sbin/fmdump
+/usr/sbin/fmstat
 /usr/sbin/nvmeadm
 /usr/sbin/raidctl
 /usr/sbin/zlogin
@@ -0,0 +1,67 @@
+"""
+Snapshots of BackgroundCollectionScheduler
+"""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import solaris_exporter as se
+
+
+class Flapping(se.BaseCollector):
+    """
+    Collects on the first run, counts error and returns nothing on the next one, as collector of failed command
+    """
+
+    def __init__(self):
+        super(Flapping, self).__init__()
+        self.runs = 0
+
+    def collect_metrics(self):
+        self.runs += 1
+        if self.runs > 1:
+            self.count_error()
+            return
+        family = se.FilteredGaugeMetricFamily('test_flapping', 'test', labels=[])
+        family.add_metric([], 1)
+        yield family
+
+
+class BackgroundCollectionSchedulerTest(unittest.TestCase):
+
+    def setUp(self):
+        se.host_name = 'host'
+
+    def errors(self):
+        return se.REGISTRY.get_sample_value('solaris_exporter_background_collection_errors_total',
+                                            {'collector': 'Flapping'}) or 0
+
+    def test_failed_run_keeps_snapshot(self):
+        collector = Flapping()
+        scheduler = se.BackgroundCollectionScheduler([collector])
+        scheduler._collect_one('Flapping', collector)
+        families, collected_at = scheduler.snapshots['Flapping']
+        errors = self.errors()
+        scheduler._collect_one('Flapping', collector)
+        self.assertEqual(collector.runs, 2)
+        self.assertEqual(self.errors(), errors + 1)
+        self.assertIs(scheduler.snapshots['Flapping'][0], families)
+        self.assertEqual(scheduler.snapshots['Flapping'][1], collected_at)
+        exported = dict((family.name, family) for family in scheduler.collect())
+        self.assertEqual([sample.value for sample in exported['test_flapping'].samples], [1])
+        self.assertEqual([sample.value for sample in
+                          exported['solaris_exporter_collector_last_success_timestamp_seconds'].samples],
+                         [collected_at])
+
+    def test_failed_first_run(self):
+        collector = Flapping()
+        collector.runs = 1
+        scheduler = se.BackgroundCollectionScheduler([collector])
+        scheduler._collect_one('Flapping', collector)
+        self.assertEqual(scheduler.snapshots, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
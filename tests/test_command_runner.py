@@ -0,0 +1,73 @@
+"""
+CommandRunner with stand-in commands
+"""
+import os
+import shutil
+import stat
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import solaris_exporter as se
+
+
+class CommandRunnerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.runner = se.CommandRunner()
+        self.directory = tempfile.mkdtemp()
+        # closes its output, but does not exit
+        self.closing_command = os.path.join(self.directory, 'closing')
+        with open(self.closing_command, 'w') as script:
+            script.write('#!/bin/sh\necho closing\nexec >&-\nsleep 5\n')
+        os.chmod(self.closing_command, stat.S_IRWXU)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_output(self):
+        self.assertEqual(self.runner.run('echo hello', 5), ('hello\n', 0, False))
+
+    def test_return_code(self):
+        self.assertEqual(self.runner.run('false', 5), ('', 1, False))
+
+    def test_not_found(self):
+        self.assertEqual(self.runner.run('/nonexistent/command', 5), ('', 101, False))
+
+    def test_timeout(self):
+        start_time = time.time()
+        self.assertEqual(self.runner.run('sleep 5', 0.3), ('', 100, True))
+        self.assertLess(time.time() - start_time, 2)
+
+    def test_output_closed_before_exit(self):
+        start_time = time.time()
+        self.assertEqual(self.runner.run(self.closing_command, 0.5), ('closing\n', 100, True))
+        self.assertLess(time.time() - start_time, 2)
+        output = self.runner.run_lines(self.closing_command, 0.5)
+        self.assertEqual(list(output), ['closing'])
+        self.assertEqual((output.return_code, output.timeouted), (100, True))
+
+    def test_parallel(self):
+        results = []
+
+        def run(commandline, timeout):
+            results.append((commandline, self.runner.run(commandline, timeout)))
+
+        threads = [threading.Thread(target=run, args=args)
+                   for args in [(self.closing_command, 0.6), (self.closing_command, 0.3), ('echo quick', 5)]]
+        start_time = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertLess(time.time() - start_time, 2)
+        self.assertEqual(sorted(result for commandline, result in results),
+                         [('closing\n', 100, True), ('closing\n', 100, True), ('quick\n', 0, False)])
+
+
+if __name__ == '__main__':
+    unittest.main()
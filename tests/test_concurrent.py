@@ -0,0 +1,71 @@
+"""
+solaris_exporter_collector_success of ConcurrentCollector
+"""
+import os
+import sys
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import solaris_exporter as se
+
+
+class Failing(se.BaseCollector):
+    """
+    Counts error on odd runs, as collector does when its command fails
+    """
+
+    def __init__(self):
+        super(Failing, self).__init__()
+        self.runs = 0
+
+    def collect_metrics(self):
+        self.runs += 1
+        if self.runs % 2:
+            self.count_error()
+            return
+        family = se.FilteredGaugeMetricFamily('test_failing', 'test', labels=[])
+        family.add_metric([], 1)
+        yield family
+
+
+class Working(se.BaseCollector):
+
+    def collect_metrics(self):
+        family = se.FilteredGaugeMetricFamily('test_working', 'test', labels=[])
+        family.add_metric([], 1)
+        yield family
+
+
+class Hung(se.BaseCollector):
+
+    def collect_metrics(self):
+        time.sleep(1)
+        return []
+
+
+class ConcurrentCollectorTest(unittest.TestCase):
+
+    def setUp(self):
+        se.host_name = 'host'
+
+    def success(self, collector):
+        families = list(collector.collect())
+        self.assertEqual(families[-1].name, 'solaris_exporter_collector_success')
+        return dict((sample.labels['collector'], sample.value) for sample in families[-1].samples)
+
+    def test_success(self):
+        collector = se.ConcurrentCollector([Failing(), se.FilteredCollector(Working()), Hung()],
+                                           workers=3, deadline=0.3)
+        self.assertEqual(self.success(collector), {'Failing': 0, 'Working': 1, 'Hung': 0})
+        # errors of the previous run are not counted again
+        self.assertEqual(self.success(collector)['Failing'], 1)
+
+    def test_filtered_failing(self):
+        collector = se.ConcurrentCollector([se.FilteredCollector(Failing())], workers=1, deadline=1)
+        self.assertEqual(self.success(collector), {'Failing': 0})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,41 @@
+"""
+DiskIndex rebuild of the disk dictionary
+"""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import solaris_exporter as se
+
+
+class DiskIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.get_disk_dictionary = se.get_disk_dictionary
+        self.dictionaries = []
+        se.get_disk_dictionary = lambda: self.dictionaries.pop(0)
+        se.kstat_reader = se.KstatReader(se.KstatTextBackend('sd:0:sd0:reads\t1\n'))
+
+    def tearDown(self):
+        se.get_disk_dictionary = self.get_disk_dictionary
+
+    def test_failed_rebuild(self):
+        disks = {'sd0': ['c0t0d0', 'SEAGATE ST300MM0006', '300000000000']}
+        self.dictionaries = [{}, disks, {}]
+        disk_index = se.DiskIndex()
+        # 'iostat -E' failed: nothing is stored, next call retries
+        self.assertFalse(disk_index.refresh_if_changed())
+        self.assertIsNone(disk_index.signature)
+        self.assertTrue(disk_index.refresh_if_changed())
+        self.assertEqual(disk_index.disks, disks)
+        # failed rebuild after expiry keeps the previous dictionary
+        disk_index.refresh_time -= se.disk_index_max_age_sec
+        self.assertFalse(disk_index.refresh_if_changed())
+        self.assertEqual(disk_index.disks, disks)
+        self.assertEqual(self.dictionaries, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+"""
+IostatCalculator against recorded 'kstat -p -c disk' pairs in tests/fixtures.
+Expected values are calculated as iostat -x does: rates and queue lengths divided by snaptime interval,
+service times by number of operations, %w and %b from wtime and rtime.
+"""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import solaris_exporter as se
+
+fixtures = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+def read_fixture(name):
+    with open(os.path.join(fixtures, name)) as fixture:
+        return fixture.read()
+
+
+def disk_counters(output):
+    """
+    {(driver, name): {statistic: value}} from 'kstat -p -c disk' output, as DiskIOCollector makes it
+    """
+    counters = {}
+    for driver, instance, name, statistic, value in se.parse_kstat_output(output):
+        if statistic in se.IostatCalculator.statistics:
+            counters.setdefault((driver, name), {})[statistic] = float(value)
+    return counters
+
+
+def iostat(first, second):
+    calculator = se.IostatCalculator()
+    calculator.update(disk_counters(read_fixture(first)))
+    return dict((device, dict(values))
+                for device, values in calculator.update(disk_counters(read_fixture(second))).items())
+
+
+class IostatCalculatorTest(unittest.TestCase):
+
+    def assertValues(self, values, expected):
+        self.assertEqual(sorted(values), sorted(expected))
+        for statistic in expected:
+            self.assertAlmostEqual(values[statistic], expected[statistic], places=6, msg=statistic)
+
+    def test_busy_disk(self):
+        # 10 seconds: 1000 reads, 500 writes, 10 MB read, 5 MB written, rtime +5 s, wtime +0.2 s,
+        # rlentime +3 s, wlentime +0.5 s
+        values = iostat('kstat_disk_1.txt', 'kstat_disk_2.txt')[('sd', 'sd0')]
+        self.assertValues(values, {
+            'reads_per_sec': 100.0,
+            'writes_per_sec': 50.0,
+            'kbytes_read_per_sec': 1024.0,
+            'kbytes_written_per_sec': 512.0,
+            'wait': 0.05,
+            'actv': 0.3,
+            'wsvc_t_ms': 0.5 / 1500 * 1000,
+            'asvc_t_ms': 2.0,
+            'wait_percent': 2.0,
+            'busy_percent': 50.0,
+        })
+
+    def test_idle_disk(self):
+        values = iostat('kstat_disk_1.txt', 'kstat_disk_2.txt')[('sd', 'sd1')]
+        self.assertEqual(set(values.values()), set([0.0]))
+
+    def test_disks_of_one_sample(self):
+        # sd2 is detached, sd3 is attached between samples
+        self.assertEqual(sorted(iostat('kstat_disk_1.txt', 'kstat_disk_2.txt')), [('sd', 'sd0'), ('sd', 'sd1')])
+
+    def test_first_update(self):
+        calculator = se.IostatCalculator()
+        self.assertEqual(calculator.update(disk_counters(read_fixture('kstat_disk_1.txt'))), {})
+
+    def test_same_snapshot(self):
+        calculator = se.IostatCalculator()
+        calculator.update(disk_counters(read_fixture('kstat_disk_1.txt')))
+        self.assertEqual(calculator.update(disk_counters(read_fixture('kstat_disk_1.txt'))), {})
+
+    def test_reads_wrap(self):
+        # 32-bit reads go from 4294967000 over 2**32 to 200 in 4 seconds, byte counters go on
+        values = iostat('kstat_disk_wrap_1.txt', 'kstat_disk_wrap_2.txt')[('sd', 'sd0')]
+        self.assertValues(values, {
+            'reads_per_sec': 496 / 4.0,
+            'writes_per_sec': 100.0,
+            'kbytes_read_per_sec': 1024.0,
+            'kbytes_written_per_sec': 200.0,
+            'wait': 0.0,
+            'actv': 0.25,
+            'wsvc_t_ms': 0.0,
+            'asvc_t_ms': 1.0 / 896 * 1000,
+            'wait_percent': 0.0,
+            'busy_percent': 50.0,
+        })
+
+    def test_reset(self):
+        # ssd0 is reattached: all counters start again, interval is skipped
+        self.assertNotIn(('ssd', 'ssd0'), iostat('kstat_disk_wrap_1.txt', 'kstat_disk_wrap_2.txt'))
+
+    def test_incomplete_kstat(self):
+        calculator = se.IostatCalculator()
+        first = disk_counters(read_fixture('kstat_disk_1.txt'))
+        second = disk_counters(read_fixture('kstat_disk_2.txt'))
+        calculator.update(first)
+        del second[('sd', 'sd0')]['rlentime']
+        self.assertNotIn(('sd', 'sd0'), calculator.update(second))
+
+
+if __name__ == '__main__':
+    unittest.main()
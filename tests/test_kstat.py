@@ -0,0 +1,80 @@
+"""
+'kstat -p' parsing and KstatCommandBackend reading kstat output while command is running
+"""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import solaris_exporter as se
+
+fixtures = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+class CommandLinesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.runner = se.CommandRunner()
+
+    def test_lines(self):
+        output = self.runner.run_lines('cat ' + os.path.join(fixtures, 'kstat_disk_1.txt'), 5)
+        with open(os.path.join(fixtures, 'kstat_disk_1.txt')) as fixture:
+            self.assertEqual(list(output), fixture.read().splitlines())
+        self.assertEqual((output.return_code, output.timeouted), (0, False))
+
+    def test_last_line_without_end(self):
+        output = self.runner.run_lines('printf a\\nb', 5)
+        self.assertEqual(list(output), ['a', 'b'])
+
+    def test_failed(self):
+        output = self.runner.run_lines('ls /nonexistent', 5)
+        self.assertEqual(list(output), [])
+        self.assertNotEqual(output.return_code, 0)
+        self.assertFalse(output.timeouted)
+
+    def test_not_found(self):
+        output = self.runner.run_lines('/nonexistent/kstat -p', 5)
+        self.assertEqual(list(output), [])
+        self.assertEqual((output.return_code, output.timeouted), (101, False))
+
+    def test_timeout(self):
+        output = self.runner.run_lines('sleep 5', 0.2)
+        self.assertEqual(list(output), [])
+        self.assertEqual((output.return_code, output.timeouted), (100, True))
+
+
+class ReplacedCommandRunner(object):
+    """
+    command_runner with run() only, as replay runner of benchmark
+    """
+
+    def run(self, commandline, timeout):
+        return 'sd:0:sd0:reads\t10\nsd:0:sd0:writes\t5\n', 0, False
+
+
+class KstatCommandBackendTest(unittest.TestCase):
+
+    def setUp(self):
+        self.command_runner = se.command_runner
+
+    def tearDown(self):
+        se.command_runner = self.command_runner
+
+    def test_replaced_command_runner(self):
+        se.command_runner = ReplacedCommandRunner()
+        records, return_code, timeouted = se.KstatCommandBackend().read(['sd:::'], 'disk', 5)
+        self.assertEqual(records, [('sd', '0', 'sd0', 'reads', '10'), ('sd', '0', 'sd0', 'writes', '5')])
+        self.assertEqual((return_code, timeouted), (0, False))
+
+    def test_parse_lines(self):
+        with open(os.path.join(fixtures, 'kstat_disk_1.txt')) as fixture:
+            output = fixture.read()
+        self.assertEqual(list(se.kstat_names.parse_lines(iter(output.splitlines()))),
+                         list(se.kstat_names.parse(output)))
+        self.assertEqual([record[:4] for record in se.kstat_names.parse(output)],
+                         [record[:4] for record in se.parse_kstat_output(output)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+"""
+PerZoneCpuCollector on kernels with and without sys_zone_accum kstats
+"""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import solaris_exporter as se
+
+# per CPU kstats of zone 1 on two CPUs, there are no sys_zone_accum and sys_zone_pset_<pset>_accum kstats
+per_cpu_kstats = '\n'.join([
+    'cpu:0:sys_zone_1:class\tzones',
+    'cpu:0:sys_zone_1:cpu_nsec_user\t3000000000',
+    'cpu:0:sys_zone_1:syscall\t100',
+    'cpu:0:sys_zone_1:zonename\tzone1',
+    'cpu:1:sys_zone_1:class\tzones',
+    'cpu:1:sys_zone_1:cpu_nsec_user\t1000000000',
+    'cpu:1:sys_zone_1:syscall\t50',
+    'cpu:1:sys_zone_1:zonename\tzone1',
+]) + '\n'
+
+
+class NoAccumKstatBackend(object):
+    """
+    'kstat -p' command backend: exits with 1 if nothing is matched
+    """
+
+    def __init__(self, text):
+        self.text_backend = se.KstatTextBackend(text)
+        self.specs = []
+
+    def read(self, specs, ks_class, timeout):
+        self.specs.append(specs)
+        records, return_code, timeouted = self.text_backend.read(specs, ks_class, timeout)
+        if not records:
+            return records, 1, False
+        return records, return_code, timeouted
+
+
+class PerZoneCpuCollectorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.kstat_reader = getattr(se, 'kstat_reader', None)
+        self.backend = NoAccumKstatBackend(per_cpu_kstats)
+        se.kstat_reader = se.KstatReader(self.backend)
+        se.host_name = 'host'
+        se.pset_dictionary = {}
+
+    def tearDown(self):
+        se.kstat_reader = self.kstat_reader
+
+    def usage(self, collector):
+        family = list(collector.collect())[0]
+        return dict(((sample.labels['zone'], sample.labels['statistic'], sample.labels['pset']), sample.value)
+                    for sample in family.samples)
+
+    def test_no_accum_kstats(self):
+        collector = se.PerZoneCpuCollector()
+        usage = self.usage(collector)
+        self.assertFalse(collector.accum_available)
+        self.assertEqual(collector.run_errors, 0)
+        self.assertEqual(usage[('zone1', 'syscall', 'unknown')], 150)
+        self.assertIn(('zone1', 'user', 'unknown'), usage)
+        # accum query is not repeated on next collections
+        del self.backend.specs[:]
+        self.usage(collector)
+        self.assertNotIn([collector.accum_query], self.backend.specs)
+
+
+if __name__ == '__main__':
+    unittest.main()
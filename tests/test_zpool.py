@@ -0,0 +1,126 @@
+"""
+parse_zpool_status against recorded 'zpool status' output in tests/fixtures.
+"""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import solaris_exporter as se
+
+fixtures = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+def read_fixture(name):
+    with open(os.path.join(fixtures, name)) as fixture:
+        return fixture.read()
+
+
+class ParseZpoolStatusTest(unittest.TestCase):
+
+    def setUp(self):
+        self.pools = dict((p['pool'], p) for p in se.parse_zpool_status(read_fixture('zpool_status.txt')))
+
+    def vdevs(self, pool):
+        return dict((vdev[0], vdev[1:]) for vdev in self.pools[pool]['vdevs'])
+
+    def test_pools(self):
+        self.assertEqual([p['pool'] for p in se.parse_zpool_status(read_fixture('zpool_status.txt'))],
+                         ['rpool', 'tank', 'data'])
+        self.assertEqual(dict((name, p['state']) for name, p in self.pools.items()),
+                         {'rpool': 'ONLINE', 'tank': 'DEGRADED', 'data': 'FAULTED'})
+
+    def test_mirror(self):
+        self.assertEqual(self.pools['rpool']['vdevs'], [
+            ('rpool', '', 'ONLINE', 0, 0, 0),
+            ('mirror-0', 'rpool', 'ONLINE', 0, 0, 0),
+            ('c0t0d0s0', 'mirror-0', 'ONLINE', 0, 0, 0),
+            ('c0t1d0s0', 'mirror-0', 'ONLINE', 0, 0, 0),
+        ])
+
+    def test_raidz(self):
+        vdevs = self.vdevs('tank')
+        self.assertEqual(vdevs['raidz1-0'], ('tank', 'DEGRADED', 0, 0, 0))
+        self.assertEqual(vdevs['c0t5000CCA01D1A0002d0'], ('raidz1-0', 'UNAVAIL', 0, 0, 0))
+        self.assertEqual(vdevs['raidz1-1'], ('tank', 'ONLINE', 0, 0, 0))
+        self.assertEqual(vdevs['c0t5000CCA01D1A0005d0'], ('raidz1-1', 'ONLINE', 0, 0, 2))
+
+    def test_logs_cache_spares(self):
+        vdevs = self.vdevs('tank')
+        self.assertEqual(vdevs['mirror-2'], ('logs', 'ONLINE', 0, 0, 0))
+        self.assertEqual(vdevs['c0t5000CCA01D1A0008d0'], ('mirror-2', 'ONLINE', 0, 0, 0))
+        self.assertEqual(vdevs['c0t5000CCA01D1A0009d0'], ('cache', 'ONLINE', 0, 0, 0))
+        # spares have no error counters
+        self.assertEqual(vdevs['c0t5000CCA01D1A000Ad0'], ('spares', 'AVAIL', None, None, None))
+        # section names are not vdevs
+        for section in ['logs', 'cache', 'spares']:
+            self.assertNotIn(section, vdevs)
+        self.assertEqual(len(vdevs), 14)
+
+    def test_faulted(self):
+        vdevs = self.vdevs('data')
+        self.assertEqual(vdevs['data'], ('', 'FAULTED', 0, 0, 1))
+        self.assertEqual(vdevs['c1t0d0'], ('data', 'FAULTED', 12, 0, 0))
+        # suffixed counters
+        self.assertEqual(vdevs['c1t1d0'], ('data', 'ONLINE', 0, 0, 1536))
+
+    def test_scan(self):
+        self.assertEqual([(p['scan'], p['scan_in_progress'], p['scan_percent_done'])
+                          for p in se.parse_zpool_status(read_fixture('zpool_status.txt'))],
+                         [('resilver', False, 100.0), ('scrub', True, 30.0), ('scrub', False, None)])
+
+    def test_errors(self):
+        self.assertEqual(dict((name, p['data_errors']) for name, p in self.pools.items()),
+                         {'rpool': 0, 'tank': 0, 'data': 2})
+
+    def test_faults(self):
+        # lines with FAILED or DEGRADED, as solaris_exporter_zpool_faults always counted them
+        self.assertEqual(dict((name, p['faults']) for name, p in self.pools.items()),
+                         {'rpool': 0, 'tank': 3, 'data': 0})
+
+    def test_no_pools(self):
+        self.assertEqual(se.parse_zpool_status('no pools available\n'), [])
+
+
+class FailingZpoolListRunner(object):
+    """
+    'zpool list' fails, 'zpool status' returns recorded output
+    """
+    def __init__(self):
+        self.commands = []
+
+    def run(self, commandline, timeout):
+        self.commands.append(commandline)
+        if commandline == '/usr/sbin/zpool status':
+            return read_fixture('zpool_status.txt'), 0, False
+        return 'internal error: out of memory\n', 1, False
+
+
+class ZpoolCollectorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.command_runner = se.command_runner
+        se.command_runner = FailingZpoolListRunner()
+        se.host_name = 'host'
+
+    def tearDown(self):
+        se.command_runner = self.command_runner
+
+    def test_zpool_list_failed(self):
+        collector = se.ZpoolCollector()
+        errors = se.REGISTRY.get_sample_value('solaris_exporter_collector_errors_total',
+                                             {'collector': collector.name}) or 0
+        families = dict((family.name, family) for family in collector.collect_metrics())
+        self.assertEqual([sample.value for sample in families['solaris_exporter_zpool_faults'].samples], [3.0])
+        self.assertEqual(len(families['solaris_exporter_zpool_vdev_state'].samples), 21)
+        self.assertEqual(families['solaris_exporter_zpool_space_bytes'].samples, [])
+        self.assertEqual(se.REGISTRY.get_sample_value('solaris_exporter_collector_errors_total',
+                                                      {'collector': collector.name}), errors + 1)
+        # status tree is not read again before zpool_status_refresh_interval_sec
+        list(collector.collect_metrics())
+        self.assertEqual(se.command_runner.commands.count('/usr/sbin/zpool status'), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()